@@ -14,7 +14,10 @@ solver.addObject(falcon9)
 solver.timeRange       = orbitals.TimeRange(orbitals.Units.time.seconds(10000)).withIterations(100000)
 solver.enableTrace     = False
 solver.historyInterval = 50
+solver.addStopCondition(orbitals.StopCondition.collided([falcon9]))
 
+# Расчет с отрисовкой графиков во время расчета - вместо solver.run():
+#orbitals.Renderer(solver).renderLive().run()
 solver.run()
 
 renderer = orbitals.Renderer(solver)
@@ -0,0 +1,52 @@
+﻿# -*- coding: utf-8 -*-
+"""Ошибка и время расчета гравитации алгоритмом Барнса-Хата по сравнению с прямым суммированием.
+   Сценарий - облако обломков на низкой околоземной орбите вокруг статической Земли.
+   Запуск из каталога src/Orbitals: python -m benchmarks.barnesHut
+"""
+import math
+import time
+
+import numpy
+
+import orbitals
+from orbitals.gravity import forceError
+
+def debrisCloud(count, seed = 1):
+    """Координаты и массы: статическая Земля (индекс 0) и count обломков на высотах 300-2000 км"""
+    random   = numpy.random.default_rng(seed)
+    earth    = orbitals.EntityFactory.earth()
+    radius   = earth.radius + random.uniform(300E3, 2000E3, count)
+    angle    = random.uniform(0, 2 * math.pi, count)
+    # Часть обломков сосредоточена в нескольких плотных облаках
+    angle[:count // 2] = random.choice(random.uniform(0, 2 * math.pi, 8), count // 2) + random.normal(0, 0.01, count // 2)
+
+    positions = numpy.zeros((count + 1, 2))
+    positions[1:, 0] = radius * numpy.cos(angle)
+    positions[1:, 1] = radius * numpy.sin(angle)
+    masses    = numpy.concatenate(([earth.mass], random.uniform(1E2, 1E5, count)))
+    fixed     = numpy.zeros(count + 1, dtype = bool)
+    fixed[0]  = True
+    return positions, masses, ~fixed, fixed
+
+def timeOf(action, repeat = 3):
+    """Минимальное время выполнения action, с"""
+    best = float('inf')
+    for i in range(repeat):
+        start = time.perf_counter()
+        action()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+if __name__ == '__main__':
+    for count in (1000, 10000):
+        positions, masses, targets, fixed = debrisCloud(count)
+        direct = orbitals.Gravity.direct()
+        print('N = {0}, прямое суммирование: {1:.3f} с'.format(count, timeOf(lambda: direct.forces(positions, masses, targets, fixed), 1)))
+        for theta in (0.3, 0.5, 0.7, 1.0):
+            model   = orbitals.Gravity.barnesHut(theta)
+            elapsed = timeOf(lambda: model.forces(positions, masses, targets, fixed))
+            # Полная сила (с учетом Земли) и сила взаимного притяжения обломков
+            total   = forceError(model, positions, masses, targets, fixed)
+            mutual  = forceError(model, positions[1:], masses[1:], targets[1:], fixed[1:])
+            print('  theta = {0:.1f}: {1:.3f} с, ошибка полной силы (медиана/99%/макс.) {2:.1e}/{3:.1e}/{4:.1e}, '
+                  'взаимной {5:.1e}/{6:.1e}/{7:.1e}'.format(theta, elapsed, *(total + mutual)))
@@ -0,0 +1,60 @@
+﻿# -*- coding: utf-8 -*-
+"""Проверка продолжения расчета с контрольной точки: расчет, записавший контрольную точку на шаге,
+   и расчет, продолженный с нее (Solver.resume), должны завершиться в одном и том же состоянии -
+   совпадают координаты, скорости, массы, история, состояние объектов и моменты времени результатов.
+   Проверяются оба ядра, постоянный и адаптивный шаг.
+   Запуск из каталога src/Orbitals: python -m benchmarks.checkpointResume
+   При расхождении завершается с кодом 1
+"""
+import os
+import sys
+import tempfile
+
+import orbitals
+from benchmarks.engineEquivalence import debris, adaptiveDebris
+from benchmarks.suite import falcon9
+
+# Сценарии: имя, конструктор Solver, шаг записи контрольной точки
+scenarios = (('falcon9',        falcon9,        700),
+             ('debris',         debris,         700),
+             ('adaptiveDebris', adaptiveDebris, 20))
+
+def state(solver):
+    """Состояние расчета для сравнения: объекты с историей и моменты времени результатов"""
+    objects = [(obj.name, type(obj.controller).__name__, obj.position.x, obj.position.y, obj.velocity.x, obj.velocity.y, obj.mass,
+                obj.positionHistory.ts.tolist(), obj.positionHistory.xs.tolist(), obj.positionHistory.ys.tolist()) for obj in solver.objects]
+    return objects, list(solver.times)
+
+def check(builder, engine, step, path):
+    """Расчет с записью контрольной точки на шаге step и продолжение с нее, True - состояния совпадают"""
+    solver = builder()
+    solver.engine   = engine()
+    solver.quiet    = True
+    solver.profiler = orbitals.Profiler()
+    steps = [0]
+    def stepHook(ctx, seconds):
+        steps[0] += 1
+        if steps[0] == step:
+            solver.checkpoint(path)
+    solver.profiler.addStepHook(stepHook)
+    solver.run()
+
+    resumed = orbitals.Solver()
+    resumed.quiet = True
+    resumed.resume(path)
+    return state(resumed) == state(solver)
+
+if __name__ == '__main__':
+    failures = 0
+    path     = os.path.join(tempfile.mkdtemp(), 'checkpoint.pkl')
+    try:
+        for name, builder, step in scenarios:
+            for engine in (orbitals.Engine.objects, orbitals.Engine.arrays):
+                isEqual = check(builder, engine, step, path)
+                print('{0:16} {1:8} {2}'.format(name, engine.__name__, 'совпадает' if isEqual else 'РАСХОЖДЕНИЕ'))
+                failures += not isEqual
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
+        os.rmdir(os.path.dirname(path))
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,91 @@
+﻿# -*- coding: utf-8 -*-
+"""Проверка согласованности ядер: один и тот же сценарий рассчитывается ядрами Engine.objects()
+   и Engine.arrays(), сравниваются конечные координаты и скорости, состояние объектов (столкновения,
+   выход из области расчета) и число точек истории. Ядра суммируют силы в разном порядке,
+   поэтому координаты сравниваются с относительной точностью tolerance.
+   Запуск из каталога src/Orbitals: python -m benchmarks.engineEquivalence
+   При расхождении завершается с кодом 1
+"""
+import math
+import sys
+
+import numpy
+
+import orbitals
+from benchmarks.suite import execute, falcon9, protonM, earthMoon
+from orbitals.gravity import G
+
+tolerance = 1E-6 # Допустимое относительное расхождение координат и скоростей
+
+def debris(count = 30, seed = 1):
+    """Обломки на низких орбитах с разбросом скоростей: часть сталкивается с Землей, часть друг с другом"""
+    random = numpy.random.default_rng(seed)
+    earth  = orbitals.EntityFactory.earth()
+    solver = orbitals.Solver()
+    solver.addObject(earth)
+    radius = earth.radius + random.uniform(100E3, 300E3, count)
+    angle  = random.uniform(0, 2 * math.pi, count)
+    speed  = numpy.sqrt(G * earth.mass / radius) * random.uniform(0.7, 1.2, count)
+    for i in range(count):
+        obj = orbitals.SpaceObject('D{0}'.format(i), 1E3 + i, 1E3)
+        obj.position = orbitals.Vector(radius[i] * math.cos(angle[i]), radius[i] * math.sin(angle[i]))
+        obj.velocity = orbitals.Vector(-speed[i] * math.sin(angle[i]), speed[i] * math.cos(angle[i]))
+        solver.addObject(obj)
+    solver.timeRange       = orbitals.TimeRange(3000.).withIterations(3000)
+    solver.historyInterval = 10
+    solver.enableTrace     = False
+    solver.escapeRadius    = 5E7
+    return solver
+
+def adaptiveDebris():
+    """То же, что debris(), с адаптивным шагом"""
+    solver = debris()
+    solver.timeRange = orbitals.TimeRange(3000.).withIterations(300).withTolerance(1E-8, 1E-3)
+    return solver
+
+# Сценарии: имя, конструктор Solver
+scenarios = (('falcon9',        falcon9),
+             ('protonM',        protonM),
+             ('earthMoon',      earthMoon),
+             ('debris',         debris),
+             ('adaptiveDebris', adaptiveDebris))
+
+def state(solver):
+    """Состояние объектов по завершении расчета: имя, тип контроллера, координаты и скорость, число точек истории"""
+    return [(obj.name, type(obj.controller).__name__, numpy.array((obj.position.x, obj.position.y, obj.velocity.x, obj.velocity.y)),
+             len(obj.positionHistory)) for obj in solver.objects]
+
+def differences(objectsState, arraysState):
+    """Расхождения состояний, рассчитанных ядрами, - список строк"""
+    result = []
+    for (name, controller, values, samples), (otherName, otherController, otherValues, otherSamples) in zip(objectsState, arraysState):
+        if controller != otherController:
+            result.append('{0}: {1} / {2}'.format(name, controller, otherController))
+        if samples != otherSamples:
+            result.append('{0}: точек истории {1} / {2}'.format(name, samples, otherSamples))
+        # Координаты и скорости сравниваются относительно их модуля
+        for k, scale in ((0, numpy.hypot(*values[:2])), (2, numpy.hypot(*values[2:]))):
+            error = numpy.hypot(*(values[k:k + 2] - otherValues[k:k + 2])) / max(scale, 1.)
+            if error > tolerance:
+                result.append('{0}: {1} {2:.1e}'.format(name, 'координаты' if k == 0 else 'скорость', error))
+    return result
+
+def check(builder):
+    """Расчет сценария обоими ядрами, возвращает список расхождений"""
+    states = []
+    for engine in (orbitals.Engine.objects, orbitals.Engine.arrays):
+        solver = builder()
+        solver.engine = engine()
+        execute(solver)
+        states.append(state(solver))
+    return differences(*states)
+
+if __name__ == '__main__':
+    failures = 0
+    for name, builder in scenarios:
+        result = check(builder)
+        print('{0:16} {1}'.format(name, 'расхождений нет' if not result else 'РАСХОЖДЕНИЯ: {0}'.format(len(result))))
+        for line in result:
+            print('    ' + line)
+        failures += len(result) > 0
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,245 @@
+﻿# -*- coding: utf-8 -*-
+"""Эталонные сценарии для отслеживания производительности вычислителя.
+   Для каждого сценария измеряются число шагов расчета в секунду, пиковый объем памяти (tracemalloc,
+   отдельный расчет), объем истории на точку и относительный дрейф полной энергии (только для
+   консервативных сценариев - без двигателей и столкновений).
+   Запуск из каталога src/Orbitals:
+       python -m benchmarks.suite run -o baseline.json [-s cloud100 cloud1000] [-r 3]
+       python -m benchmarks.suite compare baseline.json current.json [-t 0.1]
+   compare отмечает показатели, ухудшившиеся больше чем на долю threshold, и завершается с кодом 1
+"""
+import argparse
+import json
+import math
+import platform
+import sys
+import time
+import tracemalloc
+
+import numpy
+
+import orbitals
+from orbitals.gravity import G
+
+formatVersion = 1     # Версия формата файла результатов
+driftFloor    = 1E-12 # Дрейф энергии ниже этого значения считается ошибкой округления
+
+# Показатели результатов: имя, True - лучше большее значение
+metrics = (('stepsPerSecond', True), ('peakMemory', False), ('historyBytesPerSample', False), ('energyDrift', False))
+
+def falcon9():
+    """Запуск Falcon 9 с поверхности Земли до высоты 250 км"""
+    earth   = orbitals.EntityFactory.earth()
+    falcon9 = orbitals.EntityFactory.falcon9()
+    falcon9.position = orbitals.Vector(0, earth.radius + orbitals.Units.dimension.m(100))
+
+    solver = orbitals.Solver()
+    solver.addObject(earth)
+    solver.addObject(falcon9)
+    solver.timeRange       = orbitals.TimeRange(orbitals.Units.time.seconds(2000)).withIterations(20000)
+    solver.historyInterval = 10
+    solver.enableTrace     = False
+    solver.addStopCondition(orbitals.StopCondition.altitude(falcon9, earth, above = orbitals.Units.dimension.km(250)))
+    return solver
+
+def protonM():
+    """Выведение Протон-М: работа трех ступеней (ступень 2 до грав. маневра - вертикально)"""
+    earth   = orbitals.EntityFactory.earth()
+    protonM = orbitals.EntityFactory.protonM(turnAngle = 90)
+    # Радиус корабля в модели велик - старт над поверхностью на расстоянии радиуса корабля
+    protonM.position = orbitals.Vector(0, earth.radius + protonM.radius + orbitals.Units.dimension.km(1))
+
+    solver = orbitals.Solver()
+    solver.addObject(earth)
+    solver.addObject(protonM)
+    solver.timeRange       = orbitals.TimeRange(orbitals.Units.time.seconds(600)).withIterations(6000)
+    solver.historyInterval = 10
+    solver.enableTrace     = False
+    return solver
+
+def earthMoon():
+    """Система Земля - Луна: 30 суток с шагом 1 мин"""
+    solver = orbitals.Solver()
+    solver.addObject(orbitals.EntityFactory.earth())
+    solver.addObject(orbitals.EntityFactory.moon())
+    solver.timeRange       = orbitals.TimeRange(orbitals.Units.time.seconds(30 * 86400)).withIterations(43200)
+    solver.historyInterval = 60
+    solver.enableTrace     = False
+    solver.integrator      = orbitals.Integrator.leapfrog()
+    return solver
+
+def cloud(count, iterations, gravity = None, seed = 1):
+    """Облако count обломков на круговых орбитах высотой 300-2000 км вокруг статической Земли.
+       Обломки притягивают друг друга (порог источников 0), gravity - алгоритм гравитации
+       (по умолчанию - прямое суммирование)
+    """
+    random = numpy.random.default_rng(seed)
+    earth  = orbitals.EntityFactory.earth()
+    solver = orbitals.Solver()
+    solver.addObject(earth)
+    radius = earth.radius + random.uniform(300E3, 2000E3, count)
+    angle  = random.uniform(0, 2 * math.pi, count)
+    speed  = numpy.sqrt(G * earth.mass / radius)
+    masses = random.uniform(1E2, 1E5, count)
+    for i in range(count):
+        debris = orbitals.SpaceObject('D{0}'.format(i), masses[i], 1.)
+        debris.position = orbitals.Vector(radius[i] * math.cos(angle[i]), radius[i] * math.sin(angle[i]))
+        debris.velocity = orbitals.Vector(-speed[i] * math.sin(angle[i]), speed[i] * math.cos(angle[i]))
+        solver.addObject(debris)
+    solver.timeRange       = orbitals.TimeRange(iterations * 10.).withIterations(iterations)
+    solver.historyInterval = 10
+    solver.enableTrace     = False
+    solver.engine          = orbitals.Engine.arrays()
+    solver.integrator      = orbitals.Integrator.leapfrog()
+    solver.gravity         = orbitals.Gravity.direct(sourceThreshold = 0) if gravity is None else gravity
+    return solver
+
+def barnesHut():
+    """Алгоритм Барнса-Хата для облаков обломков (все обломки - источники гравитации)"""
+    return orbitals.Gravity.barnesHut(0.5, sourceThreshold = 0)
+
+# Сценарии: имя, конструктор Solver, консервативный ли сценарий (проверяется дрейф энергии)
+scenarios = (('falcon9',      falcon9,                                     False),
+             ('protonM',      protonM,                                     False),
+             ('earthMoon',    earthMoon,                                   True),
+             ('cloud10',      lambda: cloud(10, 5000),                     True),
+             ('cloud100',     lambda: cloud(100, 1000),                    True),
+             ('cloud1000',    lambda: cloud(1000, 100),                    True),
+             ('cloudBH1000',  lambda: cloud(1000, 100, barnesHut()),       True),
+             ('cloudBH10000', lambda: cloud(10000, 10, barnesHut()),       True))
+
+def energy(solver):
+    """Полная энергия объектов, участвующих в расчете, с учетом только притяжения источников гравитации"""
+    objects    = [obj for obj in solver.objects if obj.controller.isActive]
+    positions  = numpy.array([(obj.position.x, obj.position.y) for obj in objects])
+    velocities = numpy.array([(obj.velocity.x, obj.velocity.y) for obj in objects])
+    masses     = numpy.array([obj.mass for obj in objects])
+    kinetic    = 0.5 * numpy.sum(masses * numpy.sum(velocities**2, axis = 1))
+
+    sources  = solver.gravity.sources(objects)
+    isSource = numpy.ones(len(objects), dtype = bool) if sources is None else sources
+    # Пары источник - объект, пары источников учитываются один раз (по строкам - без матрицы N x N)
+    potential = 0.
+    for i in numpy.nonzero(isSource)[0]:
+        pairs         = ~isSource
+        pairs[i + 1:] = True
+        pairs[i]      = False
+        distances     = numpy.hypot(*(positions[pairs] - positions[i]).T)
+        potential -= G * masses[i] * numpy.sum(masses[pairs] / distances)
+    return kinetic + potential
+
+def execute(solver):
+    """Расчет без вывода на консоль, возвращает число выполненных шагов"""
+    solver.quiet = True
+    for snapshot in solver.iterate(every = sys.maxsize):
+        pass
+    return snapshot.iteration
+
+def measure(builder, isConservative, repeat = 1):
+    """Показатели сценария: лучшее из repeat время расчета, память - в отдельном расчете под tracemalloc"""
+    elapsed = float('inf')
+    for i in range(repeat):
+        solver  = builder()
+        initial = energy(solver) if isConservative else None
+        start   = time.perf_counter()
+        steps   = execute(solver)
+        elapsed = min(elapsed, time.perf_counter() - start)
+
+    # Память, зарезервированная под незаписанные точки, в объем истории не входит
+    for obj in solver.objects:
+        obj.trimHistory()
+    samples = sum(len(obj.positionHistory) for obj in solver.objects)
+    result  = {
+        'steps':                 steps,
+        'elapsed':               elapsed,
+        'stepsPerSecond':        steps / elapsed,
+        'historyBytesPerSample': sum(obj.historyBytes for obj in solver.objects) / max(1, samples),
+        'energyDrift':           abs(energy(solver) / initial - 1.) if isConservative else None,
+        'stopReason':            solver.stopReason
+    }
+
+    tracemalloc.start()
+    try:
+        execute(builder())
+        result['peakMemory'] = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return result
+
+def run(names = None, repeat = 1):
+    """Выполнить сценарии names (None - все), возвращает результаты для записи в JSON"""
+    known = [name for name, builder, isConservative in scenarios]
+    for name in names or ():
+        if name not in known:
+            raise Exception('Unknown benchmark scenario "{0}"'.format(name))
+
+    results = {}
+    for name, builder, isConservative in scenarios:
+        if names and name not in names:
+            continue
+        results[name] = measure(builder, isConservative, repeat)
+        report(name, results[name])
+    return {
+        'version':   formatVersion,
+        'created':   time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'machine':   platform.platform(),
+        'python':    platform.python_version(),
+        'numpy':     numpy.__version__,
+        'scenarios': results
+    }
+
+def report(name, result):
+    """Вывод показателей сценария"""
+    drift = '-' if result['energyDrift'] is None else '{0:.2e}'.format(result['energyDrift'])
+    print('{0:14} {1:8d} шагов {2:10.1f} шаг/с   память {3:8.1f} МБ   история {4:6.1f} Б/точку   дрейф энергии {5}'.format(
+          name, result['steps'], result['stepsPerSecond'], result['peakMemory'] / 2**20, result['historyBytesPerSample'], drift))
+
+def compare(baseline, current, threshold = 0.1):
+    """Сравнение результатов current с baseline, возвращает список регрессий (сценарий, показатель, было, стало)"""
+    regressions = []
+    for name, base in baseline['scenarios'].items():
+        result = current['scenarios'].get(name)
+        if result is None:
+            print('{0:14} нет в новых результатах'.format(name))
+            continue
+        for metric, isHigherBetter in metrics:
+            before, after = base.get(metric), result.get(metric)
+            if before is None or after is None:
+                continue
+            change = after / before - 1. if before != 0 else 0.
+            if isHigherBetter:
+                isRegression = after < before * (1. - threshold)
+            else:
+                isRegression = after > before * (1. + threshold) and not (metric == 'energyDrift' and after < driftFloor)
+            if isRegression:
+                regressions.append((name, metric, before, after))
+            print('{0:14} {1:22} {2:12.4g} {3:12.4g} {4:+8.1%} {5}'.format(name, metric, before, after, change, '<< регрессия' if isRegression else ''))
+    return regressions
+
+if __name__ == '__main__':
+    parser   = argparse.ArgumentParser(description = 'Эталонные сценарии вычислителя')
+    commands = parser.add_subparsers(dest = 'command', required = True)
+    runner   = commands.add_parser('run', help = 'выполнить сценарии')
+    runner.add_argument('-o', '--output', help = 'файл результатов JSON')
+    runner.add_argument('-s', '--scenarios', nargs = '*', help = 'имена сценариев (по умолчанию - все)')
+    runner.add_argument('-r', '--repeat', type = int, default = 1, help = 'число повторов замера времени')
+    checker  = commands.add_parser('compare', help = 'сравнить результаты с эталоном')
+    checker.add_argument('baseline', help = 'эталонные результаты JSON')
+    checker.add_argument('current', help = 'новые результаты JSON')
+    checker.add_argument('-t', '--threshold', type = float, default = 0.1, help = 'допустимое ухудшение (доля)')
+    arguments = parser.parse_args()
+
+    if arguments.command == 'run':
+        results = run(arguments.scenarios, arguments.repeat)
+        if arguments.output:
+            with open(arguments.output, 'w', encoding = 'utf-8') as file:
+                json.dump(results, file, indent = 2)
+    else:
+        with open(arguments.baseline, encoding = 'utf-8') as file:
+            baseline = json.load(file)
+        with open(arguments.current, encoding = 'utf-8') as file:
+            current = json.load(file)
+        regressions = compare(baseline, current, arguments.threshold)
+        if regressions:
+            print('Регрессии: {0}'.format(len(regressions)))
+            sys.exit(1)
@@ -0,0 +1,68 @@
+﻿# -*- coding: utf-8 -*-
+"""Микробенчмарк: число создаваемых объектов Vector на шаг расчета.
+   Запуск из каталога src/Orbitals: python -m benchmarks.vectorAllocations
+"""
+import time
+
+import orbitals
+
+iterations = 2000
+
+class VectorCounter:
+    """Счетчик вызовов конструктора Vector"""
+    def __init__(self):
+        self._count = 0
+        self._init  = None
+
+    @property
+    def count(self):
+        return self._count
+
+    def __enter__(self):
+        self._init = orbitals.Vector.__init__
+        init = self._init
+        def countingInit(vector, x, y):
+            self._count = self._count + 1
+            init(vector, x, y)
+        orbitals.Vector.__init__ = countingInit
+        return self
+
+    def __exit__(self, *args):
+        orbitals.Vector.__init__ = self._init
+
+def scenario():
+    """Запуск Falcon 9 с поверхности Земли, двигатель первой ступени включен"""
+    earth   = orbitals.EntityFactory.earth()
+    falcon9 = orbitals.EntityFactory.falcon9()
+    falcon9.position = orbitals.Vector(0, earth.radius + orbitals.Units.dimension.m(100))
+
+    solver = orbitals.Solver()
+    solver.addObject(earth)
+    solver.addObject(falcon9)
+    solver.timeRange       = orbitals.TimeRange(orbitals.Units.time.seconds(20)).withIterations(iterations)
+    solver.enableTrace     = False
+    solver.historyInterval = iterations
+    return solver
+
+def run(solver):
+    """Расчет без вывода на консоль, возвращает время на шаг"""
+    solver.quiet = True
+    start = time.perf_counter()
+    solver.run()
+    return (time.perf_counter() - start) / iterations
+
+def measure(integrator):
+    """Число созданных Vector и время на шаг расчета"""
+    solver = scenario()
+    solver.integrator = integrator
+    with VectorCounter() as counter:
+        run(solver)
+
+    solver = scenario()
+    solver.integrator = integrator
+    return counter.count / iterations, run(solver)
+
+if __name__ == '__main__':
+    for name in ('euler', 'leapfrog'):
+        vectors, elapsed = measure(getattr(orbitals.Integrator, name)())
+        print('{0:10} Vector на шаг: {1:6.1f}   мкс на шаг: {2:6.1f}'.format(name, vectors, elapsed * 1E6))
\ No newline at end of file
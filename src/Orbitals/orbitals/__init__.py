@@ -1,7 +1,16 @@
 ﻿# -*- coding: utf-8 -*-
 import orbitals.basicTypes as basicTypes
 import orbitals.types      as types
+import orbitals.history    as history
+import orbitals.gravity    as gravity
+import orbitals.engine     as engine
+import orbitals.integrators as integrators
+import orbitals.kepler     as kepler
+import orbitals.profiler   as profiler
 import orbitals.solver     as solver
+import orbitals.conditions as conditions
+import orbitals.sweep      as sweep
+import orbitals.ensemble   as ensemble
 import orbitals.renderer   as renderer
 import orbitals.entities   as entities
 import orbitals.units      as units
@@ -14,6 +23,16 @@ SpaceShip           = types.SpaceShip
 ControlEvent        = types.SpaceShipControlEventFactory
 TimeRange           = solver.TimeRange
 Solver              = solver.Solver
+LogSink             = solver.LogSinkFactory
+StopCondition       = conditions.StopConditionFactory
+HistoryStorage      = history.HistoryStorageFactory
+Profiler            = profiler.SolverProfiler
+Sweep               = sweep.Sweep
+EnsembleSolver      = ensemble.EnsembleSolver
+Engine              = engine.EngineFactory
+Gravity             = gravity.GravityFactory
+Integrator          = integrators.IntegratorFactory
+KeplerCoast         = kepler.KeplerCoast
 Renderer            = renderer.Renderer
 EntityFactory       = entities.EntityFactory
 Units               = units.factory
\ No newline at end of file
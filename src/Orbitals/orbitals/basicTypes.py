@@ -1,8 +1,28 @@
 ﻿# -*- coding: utf-8 -*-
 import math
+import numpy
+
+from orbitals.downsampling import plotSeries
+from orbitals.downsampling import plotCurve
+
+def rotateXY(x, y, axisX, axisY):
+    """Поворот вектора (x, y) на угол оси (axisX, axisY) относительно OX, без тригонометрических функций.
+       Нулевая ось соответствует нулевому углу
+    """
+    length = math.sqrt(axisX*axisX + axisY*axisY)
+    if length == 0:
+        return x, y
+    c = axisX / length
+    s = axisY / length
+    return x * c - y * s, x * s + y * c
 
 class Vector:
-    """2D вектор"""
+    """2D вектор.
+       Операторы возвращают новый вектор, методы set/iadd/isub/imul/axpy изменяют вектор на месте
+       и предназначены для внутренних вычислений над векторами, которыми владеет вызывающий код
+    """
+    __slots__ = ('_x', '_y')
+
     def __init__(self, x, y):
         self._x = x
         self._y = y
@@ -58,6 +78,41 @@ class Vector:
     def __div__(self, k):
         """Оператор / - деление на константу"""
         return Vector(self.x / k, self.y / k)
+    __truediv__ = __div__
+
+    def set(self, x, y):
+        """Задать координаты вектора на месте"""
+        self._x = x
+        self._y = y
+        return self
+
+    def iadd(self, v):
+        """Прибавить вектор v на месте"""
+        self._x = self._x + v._x
+        self._y = self._y + v._y
+        return self
+
+    def isub(self, v):
+        """Вычесть вектор v на месте"""
+        self._x = self._x - v._x
+        self._y = self._y - v._y
+        return self
+
+    def imul(self, k):
+        """Умножить на константу на месте"""
+        self._x = self._x * k
+        self._y = self._y * k
+        return self
+
+    def axpy(self, k, v):
+        """Прибавить вектор v, умноженный на константу k, на месте (self += v * k)"""
+        self._x = self._x + v._x * k
+        self._y = self._y + v._y * k
+        return self
+
+    def copy(self):
+        """Копия вектора"""
+        return Vector(self._x, self._y)
 
     def __str__(self):
         """Преобразование в строку"""
@@ -79,9 +134,7 @@ class Vector:
 
     def rotate(self, axis):
         """Повернуть вектор относительно оси OX'"""
-        radius = self.length
-        angle = axis.angle + self.angle
-        return Vector(radius * math.cos(angle), radius * math.sin(angle))
+        return Vector(*rotateXY(self._x, self._y, axis._x, axis._y))
 
     def toStr(self, format = 'c'):
         if format == 'c':
@@ -104,70 +157,237 @@ Vector.unitX = Vector(1, 0)
 Vector.unitY = Vector(0, 1)
 
 class VectorHistory:
-    """История изменений значений вектора"""
+    """История изменений значений вектора.
+       Значения хранятся в предварительно выделенных массивах numpy (float64),
+       при заполнении емкость массивов удваивается.
+       Если подключены файлы истории (attach), в памяти хранится только блок последних значений,
+       заполненный блок дописывается в файлы, а чтение выполняется через numpy.memmap
+    """
 
-    def __init__(self, ownerName, parameterName):
+    def __init__(self, ownerName, parameterName, capacity = 0):
         self._ownerName = ownerName         # Название объекта, которому принадлежит величина
         self._parameterName = parameterName # Название величины
-        self._ts = []                       # Время
-        self._xs = []                       # Значения X
-        self._ys = []                       # Значения Y
-        self._rs = []                       # Значения модуля
-        self._counter = 0
+        self._ts = numpy.empty(capacity)    # Время
+        self._xs = numpy.empty(capacity)    # Значения X
+        self._ys = numpy.empty(capacity)    # Значения Y
+        self._rs = None                     # Значения модуля (вычисляются по запросу)
+        self._counter = 0                   # Число записанных значений
+        self._base = 0                      # Число значений, записанных в файлы (не хранятся в массивах)
+        self._columns = None                # Файлы истории (None - история хранится в памяти)
+        self._storage = None                # Подключенное хранилище истории
+
+    def __len__(self):
+        """Число записанных значений"""
+        return self._counter
+
+    def __getstate__(self):
+        """Состояние для pickle - сохраняются только записанные значения,
+           для истории в файлах - только число значений в файлах
+        """
+        self.flush()
+        state = dict(self.__dict__)
+        for name in ('_ts', '_xs', '_ys'):
+            state[name] = state[name][:self._counter - self._base].copy()
+        state['_rs'] = None
+        state['_chunkSize'] = len(self._ts)
+        return state
+
+    def __setstate__(self, state):
+        """Восстановление из pickle. Значения в файлах, записанные после сохранения, отбрасываются"""
+        chunkSize = state.pop('_chunkSize', 0)
+        self.__dict__.update(state)
+        if self._columns is not None:
+            self._columns.truncate(self._base)
+            self.attachColumns(self._columns, chunkSize)
+
+    @property
+    def capacity(self):
+        """Емкость выделенных массивов"""
+        return len(self._ts)
+
+    @property
+    def nbytes(self):
+        """Объем памяти, выделенной под историю, байт"""
+        return self._ts.nbytes + self._xs.nbytes + self._ys.nbytes
+
+    @property
+    def ts(self):
+        """Время (представление массива без копирования)"""
+        return self._values(0)
+
+    @property
+    def xs(self):
+        """Значения X (представление массива без копирования)"""
+        return self._values(1)
+
+    @property
+    def ys(self):
+        """Значения Y (представление массива без копирования)"""
+        return self._values(2)
+
+    def _values(self, column):
+        """Записанные значения столбца column (0 - время, 1 - X, 2 - Y)"""
+        if self._columns is None:
+            return (self._ts, self._xs, self._ys)[column][:self._counter]
+        self.flush()
+        return self._columns.columns()[column]
+
+    @property
+    def rs(self):
+        """Значения модуля"""
+        if self._rs is None or len(self._rs) != self._counter:
+            self._rs = numpy.hypot(self.xs, self.ys)
+        return self._rs
+
+    def attach(self, storage):
+        """Подключить хранилище истории storage (HistoryStorage).
+           Записанные ранее значения переносятся в хранилище
+        """
+        if storage is self._storage:
+            return
+        self._storage = storage
+        columns = storage.open(self._ownerName, self._parameterName)
+        if columns is None and self._columns is None:
+            return
+        ts, xs, ys = self.ts, self.xs, self.ys
+        if columns is None:
+            self._ts, self._xs, self._ys = numpy.array(ts), numpy.array(xs), numpy.array(ys)
+            self._columns = None
+            self._base    = 0
+        else:
+            columns.append(ts, xs, ys)
+            self.attachColumns(columns, storage.chunkSize)
+
+    def attachColumns(self, columns, chunkSize):
+        """Хранить историю в файлах columns, в памяти - блок из chunkSize последних значений"""
+        self._columns = columns
+        self._counter = len(columns)
+        self._base    = len(columns)
+        self._ts      = numpy.empty(chunkSize)
+        self._xs      = numpy.empty(chunkSize)
+        self._ys      = numpy.empty(chunkSize)
+        self._rs      = None
+
+    def flush(self):
+        """Дописать блок значений из памяти в файлы истории"""
+        count = self._counter - self._base
+        if self._columns is not None and count > 0:
+            self._columns.append(self._ts[:count], self._xs[:count], self._ys[:count])
+            self._base = self._counter
+
+    def reserve(self, count):
+        """Выделить память под count новых значений (для истории в файлах - не требуется)"""
+        required = self._counter + count
+        if self._columns is None and required > self.capacity:
+            self._resize(required)
+
+    def trim(self):
+        """Освободить память, выделенную под незаписанные значения (история завершена).
+           Для истории в файлах блок значений из памяти дописывается в файлы
+        """
+        if self._columns is None:
+            if self._counter < self.capacity:
+                self._resize(self._counter)
+        else:
+            self.flush()
+
+    def _resize(self, capacity):
+        """Изменить емкость массивов"""
+        for name in ('_ts', '_xs', '_ys'):
+            array = numpy.empty(capacity)
+            array[:self._counter] = getattr(self, name)[:self._counter]
+            setattr(self, name, array)
 
     def put(self, t, v):
         """Записать значение v в момент времени t"""
-        self._ts.append(t)
-        self._xs.append(v.x)
-        self._ys.append(v.y)
-        self._rs.append(v.length)
+        self.putXY(t, v.x, v.y)
+
+    def extend(self, ts, xs, ys):
+        """Записать массивы значений (xs, ys) в моменты времени ts"""
+        if self._columns is not None:
+            self.flush()
+            self._columns.append(ts, xs, ys)
+            self._counter = self._base = len(self._columns)
+            return
+        begin = self._counter
+        self.reserve(len(ts))
+        end = begin + len(ts)
+        self._ts[begin:end] = ts
+        self._xs[begin:end] = xs
+        self._ys[begin:end] = ys
+        self._counter = end
+
+    def putXY(self, t, x, y):
+        """Записать значение (x, y) в момент времени t"""
+        i = self._counter - self._base
+        if i == len(self._ts):
+            if self._columns is None:
+                self._resize(max(16, 2 * i))
+            else:
+                self.flush()
+                i = 0
+        self._ts[i] = t
+        self._xs[i] = x
+        self._ys[i] = y
+        self._counter = self._counter + 1
 
     def plot(self, plot):
-        """Вывести историю на график"""
-        plot.plot(self._ts, self._xs, '--', label = ('{0}/{1}x'.format(self._ownerName, self._parameterName)))
-        plot.plot(self._ts, self._ys, '--', label = ('{0}/{1}y'.format(self._ownerName, self._parameterName)))
-        plot.plot(self._ts, self._rs, '-',   label = ('{0}/|{1}|'.format(self._ownerName, self._parameterName)))
+        """Вывести историю на график (с прореживанием до ширины осей в пикселях)"""
+        xs, ys = self.xs, self.ys
+        plotSeries(plot, self.ts, lambda indices: numpy.asarray(xs[indices]), lambda first, last: (xs[first:last],), '--',
+                   label = ('{0}/{1}x'.format(self._ownerName, self._parameterName)))
+        plotSeries(plot, self.ts, lambda indices: numpy.asarray(ys[indices]), lambda first, last: (ys[first:last],), '--',
+                   label = ('{0}/{1}y'.format(self._ownerName, self._parameterName)))
+        plotSeries(plot, self.ts, lambda indices: numpy.hypot(xs[indices], ys[indices]), lambda first, last: (numpy.hypot(xs[first:last], ys[first:last]),), '-',
+                   label = ('{0}/|{1}|'.format(self._ownerName, self._parameterName)))
         
     def trajectory(self, plot, index = None):
-        """Вывести траекторию на график"""
+        """Вывести траекторию на график (с прореживанием до ширины осей в пикселях)"""
         if index == None:
-            return plot.plot(self._xs, self._ys, '-', label = self._ownerName,linewidth = 2)
+            return [plotCurve(plot, self.xs, self.ys, '-', label = self._ownerName,linewidth = 2)]
         else:
-            indices = range(int(index)) 
-            xs = [self._xs[i] for i in indices]
-            ys = [self._ys[i] for i in indices]
-            return plot.plot(xs, ys, '-',  color = 'r', linewidth = 2)
+            return [plotCurve(plot, self.xs, self.ys, '-', int(index), color = 'r', linewidth = 2)]
 
     def quiver(self,  vectors, plot, index  = None, step = 1):
         """Вывести на график поле векторов, используея self как XY и vectors как UV"""
-        if index == None and step == 1:
-            plot.quiver(self._xs, self._ys, vectors._xs, vectors._ys)
-        else:
-            if index == None:
-                index = 0
-            x, y, u, v = [], [], [], []
-            for i in range(len(self._ts)):
-                if i >= index and divmod(i, step)[1] == 0:
-                    x.append(self._xs[i])
-                    y.append(self._ys[i])
-                    u.append(vectors._xs[i])
-                    v.append(vectors._ys[i])
-            plot.quiver(x, y, u, v)
+        if index == None:
+            index = 0
+        # Первый индекс, кратный step, не меньший index
+        start = -(-int(index) // step) * step
+        plot.quiver(self.xs[start::step], self.ys[start::step], vectors.xs[start::step], vectors.ys[start::step])
 
 class VectorWithHistory:
-    """Вектор с историей изменений"""
+    """Вектор с историей изменений.
+       Внутренние вычисления изменяют значение на месте (mutable()), если ссылка на него
+       не передавалась наружу через value - иначе значение предварительно копируется
+    """
     
     def __init__(self, ownerName, parameterName):
-         self._value  = Vector.zero
-         self._history = VectorHistory(ownerName, parameterName)
+         self._value    = Vector.zero
+         self._isShared = True # Ссылка на значение могла быть сохранена вне объекта
+         self._history  = VectorHistory(ownerName, parameterName)
 
     @property
     def value(self):
         """Текущее значение"""
+        self._isShared = True
         return self._value;
     @value.setter
     def value(self, value):
-        self._value = value;
+        self._value    = value;
+        self._isShared = True
+
+    @property
+    def current(self):
+        """Текущее значение для чтения во внутренних вычислениях (ссылку нельзя сохранять)"""
+        return self._value
+
+    def mutable(self):
+        """Текущее значение для изменения на месте"""
+        if self._isShared:
+            self._value    = Vector(self._value.x, self._value.y)
+            self._isShared = False
+        return self._value
 
     @property
     def history(self):
@@ -0,0 +1,256 @@
+﻿# -*- coding: utf-8 -*-
+import math
+import numpy
+
+from orbitals.tools import expandRanges
+
+class SweepAndPrune:
+    """Широкая фаза поиска столкновений - метод отсечения по оси X (sweep and prune).
+       Ограничивающие прямоугольники сортируются по левой границе, кандидатами считаются пары,
+       пересекающиеся по X и по Y. При редком расположении объектов число кандидатов близко к линейному.
+       Для небольшого числа объектов проверяются все пары - это быстрее сортировки
+    """
+    bruteForceLimit = 32 # Максимальное число объектов, для которого проверяются все пары
+
+    def __init__(self):
+        self._count  = -1   # Число объектов, для которого построены пары
+        self._pairsA = None # Все пары объектов (i < j)
+        self._pairsB = None
+
+    @property
+    def name(self):
+        """Название алгоритма"""
+        return 'sweepAndPrune'
+
+    def pairs(self, low, high):
+        """Пары (a, b) объектов с пересекающимися ограничивающими прямоугольниками [low, high]"""
+        count = len(low)
+        if count <= SweepAndPrune.bruteForceLimit:
+            if count != self._count:
+                self._count = count
+                self._pairsA, self._pairsB = numpy.triu_indices(count, 1)
+            a, b    = self._pairsA, self._pairsB
+            overlap = (low[a] <= high[b]).all(axis = 1) & (low[b] <= high[a]).all(axis = 1)
+            return a[overlap], b[overlap]
+
+        order = numpy.argsort(low[:, 0], kind = 'stable')
+        xLow  = low[order, 0]
+        # Для каждого прямоугольника - последний по порядку прямоугольник, начинающийся левее его правой границы
+        last  = numpy.searchsorted(xLow, high[order, 0], side = 'right')
+        index = numpy.arange(count)
+        other = numpy.maximum(last - index - 1, 0)
+        a, b  = order[numpy.repeat(index, other)], order[expandRanges(index + 1, other)]
+        # Пересечение по оси Y
+        overlap = (low[a, 1] <= high[b, 1]) & (low[b, 1] <= high[a, 1])
+        return a[overlap], b[overlap]
+
+def findCollisions(broadPhase, positions, radii, masses, affected):
+    """Столкновения на текущем шаге - список пар (i, j): объект i столкнулся с объектом j.
+       Меньший по массе объект, участвующий в динамическом расчете, сталкивается с большим по массе,
+       при нескольких касаниях выбирается первый по порядку партнер. Список упорядочен по i.
+       Координаты, радиусы и массы задаются массивами numpy
+    """
+    if len(masses) < 2:
+        return []
+    low  = positions - radii[:, numpy.newaxis]
+    high = positions + radii[:, numpy.newaxis]
+    a, b = broadPhase.pairs(low, high)
+
+    # Точная проверка пересечения кандидатов
+    rVectors  = positions[b] - positions[a]
+    distances = numpy.sqrt(numpy.einsum('ij,ij->i', rVectors, rVectors))
+    touch     = distances <= radii[a] + radii[b]
+    a, b      = a[touch], b[touch]
+
+    # Сталкивается меньший по массе объект
+    swap  = masses[a] > masses[b]
+    a, b  = numpy.where(swap, b, a), numpy.where(swap, a, b)
+    valid = (masses[a] < masses[b]) & affected[a]
+    a, b  = a[valid], b[valid]
+
+    hits = {}
+    for i, j in zip(a.tolist(), b.tolist()):
+        if i not in hits or hits[i] > j:
+            hits[i] = j
+    return sorted(hits.items())
+
+def findObjectCollisions(objects):
+    """Столкновения на текущем шаге для списка SpaceObject - то же, что findCollisions(),
+       отсечение по оси X выполняется без numpy (для небольшого числа объектов)
+    """
+    boxes = []
+    for i, obj in enumerate(objects):
+        x = obj.currentPosition.x
+        boxes.append((x - obj.radius, x + obj.radius, i))
+    boxes.sort()
+
+    hits = {}
+    for k, (low, high, i) in enumerate(boxes):
+        for m in range(k + 1, len(boxes)):
+            otherLow, otherHigh, j = boxes[m]
+            if otherLow > high:
+                break
+            objA, objB = objects[i], objects[j]
+            positionA, positionB = objA.currentPosition, objB.currentPosition
+            dx       = positionB.x - positionA.x
+            dy       = positionB.y - positionA.y
+            distance = math.sqrt(dx*dx + dy*dy)
+            if distance > objA.radius + objB.radius:
+                continue
+
+            # Сталкивается меньший по массе объект
+            a, b = (i, j) if objA.mass < objB.mass else (j, i)
+            if objects[a].mass < objects[b].mass and objects[a].controller.isAffectedByForces:
+                if a not in hits or hits[a] > b:
+                    hits[a] = b
+    return sorted(hits.items())
+
+def hermite(x0, v0, x1, v1, h, theta):
+    """Координаты и скорости в момент theta * h внутри шага по кубическому полиному Эрмита,
+       построенному по координатам и скоростям в начале и конце шага.
+       theta - число или массив, согласованный с первым измерением x0
+    """
+    theta = numpy.asarray(theta, dtype = numpy.float64)[..., numpy.newaxis]
+    t2    = theta * theta
+    t3    = t2 * theta
+    x     = (2*t3 - 3*t2 + 1) * x0 + (t3 - 2*t2 + theta) * h * v0 + (-2*t3 + 3*t2) * x1 + (t3 - t2) * h * v1
+    v     = (6*t2 - 6*theta) / h * x0 + (3*t2 - 4*theta + 1) * v0 + (-6*t2 + 6*theta) / h * x1 + (3*t2 - 2*theta) * v1
+    return x, v
+
+def sweptBounds(x0, v0, x1, v1, h, radii):
+    """Ограничивающие прямоугольники траекторий объектов на шаге.
+       Кривая Эрмита совпадает с кривой Безье с опорными точками x0, x0 + v0 h/3, x1 - v1 h/3, x1
+       и лежит в их выпуклой оболочке
+    """
+    points = numpy.stack((x0, x0 + v0 * (h / 3.), x1 - v1 * (h / 3.), x1))
+    r      = radii[:, numpy.newaxis]
+    return points.min(axis = 0) - r, points.max(axis = 0) + r, points
+
+def impactTimes(d0, dv0, d1, dv1, h, distance, samples = 32):
+    """Момент первого касания на шаге для пар объектов: доля шага theta (nan - касания нет).
+       d0, dv0, d1, dv1 - относительные координаты и скорости пар в начале и конце шага,
+       distance - расстояние касания (сумма радиусов). Пары, касающиеся в начале шага, не учитываются.
+       Корень ищется по выборке samples точек и уточняется делением отрезка пополам
+    """
+    count = len(distance)
+    theta = numpy.full(count, numpy.nan)
+    # Все точки выборки рассчитываются одним вызовом - массив [samples + 1, пары]
+    d, v  = hermite(d0, dv0, d1, dv1, h, numpy.arange(samples + 1)[:, numpy.newaxis] / samples)
+    touch = numpy.einsum('kij,kij->ki', d, d) - distance * distance <= 0
+    first = touch[1:].argmax(axis = 0) + 1
+    hits  = numpy.nonzero(~touch[0] & touch[1:].any(axis = 0))[0]
+    if len(hits) == 0:
+        return theta
+
+    a, b = (first[hits] - 1) / samples, first[hits] / samples
+    d0, dv0, d1, dv1, distance = d0[hits], dv0[hits], d1[hits], dv1[hits], distance[hits]
+    for i in range(50):
+        middle = (a + b) / 2
+        d, v   = hermite(d0, dv0, d1, dv1, h, middle)
+        inside = numpy.einsum('ij,ij->i', d, d) <= distance * distance
+        a, b   = numpy.where(inside, a, middle), numpy.where(inside, middle, b)
+    theta[hits] = b
+    return theta
+
+def _selectImpacts(a, b, theta, masses, affected):
+    """Выбор столкновений по правилу findCollisions(): для каждого объекта - первое по времени касание"""
+    hit   = ~numpy.isnan(theta)
+    a, b, theta = a[hit], b[hit], theta[hit]
+    swap  = masses[a] > masses[b]
+    a, b  = numpy.where(swap, b, a), numpy.where(swap, a, b)
+    valid = (masses[a] < masses[b]) & affected[a]
+    hits  = {}
+    for i, j, t in zip(a[valid].tolist(), b[valid].tolist(), theta[valid].tolist()):
+        if i not in hits or (t, j) < hits[i]:
+            hits[i] = (t, j)
+    return sorted((i, j, t) for i, (t, j) in hits.items())
+
+def findImpacts(broadPhase, x0, v0, x1, v1, h, radii, masses, affected):
+    """Столкновения внутри шага (непрерывный поиск) - список (i, j, theta): объект i столкнулся
+       с объектом j в момент theta * h от начала шага. Координаты и скорости в начале и конце шага
+       задаются массивами numpy, правило выбора сталкивающегося объекта то же, что в findCollisions()
+    """
+    if len(masses) < 2:
+        return []
+    low, high, points = sweptBounds(x0, v0, x1, v1, h, radii)
+    a, b = broadPhase.pairs(low, high)
+    # Хотя бы один из объектов пары должен быть способен столкнуться с другим
+    able = ((masses[a] < masses[b]) & affected[a]) | ((masses[b] < masses[a]) & affected[b])
+    a, b = _sweptCircles(a[able], b[able], points, radii)
+    a, b = _sweptHulls(a, b, points, radii)
+    if len(a) == 0:
+        return []
+    theta = impactTimes(x0[a] - x0[b], v0[a] - v0[b], x1[a] - x1[b], v1[a] - v1[b], h, radii[a] + radii[b])
+    return _selectImpacts(a, b, theta, masses, affected)
+
+def _sweptCircles(a, b, points, radii):
+    """Отсечение пар, для которых не пересекаются окружности, описанные вокруг траекторий на шаге"""
+    center = (points[0] + points[3]) / 2
+    extent = numpy.sqrt(numpy.einsum('kij,kij->ki', points - center, points - center).max(axis = 0)) + radii
+    rVectors = center[b] - center[a]
+    near     = numpy.einsum('ij,ij->i', rVectors, rVectors) <= (extent[a] + extent[b])**2
+    return a[near], b[near]
+
+def _sweptHulls(a, b, points, radii):
+    """Отсечение пар, относительная траектория которых не приближается на расстояние касания.
+       Относительная кривая Безье лежит в выпуклой оболочке разностей опорных точек, ее проекция
+       на направление между серединами хорд - нижняя граница расстояния между объектами на шаге
+    """
+    relative  = points[:, a] - points[:, b]
+    direction = relative[0] + relative[3]
+    length    = numpy.sqrt(numpy.einsum('ij,ij->i', direction, direction))
+    bound     = numpy.einsum('kij,ij->ki', relative, direction).min(axis = 0)
+    near      = bound <= (radii[a] + radii[b]) * length
+    return a[near], b[near]
+
+def _sweptHullsApart(pointsA, pointsB, distance):
+    """То же, что _sweptHulls(), для одной пары: опорные точки - кортежи (x, y)"""
+    dx, dy = pointsA[0][0] + pointsA[3][0] - pointsB[0][0] - pointsB[3][0], pointsA[0][1] + pointsA[3][1] - pointsB[0][1] - pointsB[3][1]
+    bound  = min((pA[0] - pB[0]) * dx + (pA[1] - pB[1]) * dy for pA, pB in zip(pointsA, pointsB))
+    return bound > distance * math.hypot(dx, dy)
+
+def findObjectImpacts(objects, startPositions, startVelocities, h):
+    """Столкновения внутри шага для списка SpaceObject - то же, что findImpacts().
+       startPositions, startVelocities - координаты и скорости объектов в начале шага.
+       Отсечение кандидатов выполняется без numpy, точный расчет - только для оставшихся пар
+    """
+    # Окружность с центром в середине хорды, содержащая опорные точки кривой Безье
+    bounds = []
+    for i, obj in enumerate(objects):
+        x0, v0 = startPositions[i], startVelocities[i]
+        x1, v1 = obj.currentPosition, obj.currentVelocity
+        cx, cy = (x0.x + x1.x) / 2, (x0.y + x1.y) / 2
+        extent = math.hypot(x1.x - cx, x1.y - cy) + max(math.hypot(v0.x, v0.y), math.hypot(v1.x, v1.y)) * h / 3. + obj.radius
+        points = ((x0.x, x0.y), (x0.x + v0.x * h / 3., x0.y + v0.y * h / 3.), (x1.x - v1.x * h / 3., x1.y - v1.y * h / 3.), (x1.x, x1.y))
+        bounds.append((cx - extent, cx + extent, i, cx, cy, extent, obj.mass, obj.controller.isAffectedByForces, obj.radius, points))
+    bounds.sort(key = lambda bound: bound[:3])
+
+    pairs = []
+    for k, (low, high, i, cx, cy, extent, mass, isAffected, radius, points) in enumerate(bounds):
+        for m in range(k + 1, len(bounds)):
+            otherLow, otherHigh, j, otherX, otherY, otherExtent, otherMass, isOtherAffected, otherRadius, otherPoints = bounds[m]
+            if otherLow > high:
+                break
+            # Хотя бы один из объектов пары должен быть способен столкнуться с другим
+            if not ((mass < otherMass and isAffected) or (otherMass < mass and isOtherAffected)):
+                continue
+            if (otherX - cx)**2 + (otherY - cy)**2 > (extent + otherExtent)**2:
+                continue
+            if not _sweptHullsApart(points, otherPoints, radius + otherRadius):
+                pairs.append((i, j))
+    if len(pairs) == 0:
+        return []
+
+    a, b     = numpy.array(pairs).T
+    x1       = [obj.currentPosition for obj in objects]
+    v1       = [obj.currentVelocity for obj in objects]
+    radii    = numpy.array([obj.radius for obj in objects])
+    masses   = numpy.array([obj.mass for obj in objects])
+    affected = numpy.array([obj.controller.isAffectedByForces for obj in objects], dtype = bool)
+    theta    = impactTimes(_relative(startPositions, a, b), _relative(startVelocities, a, b),
+                           _relative(x1, a, b), _relative(v1, a, b), h, radii[a] + radii[b])
+    return _selectImpacts(a, b, theta, masses, affected)
+
+def _relative(vectors, a, b):
+    """Разности векторов vectors[a] - vectors[b] в виде массива numpy"""
+    return numpy.array([(vectors[i].x - vectors[j].x, vectors[i].y - vectors[j].y) for i, j in zip(a, b)]).reshape(len(a), 2)
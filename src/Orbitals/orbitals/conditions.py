@@ -0,0 +1,108 @@
+﻿# -*- coding: utf-8 -*-
+import numpy
+
+from orbitals.gravity import G
+from orbitals.kepler import KeplerOrbit
+from orbitals.kepler import KeplerSpaceObjectController
+
+class StopCondition:
+    """Условие досрочного завершения расчета - базовый класс.
+       Условия проверяются вычислителем по завершении шагов расчета (Solver.addStopCondition)
+    """
+    @property
+    def isStateRequired(self):
+        """Нужны ли условию координаты и скорости объектов (перед проверкой состояние ядра переносится в объекты)"""
+        return True
+
+    def check(self, solver):
+        """Причина остановки расчета (None - условие не выполнено)"""
+        raise Exception('StopCondition.check() is not implemented')
+
+class CollidedStopCondition(StopCondition):
+    """Все динамические объекты выбыли из расчета (столкнулись или покинули область расчета).
+       Корабли на баллистических участках (KeplerSpaceObjectController) считаются динамическими
+    """
+    def __init__(self, objects = None):
+        self._objects = objects # Проверяемые объекты (None - все объекты вычислителя)
+
+    @property
+    def isStateRequired(self):
+        return False
+
+    def check(self, solver):
+        objects = solver.objects if self._objects is None else self._objects
+        for obj in objects:
+            controller = obj.controller
+            if controller.isActive and (controller.isAffectedByForces or isinstance(controller, KeplerSpaceObjectController)):
+                return None
+        return 'все объекты выбыли из расчета'
+
+class _RelativeStopCondition(StopCondition):
+    """Условие на значение, вычисляемое по состоянию объекта относительно тела body"""
+    def __init__(self, object, body, above, below):
+        self._object = object
+        self._body   = body
+        self._above  = above # Расчет останавливается, если значение больше above (None - не проверяется)
+        self._below  = below # Расчет останавливается, если значение меньше below (None - не проверяется)
+
+    def check(self, solver):
+        if not self._object.controller.isActive:
+            return None
+        value = self._value()
+        if value is None:
+            return None
+        if self._above is not None and value > self._above:
+            return '{0} объекта {1} больше {2:g}'.format(self._name, self._object.name, self._above)
+        if self._below is not None and value < self._below:
+            return '{0} объекта {1} меньше {2:g}'.format(self._name, self._object.name, self._below)
+        return None
+
+class AltitudeStopCondition(_RelativeStopCondition):
+    """Высота объекта над поверхностью тела вышла за заданные пределы"""
+    _name = 'высота'
+
+    def _value(self):
+        return (self._object.position - self._body.position).length - self._body.radius
+
+class SpeedStopCondition(_RelativeStopCondition):
+    """Скорость объекта относительно тела вышла за заданные пределы"""
+    _name = 'скорость'
+
+    def _value(self):
+        return (self._object.velocity - self._body.velocity).length
+
+class PeriapsisStopCondition(_RelativeStopCondition):
+    """Высота перицентра замкнутой орбиты объекта вокруг тела вышла за заданные пределы
+       (пока орбита не замкнута, условие не проверяется)
+    """
+    _name = 'высота перицентра'
+
+    def _value(self):
+        position = self._object.position - self._body.position
+        velocity = self._object.velocity - self._body.velocity
+        orbit    = KeplerOrbit(0, 0, numpy.zeros(2), G * self._body.mass, numpy.array((position.x, position.y)),
+                               numpy.array((velocity.x, velocity.y)))
+        return orbit.periapsis - self._body.radius if orbit.isBound else None
+
+class PredicateStopCondition(StopCondition):
+    """Условие, заданное функцией predicate(solver) -> bool. Для записи контрольных точек
+       функция должна передаваться через pickle (функция уровня модуля)
+    """
+    def __init__(self, predicate, reason):
+        self._predicate = predicate
+        self._reason    = reason
+
+    def check(self, solver):
+        return self._reason if self._predicate(solver) else None
+
+class StopConditionFactory:
+    def collided(objects = None):
+        return CollidedStopCondition(objects)
+    def altitude(object, body, above = None, below = None):
+        return AltitudeStopCondition(object, body, above, below)
+    def speed(object, body, above = None, below = None):
+        return SpeedStopCondition(object, body, above, below)
+    def periapsis(object, body, above = None, below = None):
+        return PeriapsisStopCondition(object, body, above, below)
+    def predicate(predicate, reason = 'выполнено условие пользователя'):
+        return PredicateStopCondition(predicate, reason)
@@ -0,0 +1,156 @@
+﻿# -*- coding: utf-8 -*-
+import numpy
+
+blockSize = 1 << 20 # Число точек, обрабатываемых за один проход (ограничивает объем временных массивов)
+
+def minMaxIndices(values, begin, end, buckets):
+    """Индексы точек отрезка [begin, end), сохраняющих форму графика при прореживании:
+       отрезок делится на buckets равных по числу точек интервалов, в каждом выбираются
+       минимум и максимум каждого столбца. Первая и последняя точки сохраняются всегда.
+       values(first, last) возвращает список столбцов значений (массивов numpy) для точек [first, last)
+    """
+    count = end - begin
+    if count <= 2 * buckets:
+        return numpy.arange(begin, end)
+    size   = -(-count // buckets)
+    step   = max(1, blockSize // size) * size
+    result = [numpy.array([begin, end - 1])]
+    for first in range(begin, end, step):
+        last = min(end, first + step)
+        full = (last - first) // size * size
+        for column in values(first, last):
+            rows   = column[:full].reshape(-1, size)
+            offset = numpy.arange(len(rows)) * size + first
+            result.append(offset + rows.argmin(axis = 1))
+            result.append(offset + rows.argmax(axis = 1))
+            if full < last - first:
+                tail = column[full:]
+                result.append(numpy.array([first + full + tail.argmin(), first + full + tail.argmax()]))
+    return numpy.unique(numpy.concatenate(result))
+
+def visibleRuns(values, begin, end, low, high):
+    """Отрезки [first, last) подряд идущих точек кривой (x, y), попадающих в прямоугольник low - high.
+       В отрезок включаются соседние точки, чтобы линия доходила до границы прямоугольника.
+       values(first, last) возвращает столбцы x, y для точек [first, last)
+    """
+    runs = []
+    for first in range(begin, end, blockSize):
+        last = min(end, first + blockSize)
+        # Точки на границах блока учитываются вместе с соседями из соседних блоков
+        a, b   = max(begin, first - 1), min(end, last + 1)
+        xs, ys = values(a, b)
+        inside = (xs >= low[0]) & (xs <= high[0]) & (ys >= low[1]) & (ys <= high[1])
+        near   = inside.copy()
+        near[1:]  |= inside[:-1]
+        near[:-1] |= inside[1:]
+        near   = near[first - a:len(near) - (b - last)]
+
+        edges  = numpy.diff(numpy.concatenate(([False], near, [False])).astype(numpy.int8))
+        starts = numpy.nonzero(edges == 1)[0] + first
+        stops  = numpy.nonzero(edges == -1)[0] + first
+        for start, stop in zip(starts.tolist(), stops.tolist()):
+            if runs and runs[-1][1] == start:
+                runs[-1] = (runs[-1][0], stop)
+            else:
+                runs.append((start, stop))
+    return runs
+
+class DownsampledLine:
+    """Линия графика, прореживаемая до ширины осей в пикселях.
+       На каждом пикселе сохраняются минимум и максимум значений, поэтому кратковременные
+       пики (включение двигателей, отделение ступеней) остаются видны.
+       При изменении пределов осей линия перестраивается по видимой части данных
+       с полным для нового масштаба разрешением
+    """
+    def __init__(self, plot, count, values, sample, isCurve):
+        self._plot    = plot
+        self._count   = count   # Число точек данных
+        self._values  = values  # values(first, last) - столбцы значений для прореживания
+        self._sample  = sample  # sample(indices) - координаты (x, y) выбранных точек
+        self._isCurve = isCurve # Кривая (x, y) - иначе временной ряд (t, y)
+        self._line    = None
+        self._key     = None    # Параметры текущего построения (видимый отрезок и число пикселей)
+        self._low     = None    # Ограничивающий прямоугольник всей кривой
+        self._high    = None
+
+    @property
+    def line(self):
+        """Линия matplotlib"""
+        return self._line
+
+    def draw(self, fmt, end = None, **kwargs):
+        """Построить линию по точкам [0, end). Если end не задан, линия перестраивается при масштабировании"""
+        count = self._count if end is None else min(int(end), self._count)
+        x, y  = self._sample(minMaxIndices(self._values, 0, count, self._buckets()))
+        self._line, = self._plot.plot(x, y, fmt, **kwargs)
+        if end is None:
+            if self._isCurve and len(x) > 0:
+                self._low, self._high = (numpy.min(x), numpy.min(y)), (numpy.max(x), numpy.max(y))
+            self._key = (((0, count),), self._buckets())
+            self._plot.callbacks.connect('xlim_changed', lambda plot: self.update())
+            if self._isCurve:
+                self._plot.callbacks.connect('ylim_changed', lambda plot: self.update())
+        return self._line
+
+    def _buckets(self):
+        """Число интервалов прореживания - ширина осей в пикселях"""
+        return max(100, int(self._plot.bbox.width))
+
+    def update(self):
+        """Перестроить линию для текущих пределов осей"""
+        if self._count == 0:
+            return
+        buckets = self._buckets()
+        (x0, x1), (y0, y1) = sorted(self._plot.get_xlim()), sorted(self._plot.get_ylim())
+        if self._isCurve:
+            if x0 <= self._low[0] and x1 >= self._high[0] and y0 <= self._low[1] and y1 >= self._high[1]:
+                runs = [(0, self._count)]
+            else:
+                runs = visibleRuns(self._values, 0, self._count, (x0, y0), (x1, y1))
+        else:
+            ts    = self._sample.ts
+            first = max(0, int(numpy.searchsorted(ts, x0, side = 'right')) - 1)
+            last  = min(self._count, int(numpy.searchsorted(ts, x1, side = 'left')) + 1)
+            runs  = [(first, last)]
+
+        key = (tuple(runs), buckets)
+        if key == self._key:
+            return
+        self._key = key
+
+        # Интервалы прореживания распределяются между отрезками пропорционально числу точек
+        total  = sum(stop - start for start, stop in runs)
+        xs, ys = [], []
+        for start, stop in runs:
+            x, y = self._sample(minMaxIndices(self._values, start, stop, max(1, buckets * (stop - start) // max(1, total))))
+            if xs:
+                xs.append([numpy.nan])
+                ys.append([numpy.nan])
+            xs.append(x)
+            ys.append(y)
+        if xs:
+            self._line.set_data(numpy.concatenate(xs), numpy.concatenate(ys))
+        else:
+            self._line.set_data([], [])
+        self._plot.figure.canvas.draw_idle()
+
+class _TimeSample:
+    """Выборка точек временного ряда (t, y), y вычисляется функцией column(indices)"""
+    def __init__(self, ts, column):
+        self.ts      = ts
+        self._column = column
+
+    def __call__(self, indices):
+        return numpy.asarray(self.ts[indices]), self._column(indices)
+
+def plotSeries(plot, ts, column, values, fmt, **kwargs):
+    """Построить прореживаемый временной ряд (ts, column(indices)) на осях plot.
+       values(first, last) - столбцы значений для выбора минимумов и максимумов
+    """
+    return DownsampledLine(plot, len(ts), values, _TimeSample(ts, column), isCurve = False).draw(fmt, **kwargs)
+
+def plotCurve(plot, xs, ys, fmt, end = None, **kwargs):
+    """Построить прореживаемую кривую (xs, ys) на осях plot по точкам [0, end)"""
+    values = lambda first, last: (xs[first:last], ys[first:last])
+    sample = lambda indices: (numpy.asarray(xs[indices]), numpy.asarray(ys[indices]))
+    return DownsampledLine(plot, len(xs), values, sample, isCurve = True).draw(fmt, end, **kwargs)
@@ -0,0 +1,751 @@
+﻿# -*- coding: utf-8 -*-
+import math
+import numpy
+
+from orbitals.basicTypes import Vector
+from orbitals.types      import SpaceShip
+from orbitals.types      import GravitySpaceObjectController
+from orbitals.types      import StaticSpaceObjectController
+from orbitals.types      import CollidedSpaceObjectController
+from orbitals.types      import EscapedSpaceObjectController
+from orbitals.tools      import Formatter
+from orbitals.gravity    import G
+from orbitals.gravity    import DirectGravity
+from orbitals.collisions import SweepAndPrune
+from orbitals.collisions import findCollisions
+from orbitals.collisions import findObjectCollisions
+from orbitals.collisions import findImpacts
+from orbitals.collisions import findObjectImpacts
+from orbitals.collisions import hermite
+
+class ObjectEngine:
+    """Вычислительное ядро на объектах SpaceObject - попарный перебор объектов.
+       Силы, скорости и координаты обновляются на месте, промежуточные значения
+       накапливаются в векторах, выделенных один раз на весь расчет.
+       Объекты, выбывшие из расчета, исключаются из перебора в начале следующего шага
+    """
+    def __init__(self):
+        self._allObjects  = [] # Все объекты вычислителя
+        self._objects     = [] # Объекты, участвующие в расчете
+        self._log         = None
+        self._gravityModel = None
+        self._escapeRadius = None
+        self._retired     = False # Есть ли объекты, выбывшие из расчета на текущем шаге
+        self._gravity     = [] # Гравитационные силы на текущем шаге
+        self._external    = [] # Внешние силы (тяга двигателей) на текущем шаге
+        self._positions   = [] # Координаты объектов в начале шага
+        self._velocities  = [] # Скорости объектов в начале шага
+        self._stages      = [] # Силы на промежуточных этапах интегрирования
+        self._dynamic     = [] # Индексы объектов, участвующих в динамическом расчете
+        self._stageForces = [] # Силы, действующие на объекты self._dynamic на текущем этапе интегрирования
+        self._sources     = [] # Источники гравитации (объект, масса присоединенных к нему объектов)
+
+    def begin(self, solver, ctx):
+        """Инициализация расчета"""
+        if not isinstance(solver.gravity, DirectGravity):
+            raise Exception('Gravity model "{0}" requires Engine.arrays()'.format(solver.gravity.name))
+        if solver.integrator.isBlock and not solver.timeRange.isAdaptive:
+            raise Exception('Integrator "{0}" requires Engine.arrays()'.format(solver.integrator.name))
+        self._allObjects   = solver.objects
+        self._log          = solver._log
+        self._gravityModel = solver.gravity
+        self._escapeRadius = solver.escapeRadius
+        self._build()
+
+    def _build(self):
+        """Списки объектов, участвующих в расчете, и рабочие векторы для них"""
+        self._objects    = [obj for obj in self._allObjects if obj.controller.isActive]
+        self._gravity    = [Vector(0., 0.) for obj in self._objects]
+        self._external   = [Vector(0., 0.) for obj in self._objects]
+        self._positions  = [Vector(0., 0.) for obj in self._objects]
+        self._velocities = [Vector(0., 0.) for obj in self._objects]
+        self._stages     = [Vector(0., 0.) for obj in self._objects]
+        self._sources    = self._sourceList()
+        self._retired    = False
+
+    def _sourceList(self):
+        """Источники гравитации среди объектов, участвующих в расчете, с массой присоединенных к ним объектов"""
+        active   = [obj for obj in self._objects if obj.controller.isActive]
+        sources  = self._gravityModel.sources(active)
+        attached = _attachedMasses(self._allObjects, active)
+        return [(obj, 0. if attached is None else attached[k]) for k, obj in enumerate(active) if sources is None or sources[k]]
+
+    def beginStep(self, ctx):
+        """Начать шаг расчета"""
+        if self._retired:
+            self._build()
+        for obj, position, velocity in zip(self._objects, self._positions, self._velocities):
+            obj.beginStep(ctx)
+            current = obj.currentPosition
+            position.set(current.x, current.y)
+            current = obj.currentVelocity
+            velocity.set(current.x, current.y)
+
+    def runStep(self, ctx):
+        """Выполнить шаг расчета"""
+        # расчет коллизий - меньший по массе объект может столкнуться с большим по массе
+        for i, j in findObjectCollisions(self._objects):
+            # Объект A столкнулся с объектом B
+            objA, objB = self._objects[i], self._objects[j]
+            positionA, positionB = objA.currentPosition, objB.currentPosition
+            relativeVelocity = (objA.currentVelocity - objB.currentVelocity).length
+            _attachCollision(self._log, ctx, ctx.t, objA, objB, Vector(positionA.x - positionB.x, positionA.y - positionB.y), relativeVelocity)
+            self._retired = True
+        if self._retired:
+            self._sources = self._sourceList()
+
+        # расчет гравитации
+        trace = self._log.enableTrace
+        for objA, gravity, external in zip(self._objects, self._gravity, self._external):
+            # Объект должен быть подвержен действию сил (втч сил гравитации)
+            # Напр. объект, столкнувшийся с другим, более не подвержен действию внешних сил
+            if not objA.controller.isAffectedByForces:
+                continue
+
+            gravity.set(0., 0.)
+            positionA = objA.currentPosition
+            for objB, attached in self._sources:
+                # Объект не влияет сам на себя
+                if objA is objB:
+                    continue
+                positionB = objB.currentPosition
+                dx       = positionB.x - positionA.x
+                dy       = positionB.y - positionA.y
+                distance = math.sqrt(dx*dx + dy*dy)
+                if distance > 0:
+                    g = G * objA.mass * (objB.mass + attached)
+                    h = 1. / distance**3
+                    gravity.set(gravity.x + dx * g * h, gravity.y + dy * g * h)
+                    if trace:
+                        force  = Vector(dx * g * h, dy * g * h)
+                        thrust = objA.currentForce.copy()
+                        self._log.trace(ctx.t, 'Грав. сила для объекта {0} = {1} | {2}', objA.name, force, force * (1. / objA.mass))
+                        self._log.trace(ctx.t, 'Сила тяги для объекта  {0} = {1} | {2}', objA.name, thrust, thrust * (1. / objA.mass))
+
+            force = objA.currentForce
+            external.set(force.x, force.y)
+            objA.addForce(gravity.x, gravity.y)
+
+        self._dynamic     = [i for i, obj in enumerate(self._objects) if obj.controller.isAffectedByForces]
+        self._stageForces = [self._objects[i].currentForce for i in self._dynamic]
+        if ctx.profiler is not None:
+            ctx.profiler.addInteractions(self._interactions())
+
+    def updateForces(self, ctx):
+        """Пересчитать силы для текущих координат объектов (без расчета коллизий)"""
+        for k, i in enumerate(self._dynamic):
+            objA  = self._objects[i]
+            force = self._stages[i]
+            force.set(self._external[i].x, self._external[i].y)
+            thrust = _stageThrust(objA, force, self._velocities[i], objA.currentVelocity)
+            if thrust is not force:
+                force.set(thrust.x, thrust.y)
+
+            positionA = objA.currentPosition
+            for objB, attached in self._sources:
+                if objA is not objB:
+                    positionB = objB.currentPosition
+                    dx       = positionB.x - positionA.x
+                    dy       = positionB.y - positionA.y
+                    distance = math.sqrt(dx*dx + dy*dy)
+                    if distance > 0:
+                        g = G * objA.mass * (objB.mass + attached) / distance**3
+                        force.set(force.x + dx * g, force.y + dy * g)
+            self._stageForces[k] = force
+        if ctx.profiler is not None:
+            ctx.profiler.addInteractions(self._interactions())
+
+    def _interactions(self):
+        """Число парных взаимодействий при расчете сил для объектов self._dynamic"""
+        sources = set(id(obj) for obj, attached in self._sources)
+        return sum(len(self._sources) - (id(self._objects[i]) in sources) for i in self._dynamic)
+
+    def kick(self, h):
+        """Обновить скорости объектов на интервале h"""
+        for i, force in zip(self._dynamic, self._stageForces):
+            self._objects[i].accelerate(force, h)
+
+    def drift(self, h):
+        """Обновить координаты объектов на интервале h"""
+        for i in self._dynamic:
+            self._objects[i].move(h)
+
+    def getState(self):
+        """Координаты и скорости объектов, участвующих в динамическом расчете"""
+        objects = [self._objects[i] for i in self._dynamic]
+        x = numpy.array([[obj.currentPosition.x, obj.currentPosition.y] for obj in objects], dtype = numpy.float64).reshape(len(objects), 2)
+        v = numpy.array([[obj.currentVelocity.x, obj.currentVelocity.y] for obj in objects], dtype = numpy.float64).reshape(len(objects), 2)
+        return x, v
+
+    def setState(self, x, v):
+        """Задать координаты и скорости объектов, участвующих в динамическом расчете"""
+        for k, i in enumerate(self._dynamic):
+            # Объекты, столкнувшиеся в конце шага, остаются в точке столкновения
+            obj = self._objects[i]
+            if obj.controller.isAffectedByForces:
+                obj.setPositionXY(x[k, 0], x[k, 1])
+                obj.setVelocityXY(v[k, 0], v[k, 1])
+
+    def accelerations(self, remaining = 0.):
+        """Ускорения объектов, участвующих в динамическом расчете, на текущем этапе интегрирования.
+           remaining - время до конца шага, масса объектов к концу шага уже уменьшена на расход топлива
+        """
+        a = numpy.empty((len(self._dynamic), 2))
+        for k, i in enumerate(self._dynamic):
+            obj  = self._objects[i]
+            a[k] = (self._stageForces[k].x, self._stageForces[k].y)
+            a[k] /= obj.mass
+            correction = _massCorrection(obj, obj.currentVelocity, remaining)
+            if correction is not None:
+                a[k] += (correction.x, correction.y)
+        return a
+
+    def endStep(self, ctx):
+        """Завершить шаг расчета"""
+        self._impacts(ctx)
+        if self._escapeRadius is not None:
+            self._escapes(ctx)
+        for obj in self._objects:
+            if obj.controller.isActive:
+                obj.endStep(ctx)
+
+    def _impacts(self, ctx):
+        """Столкновения внутри шага - объект переносится в точку столкновения"""
+        for i, j, theta in findObjectImpacts(self._objects, self._positions, self._velocities, ctx.dt):
+            objA, objB = self._objects[i], self._objects[j]
+            xA, vA = _interpolate(objA, self._positions[i], self._velocities[i], ctx.dt, theta)
+            xB, vB = _interpolate(objB, self._positions[j], self._velocities[j], ctx.dt, theta)
+            objA.setPositionXY(xA[0], xA[1])
+            objA.setVelocityXY(vA[0], vA[1])
+            _attachCollision(self._log, ctx, ctx.t + theta * ctx.dt, objA, objB, Vector(xA[0] - xB[0], xA[1] - xB[1]), math.hypot(*(vA - vB)))
+            self._retired = True
+
+    def _escapes(self, ctx):
+        """Объекты, покинувшие область расчета (дальше Solver.escapeRadius от начала координат), выбывают из расчета"""
+        limit = self._escapeRadius * self._escapeRadius
+        for obj in self._objects:
+            if obj.controller.isAffectedByForces:
+                position = obj.currentPosition
+                if position.x * position.x + position.y * position.y > limit:
+                    _attachEscape(self._log, ctx.t + ctx.dt, obj)
+                    self._retired = True
+
+    def writeHistory(self, t):
+        """Записать текущее состояние объектов в историю в момент времени t"""
+        for obj in self._objects:
+            if obj.controller.isActive:
+                obj.putHistory(t)
+
+    def sync(self, ctx):
+        """Перенести состояние ядра в объекты (состояние хранится в самих объектах)"""
+        return
+
+    def saveState(self):
+        """Собственное состояние ядра для контрольной точки (состояние хранится в самих объектах)"""
+        return None
+
+    def restoreState(self, state):
+        """Восстановить состояние, сохраненное saveState()"""
+        return
+
+    def end(self, ctx):
+        """Завершение расчета"""
+        _followCarriers(self._allObjects)
+
+def _interpolate(obj, position, velocity, h, theta):
+    """Координаты и скорости объекта в момент theta * h внутри шага (position, velocity - в начале шага)"""
+    current, currentVelocity = obj.currentPosition, obj.currentVelocity
+    return hermite(numpy.array((position.x, position.y)), numpy.array((velocity.x, velocity.y)),
+                   numpy.array((current.x, current.y)), numpy.array((currentVelocity.x, currentVelocity.y)), h, theta)
+
+def _attachCollision(log, ctx, t, objA, objB, relativePosition, relativeVelocity):
+    """Объект A столкнулся с объектом B в момент t и далее движется вместе с ним (выбывает из расчета)"""
+    objA.finalizeHistory(t)
+    CollidedSpaceObjectController(objB, relativePosition, t).attach(objA)
+    objA.beginStep(ctx)
+    log.err(t, 'Объект {0} столкнулся с объектом {1}, скорость столкновения {2}', objA.name, objB.name, Formatter.speed(relativeVelocity))
+
+def _attachEscape(log, t, obj):
+    """Объект покинул область расчета в момент t и выбывает из расчета"""
+    obj.finalizeHistory(t)
+    EscapedSpaceObjectController(t).attach(obj)
+    log.info(t, 'Объект {0} покинул область расчета', obj.name)
+
+def _attachedMasses(objects, active):
+    """Массы объектов из objects, присоединенных при столкновениях к объектам active (None - таких объектов нет).
+       Присоединенный объект движется вместе с телом и притягивает другие объекты как часть составного тела
+    """
+    index  = {id(obj): k for k, obj in enumerate(active)}
+    masses = None
+    for obj in objects:
+        if isinstance(obj.controller, CollidedSpaceObjectController):
+            k = index.get(id(obj.controller.carrier))
+            if k is not None:
+                if masses is None:
+                    masses = numpy.zeros(len(active))
+                masses[k] += obj.mass
+    return masses
+
+def _followCarriers(objects):
+    """Перенести присоединенные объекты в точки тел, вместе с которыми они движутся"""
+    for obj in objects:
+        if isinstance(obj.controller, CollidedSpaceObjectController):
+            obj.controller.follow()
+
+def _stageThrust(obj, external, velocity, stageVelocity):
+    """Внешняя сила на промежуточном этапе шага - тяга пересчитывается для текущей скорости объекта"""
+    thrust = obj.thrust(velocity)
+    if thrust is None:
+        return external
+    return external - thrust + obj.thrust(stageVelocity)
+
+def _massCorrection(obj, velocity, remaining):
+    """Поправка ускорения от тяги с учетом массы объекта за время remaining до конца шага"""
+    if remaining == 0:
+        return None
+    rate = obj.massRate
+    if rate == 0:
+        return None
+    thrust = obj.thrust(velocity)
+    if thrust is None:
+        return None
+    return thrust * (1. / (obj.mass + rate * remaining) - 1. / obj.mass)
+
+class ArrayEngine:
+    """Вычислительное ядро на массивах numpy.
+       Координаты, скорости, массы и радиусы объектов хранятся в виде отдельных массивов (structure of arrays),
+       гравитация считается одним векторизованным шагом алгоритмом Solver.gravity.
+       Пассивные объекты (без событий и зависимых контроллеров) полностью рассчитываются в массивах
+       и синхронизируются с SpaceObject только при записи истории.
+       Объекты с собственной логикой (события, столкновения) по-прежнему обслуживаются своими контроллерами.
+       С интегратором Integrator.blocks() объекты движутся с собственными шагами, силы пересчитываются
+       только для объектов, начинающих или завершающих свой шаг.
+       Объекты, выбывшие из расчета (столкновения, выход из области расчета), исключаются из массивов
+       в начале следующего шага - при сокращении числа объектов расчет ускоряется.
+    """
+    def __init__(self):
+        self._allObjects   = []   # Все объекты вычислителя
+        self._objects      = []   # Объекты, участвующие в расчете (строки массивов)
+        self._log          = None
+        self._positions    = None # Координаты, м
+        self._velocities   = None # Скорости, м/с
+        self._accelerations= None # Ускорения, м/с^2
+        self._forces       = None # Суммарные силы, Н
+        self._external     = None # Внешние силы (тяга двигателей), Н
+        self._startPositions  = None # Координаты в начале шага, м
+        self._startVelocities = None # Скорости в начале шага, м/с
+        self._stageForces  = None # Силы на текущем этапе интегрирования, Н
+        self._masses       = None # Массы, кг
+        self._radii        = None # Радиусы, м
+        self._affected     = None # Признак участия объекта в динамическом расчете
+        self._fixed        = None # Признак неподвижного источника гравитации
+        self._sources      = None # Признак источника гравитации (None - все объекты являются источниками)
+        self._attached     = None # Массы объектов, присоединенных при столкновениях (None - таких объектов нет)
+        self._active       = None # Признак объекта, не выбывшего из расчета
+        self._escapeRadius = None # Радиус области расчета, м (None - не ограничен)
+        self._gravityModel = None # Алгоритм расчета гравитации
+        self._managed      = []   # Объекты, обслуживаемые собственными контроллерами
+        self._managedIndex = None # Индексы объектов из self._managed
+        self._passiveIndex = None # Индексы пассивных объектов
+        self._dynamicIndex = None # Индексы пассивных объектов, участвующих в динамическом расчете
+        self._integrated   = None # Индексы всех объектов, участвующих в динамическом расчете
+        self._stateIndex   = None # Индексы объектов, состояние которых возвращает getState() на текущем шаге
+        self._broadPhase   = SweepAndPrune() # Широкая фаза поиска столкновений
+        self._blocks       = None # Интегратор блочных шагов (None - все объекты движутся с шагом расчета)
+        self._dt           = 0.   # Шаг расчета (для блочных шагов)
+        self._levels       = None # Уровни шагов объектов (шаг dt * 2^level)
+        self._blockStart   = None # Номер шага расчета, на котором начался шаг объекта
+        self._blockEnd     = None # Номер шага расчета, на котором начнется следующий шаг объекта
+        self._openAccelerations = None # Ускорения в начале шага объекта
+        self._opening      = None # Объекты, начинающие свой шаг на текущем шаге расчета
+        self._closing      = None # Объекты, завершающие свой шаг на текущем шаге расчета
+
+    def begin(self, solver, ctx):
+        """Инициализация расчета"""
+        self._allObjects   = solver.objects
+        self._objects      = [obj for obj in solver.objects if obj.controller.isActive]
+        self._log          = solver._log
+        self._gravityModel = solver.gravity
+        self._escapeRadius = solver.escapeRadius
+
+        count = len(self._objects)
+        self._positions     = numpy.array([[obj.position.x, obj.position.y] for obj in self._objects], dtype = numpy.float64).reshape(count, 2)
+        self._velocities    = numpy.array([[obj.velocity.x, obj.velocity.y] for obj in self._objects], dtype = numpy.float64).reshape(count, 2)
+        self._accelerations = numpy.zeros((count, 2))
+        self._forces        = numpy.zeros((count, 2))
+        self._masses        = numpy.array([obj.mass   for obj in self._objects], dtype = numpy.float64)
+        self._radii         = numpy.array([obj.radius for obj in self._objects], dtype = numpy.float64)
+        self._classify()
+
+        # Блочные шаги: все объекты начинают свой шаг на текущем шаге расчета
+        self._blocks = solver.integrator if solver.integrator.isBlock and not solver.timeRange.isAdaptive else None
+        if self._blocks is not None:
+            self._dt         = ctx.dt
+            self._levels     = numpy.zeros(count, dtype = numpy.intp)
+            self._blockStart = numpy.full(count, ctx.iteration, dtype = numpy.int64)
+            self._blockEnd   = numpy.full(count, ctx.iteration, dtype = numpy.int64)
+            self._openAccelerations = numpy.zeros((count, 2))
+
+    def _classify(self):
+        """Разделение объектов на пассивные и обслуживаемые контроллерами.
+           Объекты, выбывшие из расчета на текущем шаге, не входят ни в одну группу и не являются источниками гравитации
+        """
+        managed, passive = [], []
+        for i, obj in enumerate(self._objects):
+            controller = obj.controller
+            if not controller.isActive:
+                continue
+            isPlain = (type(controller) is GravitySpaceObjectController and controller._nextController == None) \
+                      or type(controller) is StaticSpaceObjectController
+            if isPlain:
+                passive.append(i)
+            else:
+                managed.append(i)
+
+        self._active       = numpy.array([obj.controller.isActive for obj in self._objects], dtype = bool)
+        self._affected     = numpy.array([obj.controller.isAffectedByForces for obj in self._objects], dtype = bool)
+        self._fixed        = numpy.array([type(obj.controller) is StaticSpaceObjectController for obj in self._objects], dtype = bool)
+        self._sources      = self._gravityModel.sources(self._objects)
+        if not self._active.all():
+            self._sources  = self._active if self._sources is None else self._sources & self._active
+        self._attached     = _attachedMasses(self._allObjects, self._objects)
+        self._managed      = [self._objects[i] for i in managed]
+        self._managedIndex = numpy.array(managed, dtype = numpy.intp)
+        self._passiveIndex = numpy.array(passive, dtype = numpy.intp)
+        self._dynamicIndex = self._passiveIndex[self._affected[self._passiveIndex]]
+        self._integrated   = numpy.nonzero(self._affected)[0]
+
+    def _compact(self):
+        """Исключить из массивов объекты, выбывшие из расчета. Массивы сжимаются только между шагами,
+           поэтому внутри шага (и при возврате к началу отклоненного шага) индексы объектов не меняются
+        """
+        if self._active.all():
+            return
+        keep = numpy.nonzero(self._active)[0]
+        self._objects = [self._objects[i] for i in keep]
+        for name in _rowArrays:
+            value = getattr(self, name)
+            if value is not None:
+                setattr(self, name, value[keep])
+        self._classify()
+
+    def beginStep(self, ctx):
+        """Начать шаг расчета"""
+        self._compact()
+        if self._blocks is None:
+            self._forces.fill(0.)
+            for obj in self._managed:
+                obj.beginStep(ctx)
+            self._gather()
+            self._external = self._forces.copy()
+        else:
+            # Контроллеры объектов вызываются в начале и в конце шага объекта
+            self._opening = self._affected & (self._blockEnd == ctx.iteration)
+            starting      = self._opening | ~self._affected
+            self._forces[starting] = 0.
+            for i, obj in zip(self._managedIndex, self._managed):
+                if starting[i]:
+                    obj.beginStep(ctx)
+            self._gather(starting)
+            self._external = numpy.where(starting[:, numpy.newaxis], self._forces, 0.)
+        self._startPositions  = self._positions.copy()
+        self._startVelocities = self._velocities.copy()
+
+    def runStep(self, ctx):
+        """Выполнить шаг расчета"""
+        # расчет коллизий - меньший по массе объект может столкнуться с большим по массе
+        self._collide(ctx)
+
+        affected = self._affected if self._blocks is None else self._affected & self._opening
+        gravity  = self._gravityForces(affected)
+        if ctx.profiler is not None:
+            ctx.profiler.addInteractions(self._gravityModel.interactions)
+
+        if self._log.enableTrace:
+            for i in numpy.nonzero(affected)[0]:
+                obj = self._objects[i]
+                self._log.trace(ctx.t, 'Грав. сила для объекта {0} = {1} | {2}', obj.name, Vector(*gravity[i]), Vector(*(gravity[i] / self._masses[i])))
+                self._log.trace(ctx.t, 'Сила тяги для объекта  {0} = {1} | {2}', obj.name, Vector(*self._forces[i]), Vector(*(self._forces[i] / self._masses[i])))
+
+        self._forces += gravity
+        self._forces[~self._active] = 0.
+        self._stageForces = self._forces.copy()
+        self._stateIndex  = self._integrated
+        if self._blocks is not None:
+            self._openBlocks(ctx)
+
+    def _openBlocks(self, ctx):
+        """Выбрать уровни шагов объектов, начинающих свой шаг"""
+        opening = self._opening & self._affected
+        index   = numpy.nonzero(opening)[0]
+        accelerations = self._forces[index] / self._masses[index, numpy.newaxis]
+        levels  = self._blocks.chooseLevels(numpy.hypot(*self._velocities[index].T), numpy.hypot(*accelerations.T), self._dt)
+
+        # Шаг уровня level начинается только на шагах расчета, кратных 2^level
+        if ctx.iteration > 0:
+            levels = numpy.minimum(levels, (ctx.iteration & -ctx.iteration).bit_length() - 1)
+        for i, obj in zip(self._managedIndex, self._managed):
+            if opening[i]:
+                k = numpy.searchsorted(index, i)
+                levels[k] = min(levels[k], self._levelLimit(obj, ctx))
+
+        self._levels[index]     = levels
+        self._blockStart[index] = ctx.iteration
+        self._blockEnd[index]   = ctx.iteration + (1 << levels)
+        self._openAccelerations[index] = accelerations
+        self._closing = self._affected & (self._blockEnd == ctx.iteration + 1)
+
+    def _levelLimit(self, obj, ctx):
+        """Наибольший уровень шага объекта с собственным контроллером: шаг корабля без активных событий
+           не пересекает границу ближайшего события, остальные объекты движутся с шагом расчета
+        """
+        if not isinstance(obj, SpaceShip) or not obj.schedule.isIdle(ctx.t):
+            return 0
+        boundary = obj.schedule.nextBoundary(ctx.t)
+        if boundary == float('inf'):
+            return self._blocks.maxLevel
+        steps = int(math.ceil((boundary - ctx.t) / self._dt))
+        return max(0, steps.bit_length() - 1)
+
+    def kickBlocks(self, ctx, isClosing):
+        """Половинный толчок объектам, начинающим (isClosing = False) или завершающим свой шаг"""
+        index = numpy.nonzero((self._closing if isClosing else self._opening) & self._affected)[0]
+        h     = self._dt * 0.5 * (1 << self._levels[index])
+        self._velocities[index] += self._stageForces[index] * (h / self._masses[index])[:, numpy.newaxis]
+
+    def _syncedState(self, next):
+        """Координаты и скорости объектов к началу шага расчета next. Объекты в середине своего шага
+           получили половинный толчок в начале шага и движутся с постоянной скоростью - их состояние
+           пересчитывается по ускорению a в начале шага: через время e после начала шага длиной h
+           скорость отличается на a * (h / 2 - e), координаты - на a * e * (h - e) / 2
+        """
+        if self._blocks is None:
+            return self._positions, self._velocities
+        inside  = self._affected & (self._blockEnd > next) & (self._blockStart < next)
+        h       = (1 << self._levels[inside]) * self._dt
+        e       = (next - self._blockStart[inside]) * self._dt
+        a       = self._openAccelerations[inside]
+        positions, velocities = self._positions.copy(), self._velocities.copy()
+        positions[inside]  -= a * (0.5 * e * (h - e))[:, numpy.newaxis]
+        velocities[inside] -= a * (0.5 * h - e)[:, numpy.newaxis]
+        return positions, velocities
+
+    def updateForces(self, ctx):
+        """Пересчитать силы для текущих координат объектов (без расчета коллизий).
+           При блочных шагах силы пересчитываются только для объектов, завершающих свой шаг
+        """
+        targets = self._affected if self._blocks is None else self._affected & self._closing
+        gravity = self._gravityForces(targets)
+        if ctx.profiler is not None:
+            ctx.profiler.addInteractions(self._gravityModel.interactions)
+        if self._blocks is None:
+            self._stageForces[:] = self._external + gravity
+            self._stageForces[~self._affected] = 0.
+        else:
+            self._stageForces[targets] = self._external[targets] + gravity[targets]
+
+        for i, obj in zip(self._managedIndex, self._managed):
+            if targets[i]:
+                external = Vector(*self._external[i])
+                thrust   = _stageThrust(obj, external, Vector(*self._startVelocities[i]), Vector(*self._velocities[i]))
+                if thrust is not external:
+                    self._stageForces[i] += (thrust.x - external.x, thrust.y - external.y)
+
+    def _gravityForces(self, targets):
+        """Гравитационные силы, действующие на объекты targets (маска). Объекты, присоединенные
+           при столкновениях, притягивают другие объекты вместе с телом, к которому присоединены
+        """
+        if self._attached is None:
+            return self._gravityModel.forces(self._positions, self._masses, targets, self._fixed, self._sources)
+        masses  = self._masses + self._attached
+        gravity = self._gravityModel.forces(self._positions, masses, targets, self._fixed, self._sources)
+        gravity *= numpy.divide(self._masses, masses, out = numpy.ones_like(masses), where = masses > 0)[:, numpy.newaxis]
+        return gravity
+
+    def kick(self, h):
+        """Обновить скорости объектов на интервале h"""
+        idx = self._integrated
+        self._velocities[idx] += self._stageForces[idx] * (1. / self._masses[idx])[:, numpy.newaxis] * h
+
+    def drift(self, h):
+        """Обновить координаты объектов на интервале h"""
+        idx = self._integrated
+        self._positions[idx] += self._velocities[idx] * h
+
+    def getState(self):
+        """Координаты и скорости объектов, участвующих в динамическом расчете"""
+        return self._positions[self._stateIndex], self._velocities[self._stateIndex]
+
+    def setState(self, x, v):
+        """Задать координаты и скорости объектов, участвующих в динамическом расчете.
+           Объекты, столкнувшиеся в конце шага, остаются в точке столкновения
+        """
+        keep = self._affected[self._stateIndex]
+        idx  = self._stateIndex[keep]
+        self._positions[idx]  = x[keep]
+        self._velocities[idx] = v[keep]
+
+    def accelerations(self, remaining = 0.):
+        """Ускорения объектов, участвующих в динамическом расчете, на текущем этапе интегрирования.
+           remaining - время до конца шага, масса объектов к концу шага уже уменьшена на расход топлива
+        """
+        idx = self._integrated
+        accelerations = self._stageForces / self._masses[:, numpy.newaxis]
+        if remaining != 0:
+            for i, obj in zip(self._managedIndex, self._managed):
+                if self._affected[i]:
+                    correction = _massCorrection(obj, Vector(*self._velocities[i]), remaining)
+                    if correction is not None:
+                        accelerations[i] += (correction.x, correction.y)
+        return accelerations[idx]
+
+    def _collide(self, ctx):
+        """Расчет коллизий - столкнувшиеся объекты выбывают из расчета"""
+        hits = findCollisions(self._broadPhase, self._positions, self._radii, self._masses, self._affected)
+        for i, j in hits:
+            objA, objB = self._objects[i], self._objects[j]
+            self._scatter(i)
+            self._scatter(j)
+            relativePosition = Vector(*(self._positions[i] - self._positions[j]))
+            relativeVelocity = math.hypot(*(self._velocities[i] - self._velocities[j]))
+            _attachCollision(self._log, ctx, ctx.t, objA, objB, relativePosition, relativeVelocity)
+
+        if len(hits) > 0:
+            self._classify()
+
+    def _impacts(self, ctx):
+        """Столкновения внутри шага - объект переносится в точку столкновения"""
+        hits = findImpacts(self._broadPhase, self._startPositions, self._startVelocities, self._positions, self._velocities,
+                           ctx.dt, self._radii, self._masses, self._affected)
+        for i, j, theta in hits:
+            objA, objB = self._objects[i], self._objects[j]
+            xA, vA = hermite(self._startPositions[i], self._startVelocities[i], self._positions[i], self._velocities[i], ctx.dt, theta)
+            xB, vB = hermite(self._startPositions[j], self._startVelocities[j], self._positions[j], self._velocities[j], ctx.dt, theta)
+            self._positions[i], self._velocities[i], self._forces[i] = xA, vA, 0.
+            self._scatter(i)
+            self._scatter(j)
+            _attachCollision(self._log, ctx, ctx.t + theta * ctx.dt, objA, objB, Vector(*(xA - xB)), math.hypot(*(vA - vB)))
+
+        if len(hits) > 0:
+            self._classify()
+
+    def _escapes(self, ctx):
+        """Объекты, покинувшие область расчета (дальше Solver.escapeRadius от начала координат), выбывают из расчета"""
+        positions, velocities = self._syncedState(ctx.iteration + 1)
+        distances = numpy.einsum('ij,ij->i', positions, positions)
+        escaped   = numpy.nonzero(self._affected & (distances > self._escapeRadius * self._escapeRadius))[0]
+        for i in escaped:
+            self._scatter(i, positions, velocities)
+            _attachEscape(self._log, ctx.t + ctx.dt, self._objects[i])
+        if len(escaped) > 0:
+            self._classify()
+
+    def endStep(self, ctx):
+        """Завершить шаг расчета"""
+        self._impacts(ctx)
+        dynamic = self._dynamicIndex
+        self._accelerations[dynamic] = self._forces[dynamic] * (1. / self._masses[dynamic])[:, numpy.newaxis]
+        if self._escapeRadius is not None:
+            self._escapes(ctx)
+
+        positions, velocities = self._syncedState(ctx.iteration + 1)
+        for i, obj in zip(self._managedIndex, self._managed):
+            if self._affected[i]:
+                obj.setPositionXY(positions[i, 0],  positions[i, 1])
+                obj.setVelocityXY(velocities[i, 0], velocities[i, 1])
+            obj.setForceXY(self._forces[i, 0], self._forces[i, 1])
+        if self._blocks is None:
+            for obj in self._managed:
+                obj.endStep(ctx)
+        else:
+            # Объекты в середине своего шага только записываются в историю
+            ending = self._closing | ~self._affected
+            for i, obj in zip(self._managedIndex, self._managed):
+                if ending[i]:
+                    obj.endStep(ctx)
+                elif ctx.putIntoHistory:
+                    obj.putHistory(ctx.t)
+
+        if ctx.putIntoHistory:
+            for i in self._passiveIndex:
+                self._scatter(i, positions, velocities)
+                self._objects[i].putHistory(ctx.t)
+
+    def writeHistory(self, t):
+        """Записать текущее состояние объектов в историю в момент времени t"""
+        for i in self._passiveIndex:
+            self._scatter(i)
+            self._objects[i].putHistory(t)
+
+        # Состояние объектов, обслуживаемых контроллерами, хранится в самих объектах
+        for i, obj in zip(self._managedIndex, self._managed):
+            if self._affected[i]:
+                position, velocity = obj.position, obj.velocity
+                obj.position = Vector(self._positions[i, 0],  self._positions[i, 1])
+                obj.velocity = Vector(self._velocities[i, 0], self._velocities[i, 1])
+                obj.putHistory(t)
+                obj.position, obj.velocity = position, velocity
+            else:
+                obj.putHistory(t)
+
+    def sync(self, ctx):
+        """Перенести состояние пассивных объектов из массивов в объекты"""
+        positions, velocities = self._syncedState(ctx.iteration)
+        for i in self._passiveIndex:
+            self._scatter(i, positions, velocities)
+
+    def saveState(self):
+        """Собственное состояние ядра для контрольной точки: при блочных шагах - уровни и начала шагов объектов,
+           координаты и скорости в массивах (в объекты переносится состояние, пересчитанное на текущий момент)
+        """
+        if self._blocks is None:
+            return None
+        self._compact()
+        return self._positions.copy(), self._velocities.copy(), self._levels.copy(), self._blockStart.copy(), \
+               self._blockEnd.copy(), self._openAccelerations.copy()
+
+    def restoreState(self, state):
+        """Восстановить состояние, сохраненное saveState()"""
+        if state is None or self._blocks is None:
+            return
+        positions, velocities, self._levels, self._blockStart, self._blockEnd, self._openAccelerations = state
+        self._positions[:]  = positions
+        self._velocities[:] = velocities
+
+    def end(self, ctx):
+        """Завершение расчета"""
+        self.sync(ctx)
+        _followCarriers(self._allObjects)
+
+    def _gather(self, mask = None):
+        """Копирование состояния объектов, обслуживаемых контроллерами, в массивы (mask - только отмеченных объектов)"""
+        for i, obj in zip(self._managedIndex, self._managed):
+            if mask is not None and not mask[i]:
+                continue
+            position, velocity, force = obj.currentPosition, obj.currentVelocity, obj.currentForce
+            self._positions[i]  = (position.x, position.y)
+            self._velocities[i] = (velocity.x, velocity.y)
+            self._forces[i]     = (force.x, force.y)
+            self._masses[i]     = obj.mass
+
+    def _scatter(self, i, positions = None, velocities = None):
+        """Копирование состояния объекта из массивов в SpaceObject (positions, velocities - состояние для записи, если задано)"""
+        obj = self._objects[i]
+        positions  = self._positions  if positions  is None else positions
+        velocities = self._velocities if velocities is None else velocities
+        obj.setPositionXY(positions[i, 0],               positions[i, 1])
+        obj.setVelocityXY(velocities[i, 0],              velocities[i, 1])
+        obj.setAccelerationXY(self._accelerations[i, 0], self._accelerations[i, 1])
+        obj.setForceXY(self._forces[i, 0],               self._forces[i, 1])
+
+# Массивы ArrayEngine с данными по объектам (строка - объект), сжимаемые при выбывании объектов из расчета
+_rowArrays = ('_positions', '_velocities', '_accelerations', '_forces', '_external', '_startPositions', '_startVelocities',
+              '_stageForces', '_masses', '_radii', '_levels', '_blockStart', '_blockEnd', '_openAccelerations', '_opening', '_closing')
+
+class EngineFactory:
+    def objects():
+        """Ядро на объектах SpaceObject (по умолчанию)"""
+        return ObjectEngine()
+    def arrays():
+        """Векторизованное ядро на массивах numpy"""
+        return ArrayEngine()
\ No newline at end of file
@@ -0,0 +1,456 @@
+﻿# -*- coding: utf-8 -*-
+import math
+import numpy
+
+from orbitals.basicTypes import Vector
+from orbitals.gravity import G
+from orbitals.gravity import DirectGravity
+from orbitals.gravity import gravitySources
+from orbitals.collisions import hermite
+from orbitals.collisions import impactTimes
+from orbitals.types import SpaceShip
+from orbitals.types import BurnControlEvent
+from orbitals.types import StageSeparationControlEvent
+from orbitals.types import GravitySpaceObjectController
+from orbitals.types import DynamicSpaceObjectController
+from orbitals.types import StaticSpaceObjectController
+from orbitals.types import CollidedSpaceObjectController
+from orbitals.tools import ProgressBar
+
+def _rotate(x, y, axis):
+    """Поворот векторов (x, y) на угол осей axis (массив [..., 2]) - rotateXY() для массивов"""
+    length = numpy.sqrt(axis[..., 0] * axis[..., 0] + axis[..., 1] * axis[..., 1])
+    safe   = numpy.where(length > 0, length, 1.)
+    c      = numpy.where(length > 0, axis[..., 0] / safe, 1.)
+    s      = numpy.where(length > 0, axis[..., 1] / safe, 0.)
+    return numpy.stack((x * c - y * s, x * s + y * c), axis = -1)
+
+class _BurnSlot:
+    """Событие BurnControlEvent корабля ship во всех вариантах ансамбля"""
+    def __init__(self, ship, events):
+        self.ship     = ship
+        self.start    = numpy.array([event.start for event in events], dtype = numpy.float64)
+        self.end      = numpy.array([event.end   for event in events], dtype = numpy.float64)
+        self.forceX   = numpy.array([event._force.x for event in events], dtype = numpy.float64)
+        self.forceY   = numpy.array([event._force.y for event in events], dtype = numpy.float64)
+        self.fuelMass = numpy.array([event._fuelMass for event in events], dtype = numpy.float64)
+        self.duration = self.end - self.start
+        self.active   = numpy.array([event.isActive for event in events], dtype = bool)
+        self.burned   = numpy.array([event.burnedFuel for event in events], dtype = numpy.float64)
+
+    def apply(self, engine, live, t, dt):
+        """Применить событие к вариантам live (BurnControlEvent.apply)"""
+        n      = self.ship
+        window = (self.start <= t) & (self.end > t)
+        burn   = live & window
+        self.active = numpy.where(live, window, self.active)
+
+        burnedFuel = numpy.where(burn, self.fuelMass * dt / numpy.where(burn, self.duration, 1.), 0.)
+        engine._masses[:, n] -= burnedFuel
+        self.burned         += burnedFuel
+        engine._forces[burn, n] += self.thrust(engine._velocities[burn, n], burn)
+
+    def thrust(self, velocity, rows):
+        """Сила тяги вариантов rows при скоростях velocity"""
+        return _rotate(self.forceX[rows], self.forceY[rows], velocity)
+
+    @property
+    def massRate(self):
+        """Скорость расхода топлива, кг/с"""
+        return self.fuelMass / self.duration
+
+    def state(self, k):
+        """Состояние события варианта k (для BurnControlEvent.restoreState)"""
+        return {'_isActive': bool(self.active[k]), '_burnedFuel': float(self.burned[k])}
+
+class _SeparationSlot:
+    """Событие StageSeparationControlEvent корабля ship во всех вариантах ансамбля"""
+    def __init__(self, ship, events):
+        self.ship      = ship
+        self.start     = numpy.array([event.start for event in events], dtype = numpy.float64)
+        self.end       = numpy.array([event.end   for event in events], dtype = numpy.float64)
+        self.mass      = numpy.array([event._mass for event in events], dtype = numpy.float64)
+        self.active    = numpy.array([event.isActive for event in events], dtype = bool)
+        self.separated = numpy.array([event._separated for event in events], dtype = bool)
+
+    def apply(self, engine, live, t, dt):
+        """Применить событие к вариантам live (StageSeparationControlEvent.apply)"""
+        window = (self.start <= t) & (self.end > t)
+        drop   = live & window & ~self.separated
+        self.active    = numpy.where(live, window, self.active)
+        self.separated = self.separated | drop
+        engine._masses[:, self.ship] -= numpy.where(drop, self.mass, 0.)
+
+    def state(self, k):
+        """Состояние события варианта k (для StageSeparationControlEvent.restoreState)"""
+        return {'_isActive': bool(self.active[k]), '_separated': bool(self.separated[k])}
+
+class _EnsembleCtx:
+    """Контекст шага расчета ансамбля (время и шаг общие для всех вариантов)"""
+    def __init__(self, t, dt):
+        self.t  = t
+        self.dt = dt
+
+class EnsembleEngine:
+    """Вычислительное ядро ансамбля: K вариантов одного сценария в массивах numpy с ведущей осью варианта.
+       Координаты и скорости - [K, N, 2], массы - [K, N]. Гравитация (прямое суммирование),
+       события BurnControlEvent/StageSeparationControlEvent и столкновения считаются для всех вариантов сразу.
+       Реализует интерфейс ядра для интеграторов (updateForces, kick, drift, getState, setState, accelerations)
+    """
+    def __init__(self, members):
+        objects = members[0].objects
+        _validate(members)
+        self._count   = len(members)
+        self._names   = [obj.name for obj in objects]
+        self._fixed   = numpy.array([type(obj.controller) is StaticSpaceObjectController for obj in objects], dtype = bool)
+        self._sources = gravitySources(objects, members[0].gravity.sourceThreshold) # Источники гравитации (по первому варианту)
+        self._positions  = numpy.array([[(obj.position.x, obj.position.y) for obj in member.objects] for member in members], dtype = numpy.float64)
+        self._velocities = numpy.array([[(obj.velocity.x, obj.velocity.y) for obj in member.objects] for member in members], dtype = numpy.float64)
+        self._masses     = numpy.array([[obj.mass   for obj in member.objects] for member in members], dtype = numpy.float64)
+        self._radii      = numpy.array([[obj.radius for obj in member.objects] for member in members], dtype = numpy.float64)
+        self._affected   = numpy.repeat(~self._fixed[numpy.newaxis, :], self._count, axis = 0)
+        self._forces         = numpy.zeros(self._positions.shape)
+        self._external       = numpy.zeros(self._positions.shape)
+        self._stageForces    = numpy.zeros(self._positions.shape)
+        self._accelerations  = numpy.zeros(self._positions.shape)
+        self._startPositions  = self._positions.copy()
+        self._startVelocities = self._velocities.copy()
+        self._colliders      = numpy.full(self._masses.shape, -1, dtype = numpy.intp) # Объект, с которым столкнулся объект (-1 - нет)
+        self._offsets        = numpy.zeros(self._positions.shape)                    # Положение относительно него
+        self._collisionTimes = numpy.full(self._masses.shape, numpy.nan)             # Время столкновения
+        self._collisionStates = numpy.zeros(self._positions.shape + (2,))            # Координаты и скорость в момент столкновения
+        self._pairsA, self._pairsB = numpy.triu_indices(len(objects), 1)
+
+        # События кораблей в порядке их применения
+        self._slots = []
+        for n, obj in enumerate(objects):
+            if isinstance(obj, SpaceShip):
+                for e, event in enumerate(obj.events):
+                    events = [member.objects[n].events[e] for member in members]
+                    slot   = _BurnSlot if isinstance(event, BurnControlEvent) else _SeparationSlot
+                    self._slots.append(slot(n, events))
+        self._burns = [slot for slot in self._slots if isinstance(slot, _BurnSlot)]
+
+    @property
+    def count(self):
+        """Число вариантов"""
+        return self._count
+
+    def beginStep(self, ctx):
+        """Начать шаг расчета - события управления"""
+        self._forces.fill(0.)
+        for slot in self._slots:
+            slot.apply(self, self._colliders[:, slot.ship] < 0, ctx.t, ctx.dt)
+        self._external        = self._forces.copy()
+        self._startPositions  = self._positions.copy()
+        self._startVelocities = self._velocities.copy()
+
+    def runStep(self, ctx):
+        """Выполнить шаг расчета - столкновения и гравитация"""
+        # расчет коллизий - меньший по массе объект может столкнуться с большим по массе
+        rVectors  = self._positions[:, self._pairsB] - self._positions[:, self._pairsA]
+        distances = numpy.sqrt(numpy.einsum('kpi,kpi->kp', rVectors, rVectors))
+        touch     = distances <= self._radii[:, self._pairsA] + self._radii[:, self._pairsB]
+        for k, i, j, theta in self._select(touch, numpy.zeros(touch.shape)):
+            self._attach(k, i, j, self._positions[k, i] - self._positions[k, j], ctx.t)
+
+        self._forces += self._gravity()
+        self._forces[~self._affected] = 0.
+        self._stageForces = self._forces.copy()
+
+    def updateForces(self, ctx):
+        """Пересчитать силы для текущих координат объектов (без расчета коллизий)"""
+        self._stageForces[:] = self._external + self._gravity()
+        # Тяга пересчитывается для текущей скорости объекта
+        for slot in self._burns:
+            rows = slot.active & self._affected[:, slot.ship]
+            if rows.any():
+                self._stageForces[rows, slot.ship] += slot.thrust(self._velocities[rows, slot.ship], rows) \
+                                                    - slot.thrust(self._startVelocities[rows, slot.ship], rows)
+        self._stageForces[~self._affected] = 0.
+
+    def kick(self, h):
+        """Обновить скорости объектов на интервале h"""
+        self._velocities += numpy.where(self._affected[..., numpy.newaxis], self._stageForces * (1. / self._masses)[..., numpy.newaxis] * h, 0.)
+
+    def drift(self, h):
+        """Обновить координаты объектов на интервале h"""
+        self._positions += numpy.where(self._affected[..., numpy.newaxis], self._velocities * h, 0.)
+
+    def getState(self):
+        """Координаты и скорости объектов всех вариантов"""
+        return self._positions.copy(), self._velocities.copy()
+
+    def setState(self, x, v):
+        """Задать координаты и скорости объектов, участвующих в динамическом расчете"""
+        numpy.copyto(self._positions,  x, where = self._affected[..., numpy.newaxis])
+        numpy.copyto(self._velocities, v, where = self._affected[..., numpy.newaxis])
+
+    def accelerations(self, remaining = 0.):
+        """Ускорения объектов на текущем этапе интегрирования.
+           remaining - время до конца шага, масса объектов к концу шага уже уменьшена на расход топлива
+        """
+        accelerations = self._stageForces / self._masses[..., numpy.newaxis]
+        if remaining != 0:
+            # Поправка ускорения от тяги с учетом массы объекта за время remaining до конца шага
+            rates  = numpy.zeros(self._masses.shape)
+            thrust = numpy.zeros(self._positions.shape)
+            for slot in self._burns:
+                rows = slot.active
+                rates[rows, slot.ship]  += slot.massRate[rows]
+                thrust[rows, slot.ship] += slot.thrust(self._velocities[rows, slot.ship], rows)
+            accelerations += thrust * (1. / (self._masses + rates * remaining) - 1. / self._masses)[..., numpy.newaxis]
+        accelerations[~self._affected] = 0.
+        return accelerations
+
+    def endStep(self, ctx):
+        """Завершить шаг расчета - столкновения внутри шага, ускорения, движение столкнувшихся объектов"""
+        self._impacts(ctx)
+        self._accelerations = numpy.where(self._affected[..., numpy.newaxis], self._forces / self._masses[..., numpy.newaxis], 0.)
+
+        # Столкнувшиеся объекты движутся вместе с объектом, с которым столкнулись
+        k, i = numpy.nonzero(self._colliders >= 0)
+        for depth in range(len(self._names)):
+            self._positions[k, i] = self._positions[k, self._colliders[k, i]] + self._offsets[k, i]
+            if not (self._colliders[k, self._colliders[k, i]] >= 0).any():
+                break
+
+    def _impacts(self, ctx):
+        """Столкновения внутри шага - объект переносится в точку столкновения"""
+        h, a, b = ctx.dt, self._pairsA, self._pairsB
+        # Отсечение по окружностям, описанным вокруг траекторий на шаге (см. findObjectImpacts)
+        center = (self._startPositions + self._positions) / 2
+        chord  = self._positions - center
+        speed  = numpy.maximum(numpy.hypot(*numpy.moveaxis(self._startVelocities, -1, 0)), numpy.hypot(*numpy.moveaxis(self._velocities, -1, 0)))
+        extent = numpy.hypot(chord[..., 0], chord[..., 1]) + speed * h / 3. + self._radii
+        gap    = center[:, b] - center[:, a]
+        near   = numpy.einsum('kpi,kpi->kp', gap, gap) <= (extent[:, a] + extent[:, b])**2
+        near  &= self._able()
+        if not near.any():
+            return
+
+        k, p  = numpy.nonzero(near)
+        i, j  = a[p], b[p]
+        theta = numpy.full(near.shape, numpy.nan)
+        theta[k, p] = impactTimes(self._startPositions[k, i] - self._startPositions[k, j], self._startVelocities[k, i] - self._startVelocities[k, j],
+                                  self._positions[k, i] - self._positions[k, j], self._velocities[k, i] - self._velocities[k, j],
+                                  h, self._radii[k, i] + self._radii[k, j])
+        for k, i, j, theta in self._select(~numpy.isnan(theta), theta):
+            xA, vA = hermite(self._startPositions[k, i], self._startVelocities[k, i], self._positions[k, i], self._velocities[k, i], h, theta)
+            xB, vB = hermite(self._startPositions[k, j], self._startVelocities[k, j], self._positions[k, j], self._velocities[k, j], h, theta)
+            self._positions[k, i], self._velocities[k, i] = xA, vA
+            self._attach(k, i, j, xA - xB, ctx.t + theta * h)
+
+    def _able(self):
+        """Пары, в которых один из объектов может столкнуться с другим: [K, число пар]"""
+        a, b = self._pairsA, self._pairsB
+        ma, mb = self._masses[:, a], self._masses[:, b]
+        return ((ma < mb) & self._affected[:, a]) | ((mb < ma) & self._affected[:, b])
+
+    def _select(self, hit, theta):
+        """Столкновения (k, i, j, theta) по правилу findCollisions(): в варианте k меньший по массе
+           объект i, участвующий в расчете, сталкивается с объектом j - первое по времени касание,
+           при равном времени - первый по порядку партнер
+        """
+        hits = {}
+        for k, p in zip(*numpy.nonzero(hit & self._able())):
+            a, b = self._pairsA[p], self._pairsB[p]
+            i, j = (a, b) if self._masses[k, a] < self._masses[k, b] else (b, a)
+            key  = (int(k), int(i))
+            if key not in hits or (theta[k, p], j) < hits[key]:
+                hits[key] = (theta[k, p], int(j))
+        return [(k, i, j, t) for (k, i), (t, j) in sorted(hits.items())]
+
+    def _attach(self, k, i, j, offset, t):
+        """Объект i варианта k столкнулся с объектом j в момент t и далее движется вместе с ним"""
+        self._colliders[k, i]      = j
+        self._offsets[k, i]        = offset
+        self._collisionTimes[k, i] = t
+        self._collisionStates[k, i, :, 0] = self._positions[k, i]
+        self._collisionStates[k, i, :, 1] = self._velocities[k, i]
+        self._affected[k, i]       = False
+        self._forces[k, i]         = 0.
+
+    def _gravity(self):
+        """Гравитационные силы для объектов, участвующих в динамическом расчете: [K, N, 2].
+           Силы суммируются только от источников гравитации - [K, N, S]
+        """
+        sources   = self._sources
+        rVectors  = self._positions[:, numpy.newaxis, sources, :] - self._positions[:, :, numpy.newaxis, :]
+        distances = numpy.sqrt(numpy.einsum('kijd,kijd->kij', rVectors, rVectors))
+        safe      = numpy.where(distances > 0, distances, 1.)
+        factor    = numpy.where(distances > 0, G * self._masses[:, :, numpy.newaxis] * self._masses[:, numpy.newaxis, sources] / safe**3, 0.)
+        gravity   = numpy.einsum('kij,kijd->kid', factor, rVectors)
+        gravity[~self._affected] = 0.
+        return gravity
+
+def _validate(members):
+    """Проверка совместимости вариантов ансамбля"""
+    first = members[0]
+    if not isinstance(first.gravity, DirectGravity):
+        raise Exception('Gravity model "{0}" is not supported by EnsembleSolver'.format(first.gravity.name))
+    if first.timeRange.isAdaptive:
+        raise Exception('EnsembleSolver requires a fixed time step')
+    if first.integrator.isBlock:
+        raise Exception('Integrator "{0}" is not supported by EnsembleSolver'.format(first.integrator.name))
+    if any(member.stopConditions for member in members):
+        raise Exception('Stop conditions are not supported by EnsembleSolver')
+    if any(member.escapeRadius is not None for member in members):
+        raise Exception('Escape radius is not supported by EnsembleSolver')
+    if any(member.coast is not None for member in members):
+        raise Exception('Kepler coasting is not supported by EnsembleSolver')
+    for member in members:
+        if [obj.name for obj in member.objects] != [obj.name for obj in first.objects]:
+            raise Exception('Ensemble members must contain the same objects')
+        if member.timeRange.iterations != first.timeRange.iterations or member.timeRange.timeStep != first.timeRange.timeStep:
+            raise Exception('Ensemble members must share the time range')
+        for obj, base in zip(member.objects, first.objects):
+            controller = obj.controller
+            if type(controller) is not type(base.controller):
+                raise Exception('Object "{0}" has different controllers in ensemble members'.format(obj.name))
+            chained = getattr(controller, '_nextController', None)
+            if type(controller) not in (GravitySpaceObjectController, DynamicSpaceObjectController, StaticSpaceObjectController) \
+               or (chained is not None and (type(chained) is not GravitySpaceObjectController or chained._nextController is not None)):
+                raise Exception('Controller of object "{0}" is not supported by EnsembleSolver'.format(obj.name))
+            if isinstance(obj, SpaceShip):
+                types = [type(event) for event in obj.events]
+                if types != [type(event) for event in base.events]:
+                    raise Exception('Object "{0}" has different control events in ensemble members'.format(obj.name))
+                if any(t not in (BurnControlEvent, StageSeparationControlEvent) for t in types):
+                    raise Exception('Control events of object "{0}" are not supported by EnsembleSolver'.format(obj.name))
+
+class EnsembleSolver:
+    """Расчет ансамбля - K вариантов одного сценария, интегрируемых как одно векторизованное состояние.
+       builder(**parameters) строит Solver варианта; варианты должны содержать одинаковые объекты,
+       контроллеры и типы событий управления и могут отличаться параметрами (массы, тяга, углы,
+       время событий, начальное состояние). Шаг, интегратор и интервал записи берутся из первого варианта.
+       История вариантов доступна после расчета через member(k)
+    """
+    def __init__(self, builder, parameters):
+        self._parameters = list(parameters)
+        self._members    = [builder(**values) for values in self._parameters]
+        self._engine     = None
+        self._times      = []
+        self._history    = None # Записанные состояния: [точка, величина, K, N, 2]
+        self._extracted  = set()
+
+    @property
+    def parameters(self):
+        """Параметры вариантов"""
+        return self._parameters
+
+    @property
+    def count(self):
+        """Число вариантов"""
+        return len(self._members)
+
+    @property
+    def times(self):
+        """Список точек оси времени"""
+        return self._times
+
+    @property
+    def positions(self):
+        """Координаты объектов в конце расчета: [K, N, 2]"""
+        return self._engine._positions
+
+    @property
+    def velocities(self):
+        """Скорости объектов в конце расчета: [K, N, 2]"""
+        return self._engine._velocities
+
+    @property
+    def masses(self):
+        """Массы объектов в конце расчета: [K, N]"""
+        return self._engine._masses
+
+    @property
+    def collisionTimes(self):
+        """Время столкновения объектов (nan - столкновения не было): [K, N]"""
+        return self._engine._collisionTimes
+
+    def run(self):
+        """Запустить расчет"""
+        first      = self._members[0]
+        timeRange  = first.timeRange
+        integrator = first.integrator
+        interval   = first.historyInterval
+        engine     = EnsembleEngine(self._members)
+        ctx        = _EnsembleCtx(timeRange.beginTime, timeRange.timeStep)
+        self._engine  = engine
+        self._times   = []
+        self._history = numpy.empty((int(math.ceil(timeRange.iterations / interval)), 4) + engine._positions.shape)
+        self._extracted.clear()
+
+        bar = None
+        if not first.quiet:
+            print ('Расчет ансамбля: {0} вариантов'.format(self.count))
+            bar = ProgressBar()
+        for i in range(timeRange.iterations):
+            engine.beginStep(ctx)
+            engine.runStep(ctx)
+            integrator.step(engine, ctx)
+            engine.endStep(ctx)
+            if i % interval == 0:
+                record = self._history[len(self._times)]
+                record[0], record[1], record[2], record[3] = engine._positions, engine._velocities, engine._accelerations, engine._forces
+                self._times.append(ctx.t)
+
+            ctx.t = ctx.t + ctx.dt
+            if bar is not None:
+                bar.update(i, timeRange.iterations)
+        if bar is not None:
+            bar.end()
+            print ('Расчет ансамбля завершен')
+
+    def member(self, k):
+        """Solver варианта k: история объектов, конечное состояние и события управления по результатам расчета.
+           История столкнувшихся объектов, как и при расчете Solver, завершается состоянием в момент столкновения
+        """
+        solver = self._members[k]
+        if k in self._extracted:
+            return solver
+
+        engine  = self._engine
+        count   = len(self._times)
+        ts      = numpy.array(self._times)
+        history = self._history[:count, :, k]
+        dt      = solver.timeRange.timeStep
+        for n, obj in enumerate(solver.objects):
+            obj.position = Vector(*engine._positions[k, n])
+            obj.velocity = Vector(*engine._velocities[k, n])
+            obj.mass     = engine._masses[k, n]
+            values = (obj.positionHistory, obj.velocityHistory, obj.accelerationHistory, obj.forceHistory)
+            if engine._colliders[k, n] < 0:
+                for value, series in zip(values, range(4)):
+                    value.extend(ts, history[:, series, n, 0], history[:, series, n, 1])
+                continue
+
+            # Точки, записанные до шага столкновения, и состояние в момент столкновения
+            t    = engine._collisionTimes[k, n]
+            last = int(numpy.searchsorted(ts + dt * (1. - 1E-6), t, side = 'right'))
+            for value, series in zip(values, range(4)):
+                value.extend(ts[:last], history[:last, series, n, 0], history[:last, series, n, 1])
+            state = engine._collisionStates[k, n]
+            for value, (x, y) in zip(values, (state[:, 0], state[:, 1], (0., 0.), (0., 0.))):
+                value.putXY(t, x, y)
+                value.trim()
+            collider = solver.objects[engine._colliders[k, n]]
+            CollidedSpaceObjectController(collider, Vector(*engine._offsets[k, n]), t).attach(obj)
+
+        # Столкнувшиеся объекты находятся в точках тел, с которыми столкнулись
+        for obj in solver.objects:
+            if isinstance(obj.controller, CollidedSpaceObjectController):
+                obj.controller.follow()
+
+        events = {}
+        for slot in engine._slots:
+            events.setdefault(slot.ship, []).append(slot)
+        for n, slots in events.items():
+            for event, slot in zip(solver.objects[n].events, slots):
+                event.restoreState(slot.state(k))
+            solver.objects[n].schedule.invalidate()
+
+        solver.times.extend(self._times)
+        self._extracted.add(k)
+        return solver
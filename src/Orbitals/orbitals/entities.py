@@ -17,6 +17,7 @@ class EntityFactory:
         """Конструктор Земли (статической)"""
         earth = SpaceObject('Earth', mass = 5.97219E24, radius = unit.dimension.km(6371))
         earth.isStatic = True
+        earth.isGravitySource = True
         StaticSpaceObjectController().attach(earth)
         return earth
 
@@ -25,6 +26,7 @@ class EntityFactory:
         moon = SpaceObject('Moon', mass = 5.97219E24, radius = 1.73814E6);
         moon.position = Vector(0, 4.05696E8)
         moon.velocity = Vector(1.023E3, 0)
+        moon.isGravitySource = True
         return moon
 
     def falcon9Stage1():
@@ -33,8 +35,8 @@ class EntityFactory:
         falcon9st1.addEvent(controlEvent.burn([0, 180], force = Vector.fromPolar(4086E3, 180), fuel = 2.393E5))
         return falcon9st1
 
-    def protonM():
-        """Конструктор Протон-М (который летает)"""
+    def protonM(turnAngle = 45):
+        """Конструктор Протон-М (который летает), turnAngle - угол тяги ступени 2 до грав. маневра, град"""
         st1DryMass        = unit.mass.t(30.6)      # Ступень 1 - сухая масса
         st1FueledMass     = unit.mass.t(458.9)     # Ступень 1 - стартовая масса
         st1PropellantMass = st1FueledMass - st1DryMass      # Ступень 1 - масса топлива
@@ -70,7 +72,7 @@ class EntityFactory:
         t = t + separationTime
 
         # Запуск ступени 2  / до грав. маневра
-        protonM.addEvent(controlEvent.burn([t, t + st2BurnTime/2], force = Vector.fromPolar(st2Thrust, 45), fuel = st2PropellantMass))
+        protonM.addEvent(controlEvent.burn([t, t + st2BurnTime/2], force = Vector.fromPolar(st2Thrust, turnAngle), fuel = st2PropellantMass))
         t = t + st2BurnTime/2
         # Запуск ступени 2  / грав. маневр
         protonM.addEvent(controlEvent.burn([t, t + st2BurnTime/2], force = Vector.fromPolar(st2Thrust, 0), fuel = st2PropellantMass/2))
@@ -92,8 +94,8 @@ class EntityFactory:
         
         return protonM
 
-    def falcon9():
-        """Конструктор Falcon9"""
+    def falcon9(turnAngle = -8):
+        """Конструктор Falcon9, turnAngle - угол тяги ступени 1 при грав. маневре, град"""
         st1DryMass        = unit.mass.t(19.24)     # Ступень 1 - сухая масса
         st1PropellantMass = unit.mass.t(239.3)     # Ступень 1 - масса топлива
         st1Thrust         = unit.force.kN(4086)    # Ступень 1 - тяга
@@ -117,11 +119,11 @@ class EntityFactory:
         t = t + st1BurnTime / 3
 
         # Запуск ступени 1 / грав. маневр
-        falcon9.addEvent(controlEvent.burn([t, t + st1BurnTime / 3], force = Vector.fromPolar(st1Thrust, -8), fuel =  st1PropellantMass/3))
+        falcon9.addEvent(controlEvent.burn([t, t + st1BurnTime / 3], force = Vector.fromPolar(st1Thrust, turnAngle), fuel =  st1PropellantMass/3))
         t = t + st1BurnTime / 3
 
         # Запуск ступени 1 / грав. маневр
-        falcon9.addEvent(controlEvent.burn([t, t + st1BurnTime / 3], force = Vector.fromPolar(st1Thrust, -8), fuel =  st1PropellantMass/3))
+        falcon9.addEvent(controlEvent.burn([t, t + st1BurnTime / 3], force = Vector.fromPolar(st1Thrust, turnAngle), fuel =  st1PropellantMass/3))
         t = t + st1BurnTime / 3
 
         # Отделение ступени 1 
@@ -0,0 +1,339 @@
+﻿# -*- coding: utf-8 -*-
+import math
+import numpy
+
+from orbitals.tools import expandRanges
+
+# гравитационная постоянная
+G = 6.67384 * math.pow(10, -11) # м^3 кг^-1 с^-2
+
+def gravitySources(objects, threshold):
+    """Маска источников гравитации среди объектов objects.
+       Признак SpaceObject.isGravitySource, если он задан, имеет приоритет; иначе источниками считаются
+       объекты с массой не менее threshold от массы самого тяжелого объекта, остальные - пробные частицы
+       (притягиваются источниками, но сами ни на кого не действуют)
+    """
+    masses = [obj.mass for obj in objects]
+    limit  = threshold * max(masses) if masses else 0.
+    return numpy.array([obj.isGravitySource if obj.isGravitySource is not None else mass >= limit
+                        for obj, mass in zip(objects, masses)], dtype = bool)
+
+class DirectGravity:
+    """Прямое суммирование гравитации по всем парам объектов - O(N^2).
+       Для небольшого числа объектов каждая пара считается один раз (третий закон Ньютона),
+       для большого - суммирование ведется блоками целевых объектов, чтобы ограничить объем памяти.
+       Если среди объектов есть пробные частицы, суммируются только силы от источников - O(N * S)
+    """
+    pairsLimit = 1 << 20 # Максимальное число пар, обрабатываемых за один раз
+
+    def __init__(self, sourceThreshold = 1E-10):
+        self._sourceThreshold = sourceThreshold # Порог массы источника относительно самого тяжелого объекта
+        self._count  = -1   # Число объектов, для которого построены пары
+        self._pairsA = None # Пары объектов (i < j)
+        self._pairsB = None
+        self._interactions = 0
+
+    def __getstate__(self):
+        """Состояние для pickle - кэш пар не сохраняется"""
+        state = dict(self.__dict__)
+        state['_count'], state['_pairsA'], state['_pairsB'] = -1, None, None
+        return state
+
+    @property
+    def name(self):
+        """Название алгоритма"""
+        return 'direct'
+
+    @property
+    def sourceThreshold(self):
+        """Порог массы источника гравитации относительно самого тяжелого объекта (0 - все объекты источники)"""
+        return self._sourceThreshold
+
+    @property
+    def interactions(self):
+        """Число парных взаимодействий, вычисленных при последнем вызове forces()"""
+        return self._interactions
+
+    def sources(self, objects):
+        """Маска источников гравитации среди объектов objects (None - все объекты являются источниками)"""
+        mask = gravitySources(objects, self._sourceThreshold)
+        return None if mask.all() else mask
+
+    def forces(self, positions, masses, targets, fixed = None, sources = None):
+        """Гравитационные силы, действующие на объекты targets (маска), Н.
+           fixed - маска неподвижных источников (для прямого суммирования не используется),
+           sources - маска источников гравитации (None - все объекты)
+        """
+        count = len(masses)
+        index = numpy.nonzero(targets)[0]
+        # Пробные частицы не притягивают другие объекты - суммируются только силы от источников
+        if sources is not None:
+            sourceIndex = numpy.nonzero(sources)[0]
+            self._interactions = len(index) * len(sourceIndex)
+            return _blockForces(positions, masses, index, positions[sourceIndex], masses[sourceIndex])
+        # Если целевых объектов мало (напр. при блочных шагах), считаются только их взаимодействия
+        if count * (count - 1) // 2 > DirectGravity.pairsLimit or 2 * len(index) < count - 1:
+            self._interactions = len(index) * count
+            return _blockForces(positions, masses, index, positions, masses)
+
+        if count != self._count:
+            self._count = count
+            self._pairsA, self._pairsB = numpy.triu_indices(count, 1)
+
+        a, b      = self._pairsA, self._pairsB
+        self._interactions = len(a)
+        rVectors  = positions[b] - positions[a]
+        distances = numpy.sqrt(numpy.einsum('ij,ij->i', rVectors, rVectors))
+        safe      = numpy.where(distances > 0, distances, 1.)
+        factor    = numpy.where(distances > 0, G * masses[a] * masses[b] / safe**3, 0.)
+        forces    = rVectors * factor[:, numpy.newaxis]
+        gravity   = numpy.empty((count, 2))
+        for k in range(2):
+            gravity[:, k] = numpy.bincount(a, weights = forces[:, k], minlength = count) \
+                          - numpy.bincount(b, weights = forces[:, k], minlength = count)
+        gravity[~targets] = 0.
+        return gravity
+
+class BarnesHutGravity:
+    """Приближенный расчет гравитации по алгоритму Барнса-Хата - O(N log N).
+       Квадродерево строится заново на каждом вызове по кодам Мортона отсортированных объектов,
+       обход дерева выполняется для всех целевых объектов одновременно, уровень за уровнем.
+       Узел дерева размера s на расстоянии d от центра масс заменяется точечной массой при s / d < theta.
+       Неподвижные источники (напр. статическая Земля) в дерево не входят и суммируются напрямую,
+       пробные частицы в дерево не входят и только обходят его
+    """
+    levels    = 21   # Глубина дерева (разрядность кодов Мортона по каждой оси)
+    blockSize = 4096 # Число целевых объектов, обходящих дерево одновременно
+
+    def __init__(self, theta = 0.5, sourceThreshold = 1E-10):
+        self._theta           = theta           # Критерий раскрытия узла
+        self._sourceThreshold = sourceThreshold # Порог массы источника относительно самого тяжелого объекта
+        self._interactions    = 0
+
+    @property
+    def name(self):
+        """Название алгоритма"""
+        return 'barnesHut'
+
+    @property
+    def theta(self):
+        """Критерий раскрытия узла (0 - прямое суммирование)"""
+        return self._theta
+
+    @property
+    def sourceThreshold(self):
+        """Порог массы источника гравитации относительно самого тяжелого объекта (0 - все объекты источники)"""
+        return self._sourceThreshold
+
+    @property
+    def interactions(self):
+        """Число взаимодействий (с объектами и узлами дерева), вычисленных при последнем вызове forces()"""
+        return self._interactions
+
+    def sources(self, objects):
+        """Маска источников гравитации среди объектов objects (None - все объекты являются источниками)"""
+        mask = gravitySources(objects, self._sourceThreshold)
+        return None if mask.all() else mask
+
+    def forces(self, positions, masses, targets, fixed = None, sources = None):
+        """Гравитационные силы, действующие на объекты targets (маска), Н.
+           fixed - маска неподвижных источников, суммируемых напрямую,
+           sources - маска источников гравитации (None - все объекты)
+        """
+        count   = len(masses)
+        gravity = numpy.zeros((count, 2))
+        self._interactions = 0
+        if fixed is None:
+            fixed = numpy.zeros(count, dtype = bool)
+        if sources is None:
+            sources = numpy.ones(count, dtype = bool)
+        targetIndex = numpy.nonzero(targets)[0]
+        if len(targetIndex) == 0:
+            return gravity
+
+        fixedIndex = numpy.nonzero(fixed & sources)[0]
+        if len(fixedIndex) > 0:
+            self._interactions = len(targetIndex) * len(fixedIndex)
+            gravity[targetIndex] += _blockForces(positions[targetIndex], masses[targetIndex], None, positions[fixedIndex], masses[fixedIndex])
+
+        members = numpy.nonzero(~fixed & sources)[0]
+        if len(members) > 0:
+            gravity += self._treeForces(positions, masses, targets, members)
+        return gravity
+
+    def _treeForces(self, positions, masses, targets, members):
+        """Силы от объектов members, рассчитанные обходом квадродерева"""
+        count = len(masses)
+        tree  = _QuadTree(positions[members], masses[members], BarnesHutGravity.levels)
+
+        # Позиция каждого объекта в отсортированном порядке дерева (-1 - объект не входит в дерево)
+        rank = numpy.full(count, -1, dtype = numpy.intp)
+        rank[members[tree.order]] = numpy.arange(len(members))
+
+        # Целевые объекты обходят дерево блоками, чтобы ограничить число одновременных взаимодействий
+        index   = numpy.nonzero(targets)[0]
+        gravity = numpy.zeros((count, 2))
+        for begin in range(0, len(index), BarnesHutGravity.blockSize):
+            self._walk(tree, positions, masses, members, rank, index[begin:begin + BarnesHutGravity.blockSize], gravity)
+        return gravity
+
+    def _walk(self, tree, positions, masses, members, rank, ti, gravity):
+        """Обход дерева для целевых объектов ti, силы добавляются к gravity"""
+        tn = numpy.zeros(len(ti), dtype = numpy.intp) # Узлы дерева текущего уровня
+        for level in range(tree.depth + 1):
+            if len(ti) == 0:
+                return
+            node     = tree.level(level)
+            size     = tree.size / (1 << level)
+            start    = node.start[tn]
+            counts   = node.count[tn]
+            dx       = node.cx[tn] - positions[ti, 0]
+            dy       = node.cy[tn] - positions[ti, 1]
+            distance = numpy.sqrt(dx*dx + dy*dy)
+            contains = (start <= rank[ti]) & (rank[ti] < start + counts)
+            single   = counts == 1
+            accept   = ~contains & (single | (size < self._theta * distance))
+
+            # Узел принят - взаимодействие с точечной массой в центре масс узла
+            k = accept & (distance > 0)
+            self._interactions += int(numpy.count_nonzero(k))
+            _accumulate(gravity, ti[k], dx[k], dy[k], distance[k], masses[ti[k]] * node.mass[tn[k]])
+
+            # Узел раскрывается - переходим к дочерним узлам
+            rest   = ~accept & ~single
+            ti, tn = ti[rest], tn[rest]
+            if level == tree.depth:
+                # Объекты, неразличимые на последнем уровне, суммируются напрямую
+                bodies   = members[tree.order[expandRanges(node.start[tn], node.count[tn])]]
+                ti       = numpy.repeat(ti, node.count[tn])
+                dx       = positions[bodies, 0] - positions[ti, 0]
+                dy       = positions[bodies, 1] - positions[ti, 1]
+                distance = numpy.sqrt(dx*dx + dy*dy)
+                k        = distance > 0
+                self._interactions += int(numpy.count_nonzero(k))
+                _accumulate(gravity, ti[k], dx[k], dy[k], distance[k], masses[ti[k]] * masses[bodies[k]])
+                return
+            children = node.childCount[tn]
+            tn = expandRanges(node.childFirst[tn], children)
+            ti = numpy.repeat(ti, children)
+
+class _QuadTreeLevel:
+    """Узлы одного уровня квадродерева"""
+    def __init__(self, start, count, mass, cx, cy):
+        self.start      = start # Индекс первого объекта узла в отсортированном порядке
+        self.count      = count # Число объектов в узле
+        self.mass       = mass  # Масса узла
+        self.cx         = cx    # Центр масс узла
+        self.cy         = cy
+        self.childFirst = None  # Индекс первого дочернего узла на следующем уровне
+        self.childCount = None  # Число дочерних узлов
+
+class _QuadTree:
+    """Квадродерево на кодах Мортона - узлы уровня l соответствуют различным префиксам кодов длины 2l"""
+    def __init__(self, positions, masses, depth):
+        low   = positions.min(axis = 0)
+        size  = float((positions.max(axis = 0) - low).max())
+        size  = size * (1. + 1E-9) if size > 0 else 1.
+        cells = numpy.floor((positions - low) / size * (1 << depth)).astype(numpy.uint64)
+        cells = numpy.minimum(cells, numpy.uint64((1 << depth) - 1))
+        codes = _interleave(cells[:, 0]) | (_interleave(cells[:, 1]) << numpy.uint64(1))
+
+        self._order  = numpy.argsort(codes, kind = 'stable')
+        self._size   = size
+        self._depth  = depth
+        self._levels = []
+
+        codes = codes[self._order]
+        m     = masses[self._order]
+        mx    = m * positions[self._order, 0]
+        my    = m * positions[self._order, 1]
+        for level in range(depth + 1):
+            keys  = codes >> numpy.uint64(2 * (depth - level))
+            start = numpy.flatnonzero(numpy.concatenate(([True], keys[1:] != keys[:-1])))
+            count = numpy.diff(numpy.append(start, len(keys)))
+            mass  = numpy.add.reduceat(m, start)
+            safe  = numpy.where(mass > 0, mass, 1.)
+            self._levels.append(_QuadTreeLevel(start, count, mass,
+                                               numpy.add.reduceat(mx, start) / safe,
+                                               numpy.add.reduceat(my, start) / safe))
+
+        # Дочерние узлы - непрерывный диапазон узлов следующего уровня
+        for parent, child in zip(self._levels, self._levels[1:]):
+            parent.childFirst = numpy.searchsorted(child.start, parent.start)
+            parent.childCount = numpy.diff(numpy.append(parent.childFirst, len(child.start)))
+
+    @property
+    def order(self):
+        """Порядок объектов по кодам Мортона"""
+        return self._order
+
+    @property
+    def size(self):
+        """Размер корневого узла, м"""
+        return self._size
+
+    @property
+    def depth(self):
+        """Глубина дерева"""
+        return self._depth
+
+    def level(self, level):
+        """Узлы уровня level"""
+        return self._levels[level]
+
+def _interleave(v):
+    """Разрядить биты числа (bit i -> bit 2i) для построения кода Мортона"""
+    v = v & numpy.uint64(0x00000000FFFFFFFF)
+    v = (v | (v << numpy.uint64(16))) & numpy.uint64(0x0000FFFF0000FFFF)
+    v = (v | (v << numpy.uint64(8)))  & numpy.uint64(0x00FF00FF00FF00FF)
+    v = (v | (v << numpy.uint64(4)))  & numpy.uint64(0x0F0F0F0F0F0F0F0F)
+    v = (v | (v << numpy.uint64(2)))  & numpy.uint64(0x3333333333333333)
+    v = (v | (v << numpy.uint64(1)))  & numpy.uint64(0x5555555555555555)
+    return v
+
+def _accumulate(gravity, ti, dx, dy, distance, mm):
+    """Добавить силы притяжения G * mm / distance^2 вдоль (dx, dy) к объектам ti"""
+    if len(ti) == 0:
+        return
+    count  = len(gravity)
+    factor = G * mm / distance**3
+    gravity[:, 0] += numpy.bincount(ti, weights = dx * factor, minlength = count)
+    gravity[:, 1] += numpy.bincount(ti, weights = dy * factor, minlength = count)
+
+def _blockForces(positions, masses, targetIndex, sourcePositions, sourceMasses):
+    """Прямое суммирование сил от источников блоками целевых объектов.
+       targetIndex - индексы целевых объектов в positions (None - все объекты positions);
+       при заданном targetIndex результат возвращается для всех объектов positions
+    """
+    count   = len(masses)
+    index   = numpy.arange(count) if targetIndex is None else targetIndex
+    gravity = numpy.zeros((count, 2))
+    block   = max(1, DirectGravity.pairsLimit // max(1, len(sourceMasses)))
+    for begin in range(0, len(index), block):
+        i        = index[begin:begin + block]
+        rVectors = sourcePositions[numpy.newaxis, :, :] - positions[i, numpy.newaxis, :]
+        squared  = numpy.einsum('ijk,ijk->ij', rVectors, rVectors)
+        safe     = numpy.where(squared > 0, squared, 1.)
+        factor   = numpy.where(squared > 0, G * sourceMasses[numpy.newaxis, :] / (safe * numpy.sqrt(safe)), 0.)
+        gravity[i] = numpy.einsum('ij,ijk->ik', factor, rVectors) * masses[i, numpy.newaxis]
+    return gravity
+
+def forceError(model, positions, masses, targets, fixed = None, sources = None):
+    """Относительная ошибка сил model по сравнению с прямым суммированием: (медиана, 99-й процентиль, максимум)"""
+    exact    = DirectGravity().forces(positions, masses, targets, fixed, sources)[targets]
+    approx   = model.forces(positions, masses, targets, fixed, sources)[targets]
+    norm     = numpy.hypot(exact[:, 0], exact[:, 1])
+    relative = numpy.hypot(*(approx - exact).T) / numpy.where(norm > 0, norm, 1.)
+    return float(numpy.median(relative)), float(numpy.percentile(relative, 99)), float(relative.max())
+
+class GravityFactory:
+    def direct(sourceThreshold = 1E-10):
+        """Прямое суммирование по всем парам объектов (по умолчанию).
+           Объекты легче sourceThreshold от самого тяжелого считаются пробными частицами
+        """
+        return DirectGravity(sourceThreshold)
+    def barnesHut(theta = 0.5, sourceThreshold = 1E-10):
+        """Алгоритм Барнса-Хата с критерием раскрытия узла theta.
+           Объекты легче sourceThreshold от самого тяжелого считаются пробными частицами
+        """
+        return BarnesHutGravity(theta, sourceThreshold)
@@ -0,0 +1,172 @@
+﻿# -*- coding: utf-8 -*-
+import io
+import os
+
+import numpy
+import numpy.lib.format
+
+from orbitals.basicTypes import VectorHistory
+
+class MappedColumns:
+    """Столбцы (t, x, y) истории величины в файлах .npy на диске.
+       Значения дописываются в конец файлов, заголовок .npy обновляется при каждой записи,
+       поэтому файлы в любой момент читаются через numpy.load(path, mmap_mode = 'r').
+       Файлы открываются только на время записи - число объектов не ограничено числом дескрипторов
+    """
+    dtype = numpy.dtype('<f8')
+
+    def __init__(self, paths):
+        self._paths      = paths # Файлы столбцов t, x, y
+        self._count      = 0     # Число записанных значений
+        self._headerSize = len(MappedColumns._header(0))
+        self._views      = None  # Отображения файлов в память для текущего числа значений
+
+    @staticmethod
+    def create(paths):
+        """Создать пустые файлы столбцов"""
+        columns = MappedColumns(paths)
+        for path in paths:
+            with open(path, 'wb') as file:
+                file.write(MappedColumns._header(0))
+        return columns
+
+    @staticmethod
+    def open(paths):
+        """Открыть существующие файлы столбцов"""
+        columns = MappedColumns(paths)
+        counts  = [numpy.load(path, mmap_mode = 'r').shape[0] for path in paths]
+        columns._count = min(counts)
+        return columns
+
+    @staticmethod
+    def _header(count):
+        """Заголовок файла .npy для одномерного массива из count значений"""
+        buffer = io.BytesIO()
+        numpy.lib.format.write_array_header_1_0(buffer, {'descr': MappedColumns.dtype.str, 'fortran_order': False, 'shape': (count,)})
+        return buffer.getvalue()
+
+    def __len__(self):
+        """Число записанных значений"""
+        return self._count
+
+    def __getstate__(self):
+        """Состояние для pickle - файлы не копируются, сохраняется только число значений"""
+        state = dict(self.__dict__)
+        state['_views'] = None
+        return state
+
+    @property
+    def paths(self):
+        """Файлы столбцов t, x, y"""
+        return self._paths
+
+    @property
+    def nbytes(self):
+        """Объем записанных данных, байт"""
+        return 3 * self._count * MappedColumns.dtype.itemsize
+
+    def append(self, ts, xs, ys):
+        """Дописать значения в конец столбцов"""
+        count = self._count + len(ts)
+        for path, values in zip(self._paths, (ts, xs, ys)):
+            with open(path, 'r+b') as file:
+                file.seek(self._headerSize + self._count * MappedColumns.dtype.itemsize)
+                file.write(numpy.ascontiguousarray(values, dtype = MappedColumns.dtype).tobytes())
+                self._writeHeader(file, count)
+        self._count = count
+        self._views = None
+
+    def truncate(self, count):
+        """Отбросить значения после первых count (напр. записанные после контрольной точки)"""
+        for path in self._paths:
+            with open(path, 'r+b') as file:
+                file.truncate(self._headerSize + count * MappedColumns.dtype.itemsize)
+                self._writeHeader(file, count)
+        self._count = count
+        self._views = None
+
+    def _writeHeader(self, file, count):
+        """Обновить число значений в заголовке файла"""
+        header = MappedColumns._header(count)
+        if len(header) != self._headerSize:
+            raise Exception('Size of the .npy header has changed: {0}'.format(file.name))
+        file.seek(0)
+        file.write(header)
+
+    def columns(self):
+        """Столбцы t, x, y - массивы numpy, отображенные в память (только чтение)"""
+        if self._views is None:
+            if self._count == 0:
+                self._views = tuple(numpy.empty(0) for path in self._paths)
+            else:
+                self._views = tuple(numpy.memmap(path, dtype = MappedColumns.dtype, mode = 'r',
+                                                 offset = self._headerSize, shape = (self._count,)) for path in self._paths)
+        return self._views
+
+class MemoryHistoryStorage:
+    """Хранение истории в оперативной памяти (по умолчанию)"""
+
+    @property
+    def chunkSize(self):
+        """Размер блока записи (None - история целиком хранится в памяти)"""
+        return None
+
+    def open(self, ownerName, parameterName):
+        """Файлы для истории величины (None - история хранится в памяти)"""
+        return None
+
+class MappedHistoryStorage:
+    """Хранение истории в файлах .npy в каталоге directory.
+       Для каждой величины объекта создаются три файла {объект}.{величина}.{t|x|y}.npy,
+       в памяти остается только блок из chunkSize последних значений.
+       Для чтения без загрузки в память используется numpy.memmap
+    """
+    def __init__(self, directory, chunkSize = 65536):
+        self._directory = directory
+        self._chunkSize = chunkSize
+        self._names     = set() # Использованные имена файлов
+
+    @property
+    def directory(self):
+        """Каталог файлов истории"""
+        return self._directory
+
+    @property
+    def chunkSize(self):
+        """Число значений в блоке записи"""
+        return self._chunkSize
+
+    def _paths(self, name):
+        """Файлы столбцов t, x, y для базового имени name"""
+        return [os.path.join(self._directory, '{0}.{1}.npy'.format(name, column)) for column in ('t', 'x', 'y')]
+
+    def _name(self, ownerName, parameterName):
+        """Базовое имя файлов величины (символы, недопустимые в именах файлов, заменяются)"""
+        name = '{0}.{1}'.format(ownerName, parameterName)
+        return ''.join('_' if c in '\\/:*?"<>|' else c for c in name)
+
+    def open(self, ownerName, parameterName):
+        """Создать файлы для истории величины. Одноименные объекты получают суффикс номера"""
+        os.makedirs(self._directory, exist_ok = True)
+        base  = self._name(ownerName, parameterName)
+        name  = base
+        index = 1
+        while name in self._names:
+            index = index + 1
+            name  = '{0}#{1}'.format(base, index)
+        self._names.add(name)
+        return MappedColumns.create(self._paths(name))
+
+    def load(self, ownerName, parameterName):
+        """Загрузить историю величины, записанную ранее, в виде VectorHistory (значения читаются через numpy.memmap)"""
+        history = VectorHistory(ownerName, parameterName)
+        history.attachColumns(MappedColumns.open(self._paths(self._name(ownerName, parameterName))), self._chunkSize)
+        return history
+
+class HistoryStorageFactory:
+    def memory():
+        """История в оперативной памяти (по умолчанию)"""
+        return MemoryHistoryStorage()
+    def mapped(directory, chunkSize = 65536):
+        """История в файлах .npy на диске, в памяти - блок из chunkSize последних значений"""
+        return MappedHistoryStorage(directory, chunkSize)
@@ -0,0 +1,295 @@
+﻿# -*- coding: utf-8 -*-
+import math
+import numpy
+
+KICK  = 1 # Обновление скоростей по текущим силам
+DRIFT = 2 # Обновление координат по текущим скоростям
+
+class SplittingIntegrator:
+    """Интегратор с фиксированным шагом на основе схемы расщепления.
+       Шаг расчета раскладывается на последовательность операций kick (скорости) и drift (координаты)
+       с коэффициентами, в сумме дающими полный шаг dt.
+       Силы в начале шага берутся из основного расчета (события + гравитация),
+       перед каждым последующим kick гравитация пересчитывается для новых координат,
+       внешние силы (тяга двигателей) считаются постоянными в пределах шага.
+    """
+    def __init__(self, name, scheme):
+        self._name   = name   # Название схемы
+        self._scheme = scheme # Последовательность операций [(KICK|DRIFT, коэффициент)]
+
+    @property
+    def name(self):
+        """Название схемы"""
+        return self._name
+
+    @property
+    def isAdaptive(self):
+        """Поддерживает ли интегратор контроль ошибки"""
+        return False
+
+    @property
+    def isBlock(self):
+        """Движутся ли объекты с собственными (блочными) шагами"""
+        return False
+
+    @property
+    def forceEvaluations(self):
+        """Число дополнительных расчетов сил на шаге"""
+        count, isStale = 0, False
+        for operation, k in self._scheme:
+            if operation == DRIFT:
+                isStale = True
+            elif isStale:
+                count, isStale = count + 1, False
+        return count
+
+    def step(self, engine, ctx):
+        """Выполнить шаг интегрирования"""
+        dt      = ctx.dt
+        isStale = False
+        for operation, k in self._scheme:
+            if operation == KICK:
+                if isStale:
+                    engine.updateForces(ctx)
+                    isStale = False
+                engine.kick(k * dt)
+            else:
+                engine.drift(k * dt)
+                isStale = True
+
+class BlockIntegrator:
+    """Схема leapfrog kick-drift-kick с иерархическими блочными шагами.
+       Каждый объект движется со своим шагом dt * 2^level (level = 0..maxLevel). Шаги уровней кратны
+       друг другу, поэтому шаг объекта всегда начинается и заканчивается на границе шага расчета.
+       Уровень выбирается в начале шага объекта так, чтобы шаг не превышал accuracy * |v| / |a|
+       (время заметного изменения скорости); корабль с активными событиями движется с шагом расчета,
+       шаг корабля без событий не пересекает границу ближайшего события.
+       Силы, действующие на объект, пересчитываются только в начале и в конце его шага - в середине шага
+       объект движется со скоростью, полученной половинным толчком. Поддерживается ядром Engine.arrays()
+    """
+    def __init__(self, maxLevel = 8, accuracy = 0.01):
+        self._maxLevel = maxLevel # Наибольший уровень шага (шаг dt * 2^maxLevel)
+        self._accuracy = accuracy # Доля времени изменения скорости, допустимая для шага объекта
+
+    @property
+    def name(self):
+        """Название схемы"""
+        return 'blocks'
+
+    @property
+    def isAdaptive(self):
+        """Поддерживает ли интегратор контроль ошибки"""
+        return False
+
+    @property
+    def isBlock(self):
+        """Движутся ли объекты с собственными (блочными) шагами"""
+        return True
+
+    @property
+    def maxLevel(self):
+        """Наибольший уровень шага"""
+        return self._maxLevel
+
+    @property
+    def accuracy(self):
+        """Доля времени изменения скорости, допустимая для шага объекта"""
+        return self._accuracy
+
+    def chooseLevels(self, speeds, accelerations, dt):
+        """Уровни шагов объектов: наибольший уровень, при котором шаг dt * 2^level не превышает accuracy * |v| / |a|"""
+        with numpy.errstate(divide = 'ignore', invalid = 'ignore'):
+            ratio  = numpy.where(accelerations > 0, self._accuracy * speeds / (accelerations * dt), numpy.inf)
+            levels = numpy.floor(numpy.log2(ratio))
+        return numpy.clip(numpy.nan_to_num(levels, nan = 0., posinf = self._maxLevel, neginf = 0.), 0, self._maxLevel).astype(numpy.intp)
+
+    def step(self, engine, ctx):
+        """Выполнить шаг расчета: толчок объектам, начинающим свой шаг, перемещение всех объектов,
+           пересчет сил и толчок объектам, завершающим свой шаг
+        """
+        engine.kickBlocks(ctx, isClosing = False)
+        engine.drift(ctx.dt)
+        engine.updateForces(ctx)
+        engine.kickBlocks(ctx, isClosing = True)
+
+class RungeKuttaStep:
+    """Результат шага вложенной схемы Рунге-Кутты"""
+    def __init__(self, h, error, x0, v0, a0, x1, v1, a1):
+        self._h     = h     # Величина шага
+        self._error = error # Нормированная оценка локальной ошибки (<= 1 - шаг принят)
+        self._x0, self._v0, self._a0 = x0, v0, a0
+        self._x1, self._v1, self._a1 = x1, v1, a1
+
+    @property
+    def error(self):
+        """Нормированная оценка локальной ошибки"""
+        return self._error
+
+    @property
+    def beginState(self):
+        """Координаты и скорости в начале шага"""
+        return self._x0, self._v0
+
+    @property
+    def endState(self):
+        """Координаты и скорости в конце шага"""
+        return self._x1, self._v1
+
+    def interpolate(self, theta):
+        """Плотный вывод: координаты и скорости в момент t + theta * h (кубический полином Эрмита)"""
+        h  = self._h
+        t2 = theta * theta
+        t3 = t2 * theta
+        h00, h10, h01, h11 = 2*t3 - 3*t2 + 1, t3 - 2*t2 + theta, -2*t3 + 3*t2, t3 - t2
+        x = h00 * self._x0 + h10 * h * self._v0 + h01 * self._x1 + h11 * h * self._v1
+        v = h00 * self._v0 + h10 * h * self._a0 + h01 * self._v1 + h11 * h * self._a1
+        return x, v
+
+class EmbeddedRungeKuttaIntegrator:
+    """Вложенная схема Рунге-Кутты с оценкой локальной ошибки.
+       В режиме TimeRange.withTolerance() шаг подбирается по оценке ошибки,
+       при фиксированном шаге схема используется как обычный метод Рунге-Кутты.
+       Внешние силы (тяга двигателей) считаются постоянными в пределах шага.
+    """
+    def __init__(self, name, c, a, b, bErr, order):
+        self._name  = name  # Название схемы
+        self._c     = c     # Узлы схемы
+        self._a     = a     # Матрица коэффициентов
+        self._b     = b     # Веса решения старшего порядка
+        self._bErr  = bErr  # Разность весов решений старшего и младшего порядков
+        self._order = order # Порядок схемы младшего порядка (для выбора шага)
+        # Схема FSAL - последняя стадия вычисляется в конце шага
+        self._isFsal = len(a) == len(b) - 1 and list(a[-1]) == list(b[:-1])
+
+    @property
+    def name(self):
+        """Название схемы"""
+        return self._name
+
+    @property
+    def isAdaptive(self):
+        """Поддерживает ли интегратор контроль ошибки"""
+        return True
+
+    @property
+    def isBlock(self):
+        """Движутся ли объекты с собственными (блочными) шагами"""
+        return False
+
+    @property
+    def order(self):
+        """Порядок вложенной схемы младшего порядка"""
+        return self._order
+
+    def step(self, engine, ctx):
+        """Выполнить шаг интегрирования с фиксированным шагом"""
+        self.attempt(engine, ctx)
+
+    def attempt(self, engine, ctx, rtol = 0., atol = 0.):
+        """Выполнить пробный шаг величиной ctx.dt, состояние движка переводится в конец шага"""
+        h      = ctx.dt
+        x0, v0 = engine.getState()
+        a0     = engine.accelerations(h)
+        kx, kv = [v0], [a0]
+        for c, row in zip(self._c, self._a):
+            x, v = x0.copy(), v0.copy()
+            for j, k in enumerate(row):
+                if k != 0:
+                    x += (h * k) * kx[j]
+                    v += (h * k) * kv[j]
+            engine.setState(x, v)
+            engine.updateForces(ctx)
+            kx.append(v)
+            kv.append(engine.accelerations((1. - c) * h))
+
+        if self._isFsal:
+            x1, v1 = x, v
+            a1     = kv[-1]
+        else:
+            x1, v1 = self._combine(x0, v0, kx, kv, self._b, h)
+            engine.setState(x1, v1)
+            engine.updateForces(ctx)
+            a1 = engine.accelerations()
+
+        error = 0.
+        if rtol > 0 or atol > 0:
+            ex, ev = self._combine(0., 0., kx, kv, self._bErr, h)
+            sx = atol + rtol * numpy.maximum(numpy.abs(x0), numpy.abs(x1))
+            sv = atol + rtol * numpy.maximum(numpy.abs(v0), numpy.abs(v1))
+            if ex.size > 0:
+                error = math.sqrt((numpy.sum((ex / sx)**2) + numpy.sum((ev / sv)**2)) / (2 * ex.size))
+        return RungeKuttaStep(h, error, x0, v0, a0, x1, v1, a1)
+
+    def _combine(self, x0, v0, kx, kv, weights, h):
+        """Линейная комбинация стадий"""
+        x, v = x0, v0
+        for j, k in enumerate(weights):
+            if k != 0:
+                x = x + (h * k) * kx[j]
+                v = v + (h * k) * kv[j]
+        return x, v
+
+    def stepFactor(self, error):
+        """Коэффициент изменения шага по оценке ошибки"""
+        if error == 0:
+            return 5.
+        return min(5., max(.2, .9 * math.pow(error, -1. / (self._order + 1))))
+
+def _dormandPrince():
+    """Таблица Бутчера схемы Дорманда-Принса 5(4)"""
+    c = [1./5, 3./10, 4./5, 8./9, 1., 1.]
+    a = [[1./5],
+         [3./40,       9./40],
+         [44./45,      -56./15,      32./9],
+         [19372./6561, -25360./2187, 64448./6561, -212./729],
+         [9017./3168,  -355./33,     46732./5247, 49./176,  -5103./18656],
+         [35./384,     0.,           500./1113,   125./192, -2187./6784,    11./84]]
+    b    = [35./384,     0., 500./1113,   125./192, -2187./6784,    11./84,    0.]
+    bLow = [5179./57600, 0., 7571./16695, 393./640, -92097./339200, 187./2100, 1./40]
+    return c, a, b, [hi - lo for hi, lo in zip(b, bLow)]
+
+def _fehlberg():
+    """Таблица Бутчера схемы Рунге-Кутты-Фельберга 4(5)"""
+    c = [1./4, 3./8, 12./13, 1., 1./2]
+    a = [[1./4],
+         [3./32,      9./32],
+         [1932./2197, -7200./2197, 7296./2197],
+         [439./216,   -8.,         3680./513,   -845./4104],
+         [-8./27,     2.,          -3544./2565, 1859./4104, -11./40]]
+    b    = [16./135, 0., 6656./12825, 28561./56430, -9./50, 2./55]
+    bLow = [25./216, 0., 1408./2565,  2197./4104,   -1./5,  0.]
+    return c, a, b, [hi - lo for hi, lo in zip(b, bLow)]
+
+def _yoshida4():
+    """Схема Йошиды 4-го порядка (в форме kick-drift)"""
+    cbrt2 = math.pow(2, 1. / 3.)
+    w1    = 1. / (2. - cbrt2)
+    w0    = -cbrt2 / (2. - cbrt2)
+    c1    = w1 / 2.
+    c2    = (w0 + w1) / 2.
+    return [(KICK, c1), (DRIFT, w1), (KICK, c2), (DRIFT, w0), (KICK, c2), (DRIFT, w1), (KICK, c1)]
+
+class IntegratorFactory:
+    def euler():
+        """Полунеявный метод Эйлера (скорость, затем координаты) - 1-й порядок, по умолчанию"""
+        return SplittingIntegrator('euler', [(KICK, 1.), (DRIFT, 1.)])
+    def leapfrog():
+        """Симплектическая схема leapfrog kick-drift-kick - 2-й порядок"""
+        return SplittingIntegrator('leapfrog', [(KICK, .5), (DRIFT, 1.), (KICK, .5)])
+    def velocityVerlet():
+        """Скоростная схема Верле - 2-й порядок, эквивалентна leapfrog kick-drift-kick"""
+        return SplittingIntegrator('velocityVerlet', [(KICK, .5), (DRIFT, 1.), (KICK, .5)])
+    def yoshida4():
+        """Симплектическая схема Йошиды - 4-й порядок"""
+        return SplittingIntegrator('yoshida4', _yoshida4())
+    def blocks(maxLevel = 8, accuracy = 0.01):
+        """Leapfrog с блочными шагами объектов dt * 2^level, level <= maxLevel (только Engine.arrays())"""
+        return BlockIntegrator(maxLevel, accuracy)
+    def dormandPrince():
+        """Вложенная схема Дорманда-Принса 5(4) - по умолчанию для TimeRange.withTolerance()"""
+        c, a, b, bErr = _dormandPrince()
+        return EmbeddedRungeKuttaIntegrator('dormandPrince', c, a, b, bErr, 4)
+    def rungeKuttaFehlberg():
+        """Вложенная схема Рунге-Кутты-Фельберга 4(5)"""
+        c, a, b, bErr = _fehlberg()
+        return EmbeddedRungeKuttaIntegrator('rungeKuttaFehlberg', c, a, b, bErr, 4)
\ No newline at end of file
@@ -0,0 +1,358 @@
+﻿# -*- coding: utf-8 -*-
+import math
+
+import numpy
+
+from orbitals.gravity import G
+from orbitals.types import SpaceShip
+from orbitals.types import SpaceObjectController
+from orbitals.types import GravitySpaceObjectController
+from orbitals.types import DynamicSpaceObjectController
+
+def _stumpff(z):
+    """Функции Штумпфа C(z), S(z). При малых |z| используются ряды (исключается потеря точности)"""
+    c, s  = numpy.empty_like(z), numpy.empty_like(z)
+    small = numpy.abs(z) < 1E-3
+    ell   = (z > 0) & ~small
+    hyp   = (z < 0) & ~small
+
+    root   = numpy.sqrt(z[ell])
+    c[ell] = (1. - numpy.cos(root)) / z[ell]
+    s[ell] = (root - numpy.sin(root)) / root**3
+
+    root   = numpy.sqrt(-z[hyp])
+    c[hyp] = (numpy.cosh(root) - 1.) / -z[hyp]
+    s[hyp] = (numpy.sinh(root) - root) / root**3
+
+    zs       = z[small]
+    c[small] = 1. / 2. - zs / 24. + zs * zs / 720.
+    s[small] = 1. / 6. - zs / 120. + zs * zs / 5040.
+    return c, s
+
+def propagate(mu, position, velocity, ts):
+    """Координаты и скорости тела на кеплеровой орбите вокруг неподвижного центра (гравитационный параметр mu)
+       через ts секунд после момента, в который тело находится в точке position со скоростью velocity.
+       Задача решается в универсальных переменных, уравнение Кеплера - методом Ньютона сразу для всех моментов.
+       Возвращает массивы координат и скоростей (len(ts), 2)
+    """
+    r0v, v0v = numpy.asarray(position, dtype = numpy.float64), numpy.asarray(velocity, dtype = numpy.float64)
+    ts       = numpy.asarray(ts, dtype = numpy.float64)
+    r0       = math.hypot(*r0v)
+    sqrtMu   = math.sqrt(mu)
+    vr0      = numpy.dot(r0v, v0v) / sqrtMu
+    alpha    = 2. / r0 - numpy.dot(v0v, v0v) / mu
+
+    if alpha > 0:
+        # Замкнутая орбита - время приводится к одному периоду
+        ts  = numpy.fmod(ts, 2. * math.pi / math.sqrt(mu * alpha**3))
+        chi = sqrtMu * alpha * ts
+    else:
+        chi = sqrtMu * ts / r0
+
+    for iteration in range(50):
+        z    = alpha * chi * chi
+        c, s = _stumpff(z)
+        f    = vr0 * chi * chi * c + (1. - alpha * r0) * chi**3 * s + r0 * chi - sqrtMu * ts
+        r    = chi * chi * c + vr0 * chi * (1. - z * s) + r0 * (1. - z * c)
+        step = f / r
+        chi  = chi - step
+        if numpy.all(numpy.abs(step) <= 1E-13 * numpy.maximum(1., numpy.abs(chi))):
+            break
+
+    z    = alpha * chi * chi
+    c, s = _stumpff(z)
+    f    = 1. - chi * chi / r0 * c
+    g    = ts - chi**3 * s / sqrtMu
+    positions = f[:, numpy.newaxis] * r0v + g[:, numpy.newaxis] * v0v
+    r    = numpy.hypot(positions[:, 0], positions[:, 1])
+    fdot = sqrtMu / (r * r0) * (alpha * chi**3 * s - chi)
+    gdot = 1. - chi * chi * c / r
+    velocities = fdot[:, numpy.newaxis] * r0v + gdot[:, numpy.newaxis] * v0v
+    return positions, velocities
+
+class KeplerOrbit:
+    """Кеплерова орбита объекта objects[index] вокруг неподвижного тела objects[primary]"""
+    def __init__(self, index, primary, center, mu, position, velocity):
+        self.index    = index    # Номер объекта
+        self.primary  = primary  # Номер центрального тела
+        self.center   = center   # Координаты центрального тела
+        self.mu       = mu       # Гравитационный параметр центрального тела, м^3/с^2
+        self.position = position # Координаты относительно центрального тела в начале участка
+        self.velocity = velocity # Скорость в начале участка
+
+        r     = math.hypot(*position)
+        alpha = 2. / r - numpy.dot(velocity, velocity) / mu
+        h     = position[0] * velocity[1] - position[1] * velocity[0]
+        p     = h * h / mu
+        e     = math.sqrt(max(0., 1. - p * alpha))
+        self.isBound   = alpha > 0 and e < 1.
+        self.periapsis = p / (1. + e)
+        self.apoapsis  = p / (1. - e) if self.isBound else float('inf')
+        self.period    = 2. * math.pi / math.sqrt(mu * alpha**3) if self.isBound else float('inf')
+
+    def states(self, ts):
+        """Координаты (абсолютные) и скорости объекта через ts секунд после начала участка"""
+        positions, velocities = propagate(self.mu, self.position, self.velocity, ts)
+        return positions + self.center, velocities
+
+    def acceleration(self, position):
+        """Ускорение объекта в точке position (притяжение центрального тела)"""
+        relative = position - self.center
+        r        = math.hypot(*relative)
+        return -self.mu / r**3 * relative
+
+class KeplerSpaceObjectController(SpaceObjectController):
+    """Контроллер корабля на баллистическом участке отдельного корабля (KeplerCoast, постоянный шаг).
+       Корабль не участвует в динамическом расчете: в конце каждого шага его состояние задается
+       по кеплеровой орбите orbit, начатой в момент time. Остальные объекты интегрируются как обычно,
+       корабль остается для них источником гравитации. По завершении участка вычислитель
+       восстанавливает прежний контроллер previous.
+       Состояния рассчитываются сразу для chunkSteps шагов вперед (одно решение уравнения Кеплера на все шаги)
+    """
+    chunkSteps = 256
+
+    def __init__(self, orbit, time, previous):
+        super().__init__()
+        self._orbit      = orbit
+        self._time       = time
+        self._previous   = previous
+        self._first      = 0    # Номер шага, для конца которого рассчитано первое состояние
+        self._states     = None # Координаты, скорости и ускорения на концы шагов self._first, self._first + 1, ...
+
+    @property
+    def orbit(self):
+        """Кеплерова орбита корабля"""
+        return self._orbit
+
+    @property
+    def previous(self):
+        """Контроллер корабля до начала участка"""
+        return self._previous
+
+    @property
+    def isAffectedByForces(self):
+        """Является ли данный объект участником динамического расчета"""
+        return False
+
+    def beginStep(self, ctx):
+        """Обновление шага расчета - состояние на начало шага задано в конце предыдущего шага"""
+        self._clearDependents()
+
+    def endStep(self, ctx, isDependencyCall = False):
+        """Завершение шага расчета - состояние корабля на конец шага по кеплеровой орбите"""
+        k = ctx.iteration - self._first
+        if self._states is None or not 0 <= k < len(self._states):
+            steps = numpy.arange(1, KeplerSpaceObjectController.chunkSteps + 1)
+            positions, velocities = self._orbit.states(ctx.t + steps * ctx.dt - self._time)
+            relative      = positions - self._orbit.center
+            accelerations = -self._orbit.mu / numpy.hypot(relative[:, 0], relative[:, 1])[:, numpy.newaxis]**3 * relative
+            self._states  = numpy.hstack((positions, velocities, accelerations)).tolist()
+            self._first, k = ctx.iteration, 0
+        x, y, vx, vy, ax, ay = self._states[k]
+        obj = self._object
+        obj.setPositionXY(x, y)
+        obj.setVelocityXY(vx, vy)
+        obj.setAccelerationXY(ax, ay)
+        obj.setForceXY(ax * obj.mass, ay * obj.mass)
+        self._invokeDependents(ctx)
+
+    def setState(self, t):
+        """Задать состояние корабля на орбите в момент t"""
+        positions, velocities = self._orbit.states(numpy.array((t - self._time,)))
+        setKeplerState(self._object, self._orbit, positions[0], velocities[0])
+
+def setKeplerState(obj, orbit, position, velocity):
+    """Задать состояние объекта на кеплеровой орбите: координаты, скорость, ускорение и сила притяжения"""
+    acceleration = orbit.acceleration(position)
+    obj.setPositionXY(position[0], position[1])
+    obj.setVelocityXY(velocity[0], velocity[1])
+    obj.setAccelerationXY(acceleration[0], acceleration[1])
+    obj.setForceXY(acceleration[0] * obj.mass, acceleration[1] * obj.mass)
+
+class KeplerCoast:
+    """Баллистические участки по кеплеровым орбитам (Solver.coast).
+       Если ни у одного корабля нет активных событий управления, а каждый динамический объект движется
+       по замкнутой орбите вокруг одного неподвижного тела и притяжение остальных тел не превышает
+       tolerance от притяжения основного, вычислитель переносит объекты по решению задачи двух тел
+       до ближайшего события управления или конца расчета, записывая историю в заданные моменты времени.
+       Участок сокращается, если возмущения на нем превысят tolerance; участки короче minSteps шагов
+       не выполняются, после неудачной попытки следующая выполняется через retrySteps шагов.
+       Если участок для всех объектов сразу невозможен (напр. другой корабль работает двигателем),
+       в режиме постоянного шага по орбитам переносятся отдельные корабли без активных событий
+       (KeplerSpaceObjectController), остальные объекты интегрируются. Участок корабля завершается
+       перед его событием управления, при превышении возмущениями tolerance или при сближении
+       с другими объектами - эти условия проверяются каждые minSteps шагов
+    """
+    def __init__(self, tolerance = 1E-6, minSteps = 10, retrySteps = 100, samplesPerOrbit = 64):
+        self._tolerance       = tolerance
+        self._minSteps        = minSteps
+        self._retrySteps      = retrySteps
+        self._samplesPerOrbit = samplesPerOrbit
+
+    @property
+    def tolerance(self):
+        """Допустимое отношение возмущающих ускорений к притяжению центрального тела"""
+        return self._tolerance
+
+    @property
+    def minSteps(self):
+        """Минимальная длительность участка, шагов расчета"""
+        return self._minSteps
+
+    @property
+    def retrySteps(self):
+        """Число шагов до повторной попытки после неудачной"""
+        return self._retrySteps
+
+    def orbits(self, objects, t, sources = None):
+        """Кеплеровы орбиты динамических объектов в момент t (None - баллистический участок невозможен).
+           sources - маска источников гравитации (None - все объекты), центральным телом может быть только источник.
+           Корабли на баллистических участках отдельных кораблей учитываются как динамические объекты
+        """
+        fixed, dynamic = [], []
+        for i, obj in enumerate(objects):
+            controller = obj.controller
+            if not controller.isActive:
+                # Объекты, выбывшие из расчета, не учитываются
+                continue
+            if controller.isAffectedByForces or isinstance(controller, KeplerSpaceObjectController):
+                if controller.isAffectedByForces and type(controller) not in (GravitySpaceObjectController, DynamicSpaceObjectController):
+                    return None
+                if isinstance(obj, SpaceShip) and not obj.schedule.isIdle(t):
+                    return None
+                dynamic.append(i)
+            elif sources is None or sources[i]:
+                fixed.append(i)
+        if not dynamic or not fixed:
+            return None
+
+        result = []
+        for i in dynamic:
+            orbit = _boundOrbit(objects, i, fixed)
+            if orbit is None:
+                return None
+            result.append(orbit)
+        return result
+
+    def shipOrbit(self, objects, index, t, dt, sources = None):
+        """Кеплерова орбита корабля objects[index] для баллистического участка отдельного корабля с момента t
+           (None - участок невозможен): у корабля нет событий управления ближайшие minSteps шагов dt,
+           корабль движется по замкнутой орбите вокруг неподвижного источника гравитации
+        """
+        ship = objects[index]
+        if type(ship.controller) not in (GravitySpaceObjectController, DynamicSpaceObjectController):
+            return None
+        if not ship.schedule.isIdle(t) or ship.schedule.nextBoundary(t) < t + self._minSteps * dt:
+            return None
+        fixed = [j for j, obj in enumerate(objects) if _isFixed(obj) and (sources is None or sources[j])]
+        if not fixed:
+            return None
+        return _boundOrbit(objects, index, fixed)
+
+    def isShipFree(self, objects, orbit, interval, sources = None):
+        """Можно ли продолжать баллистический участок корабля на орбите orbit следующие interval секунд:
+           возмущения от источников, кроме центрального тела, не превышают tolerance, и ни один объект
+           не может сблизиться с кораблем до касания (с запасом по относительной скорости)
+        """
+        ship     = objects[orbit.index]
+        position = ship.position
+        velocity = ship.velocity
+        primary  = orbit.mu / ((position.x - orbit.center[0])**2 + (position.y - orbit.center[1])**2)
+        perturbation = 0.
+        for j, obj in enumerate(objects):
+            if j == orbit.index or j == orbit.primary or not obj.controller.isActive:
+                continue
+            other    = obj.position
+            distance = math.hypot(other.x - position.x, other.y - position.y)
+            speed    = math.hypot(obj.velocity.x - velocity.x, obj.velocity.y - velocity.y)
+            if distance <= ship.radius + obj.radius + 2. * speed * interval:
+                return False
+            if obj.mass != 0 and (sources is None or sources[j]):
+                perturbation += G * obj.mass / (distance * distance)
+        return perturbation <= self._tolerance * primary
+
+    def duration(self, objects, orbits, duration, sources = None):
+        """Длительность участка (не более duration), на которой движение объектов описывается орбитами orbits
+           с точностью tolerance и столкновения невозможны. Возмущения создают только источники гравитации sources
+        """
+        if not self._isSeparated(objects, orbits):
+            return 0.
+        # Быстрая проверка в начале участка, затем - в точках, равномерно расположенных на участке
+        if self._firstExceeded(objects, orbits, numpy.zeros(1), sources) == 0:
+            return 0.
+        period = min(orbit.period for orbit in orbits)
+        count  = int(math.ceil(duration * self._samplesPerOrbit / period)) + 1
+        ts     = numpy.linspace(0., duration, max(count, 2))
+        first  = self._firstExceeded(objects, orbits, ts, sources)
+        if first == len(ts):
+            return duration
+        return ts[first - 1] if first > 0 else 0.
+
+    def _firstExceeded(self, objects, orbits, ts, sources = None):
+        """Номер первого момента из ts, в который возмущения превышают tolerance (len(ts) - не превышают)"""
+        tracks = {orbit.index: orbit.states(ts)[0] for orbit in orbits}
+        active = [j for j, obj in enumerate(objects) if obj.mass != 0 and obj.controller.isActive and (sources is None or sources[j])]
+        result = len(ts)
+        for orbit in orbits:
+            track   = tracks[orbit.index]
+            primary = orbit.mu / numpy.sum((track - orbit.center)**2, axis = 1)
+            perturbation = numpy.zeros(len(ts))
+            for j in active:
+                if j == orbit.index or j == orbit.primary:
+                    continue
+                obj    = objects[j]
+                source = tracks[j] if j in tracks else numpy.array((obj.position.x, obj.position.y))
+                perturbation += G * obj.mass / numpy.sum((track - source)**2, axis = 1)
+            exceeded = numpy.nonzero(perturbation > self._tolerance * primary)[0]
+            if len(exceeded) > 0:
+                result = min(result, exceeded[0])
+        return result
+
+    def _isSeparated(self, objects, orbits):
+        """Исключены ли столкновения объектов на орбитах orbits с остальными телами и друг с другом:
+           орбита не пересекает окрестность других неподвижных тел, орбиты вокруг одного тела
+           не пересекаются по расстоянию от него, орбиты вокруг разных тел разнесены
+        """
+        dynamic = set(orbit.index for orbit in orbits)
+        for orbit in orbits:
+            radius = objects[orbit.index].radius
+            for j, obj in enumerate(objects):
+                if j == orbit.primary or j in dynamic or not obj.controller.isActive:
+                    continue
+                distance = math.hypot(obj.position.x - orbit.center[0], obj.position.y - orbit.center[1])
+                if distance <= orbit.apoapsis + radius + obj.radius:
+                    return False
+
+        for k, a in enumerate(orbits):
+            for b in orbits[k + 1:]:
+                gap = objects[a.index].radius + objects[b.index].radius
+                if a.primary == b.primary:
+                    if a.apoapsis + gap < b.periapsis or b.apoapsis + gap < a.periapsis:
+                        continue
+                elif math.hypot(*(a.center - b.center)) > a.apoapsis + b.apoapsis + gap:
+                    continue
+                return False
+        return True
+
+def _isFixed(obj):
+    """Является ли объект неподвижным телом (корабли на баллистических участках к ним не относятся)"""
+    controller = obj.controller
+    return controller.isActive and not controller.isAffectedByForces and not isinstance(controller, KeplerSpaceObjectController)
+
+def _boundOrbit(objects, index, fixed):
+    """Орбита объекта objects[index] вокруг тела из fixed с наибольшим притяжением
+       (None - орбита не замкнута или перицентр касается тела)
+    """
+    obj      = objects[index]
+    position = numpy.array((obj.position.x, obj.position.y))
+    primary  = max(fixed, key = lambda j: objects[j].mass / _squaredDistance(objects[j], position))
+    body     = objects[primary]
+    center   = numpy.array((body.position.x, body.position.y))
+    orbit    = KeplerOrbit(index, primary, center, G * body.mass, position - center, numpy.array((obj.velocity.x, obj.velocity.y)))
+    if not orbit.isBound or orbit.periapsis <= body.radius + obj.radius:
+        return None
+    return orbit
+
+def _squaredDistance(obj, position):
+    """Квадрат расстояния от объекта obj до точки position"""
+    return max((obj.position.x - position[0])**2 + (obj.position.y - position[1])**2, 1E-300)
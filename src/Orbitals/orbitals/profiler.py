@@ -0,0 +1,179 @@
+﻿# -*- coding: utf-8 -*-
+import time
+
+class ProfileReport:
+    """Отчет профилировщика о расчете.
+       Время указывается в секундах, время контроллеров и событий - включая вложенные вызовы
+    """
+    def __init__(self, totalTime, steps, rejectedSteps, phases, interactions, historyBytes, controllers, events):
+        self._totalTime     = totalTime
+        self._steps         = steps
+        self._rejectedSteps = rejectedSteps
+        self._phases        = phases
+        self._interactions  = interactions
+        self._historyBytes  = historyBytes
+        self._controllers   = controllers
+        self._events        = events
+
+    @property
+    def totalTime(self):
+        """Полное время расчета, с"""
+        return self._totalTime
+
+    @property
+    def steps(self):
+        """Число выполненных шагов расчета"""
+        return self._steps
+
+    @property
+    def rejectedSteps(self):
+        """Число отклоненных шагов (адаптивный шаг)"""
+        return self._rejectedSteps
+
+    @property
+    def stepsPerSecond(self):
+        """Скорость расчета, шагов в секунду"""
+        return self._steps / self._totalTime if self._totalTime > 0 else 0.
+
+    @property
+    def phases(self):
+        """Время по фазам шага расчета: {фаза: с}"""
+        return self._phases
+
+    @property
+    def interactions(self):
+        """Число вычисленных парных гравитационных взаимодействий"""
+        return self._interactions
+
+    @property
+    def historyBytes(self):
+        """Объем памяти, выделенной под историю объектов, байт"""
+        return self._historyBytes
+
+    @property
+    def controllers(self):
+        """Время по классам контроллеров: {класс: с}"""
+        return self._controllers
+
+    @property
+    def events(self):
+        """Время по событиям управления: {событие: с}"""
+        return self._events
+
+    def asDict(self):
+        """Отчет в виде словаря (напр. для сохранения в JSON)"""
+        return {
+            'totalTime':      self._totalTime,
+            'steps':          self._steps,
+            'rejectedSteps':  self._rejectedSteps,
+            'stepsPerSecond': self.stepsPerSecond,
+            'phases':         dict(self._phases),
+            'interactions':   self._interactions,
+            'historyBytes':   self._historyBytes,
+            'controllers':    dict(self._controllers),
+            'events':         dict(self._events)
+        }
+
+    def print(self):
+        """Вывод отчета в консоль"""
+        print ('Профиль расчета: {0:.3f} с, шагов {1} ({2:.1f} шаг/с), отклонено {3}'.format(self._totalTime, self._steps, self.stepsPerSecond, self._rejectedSteps))
+        print ('  Парных взаимодействий: {0}, память истории: {1:.1f} МБ'.format(self._interactions, self._historyBytes / 2.**20))
+        for title, values in (('Фазы', self._phases), ('Контроллеры', self._controllers), ('События', self._events)):
+            if values:
+                print ('  {0}:'.format(title))
+            for name, seconds in sorted(values.items(), key = lambda item: -item[1]):
+                share = seconds / self._totalTime * 100 if self._totalTime > 0 else 0.
+                print ('    {0:<50} {1:10.4f} с {2:6.1f}%'.format(name, seconds, share))
+
+class SolverProfiler:
+    """Профилировщик вычислителя (Solver.profiler).
+       Накапливает время фаз шага, контроллеров и событий управления, число взаимодействий и шагов.
+       Если профилировщик не задан, вычислитель и контроллеры не выполняют замеров
+    """
+    def __init__(self):
+        self._stepHooks = []
+        self._endHooks  = []
+        self._reset()
+
+    def _reset(self):
+        """Сбросить накопленные значения"""
+        self._start         = 0.
+        self._stepStart     = 0.
+        self._totalTime     = 0.
+        self._steps         = 0
+        self._rejectedSteps = 0
+        self._interactions  = 0
+        self._historyBytes  = 0
+        self._phases        = {}
+        self._controllers   = {}
+        self._events        = {} # {(имя объекта, событие): с}
+
+    def addStepHook(self, hook):
+        """Добавить обработчик завершения шага hook(ctx, seconds)"""
+        self._stepHooks.append(hook)
+
+    def addEndHook(self, hook):
+        """Добавить обработчик завершения расчета hook(report)"""
+        self._endHooks.append(hook)
+
+    def begin(self, solver):
+        """Начало расчета"""
+        self._reset()
+        self._start     = time.perf_counter()
+        self._stepStart = self._start
+
+    def measure(self, phase, action, *args):
+        """Выполнить action(*args) с замером времени фазы phase"""
+        start  = time.perf_counter()
+        result = action(*args)
+        self._phases[phase] = self._phases.get(phase, 0.) + (time.perf_counter() - start)
+        return result
+
+    def measureController(self, controller, action, *args):
+        """Выполнить action(*args) с замером времени контроллера controller"""
+        start  = time.perf_counter()
+        result = action(*args)
+        name   = type(controller).__name__
+        self._controllers[name] = self._controllers.get(name, 0.) + (time.perf_counter() - start)
+        return result
+
+    def measureEvent(self, object, event, action, *args):
+        """Выполнить action(*args) с замером времени события управления event объекта object"""
+        start  = time.perf_counter()
+        result = action(*args)
+        key    = (object.name, event)
+        self._events[key] = self._events.get(key, 0.) + (time.perf_counter() - start)
+        return result
+
+    def addInteractions(self, count):
+        """Учесть count вычисленных парных взаимодействий"""
+        self._interactions = self._interactions + count
+
+    def stepRejected(self):
+        """Шаг расчета отклонен (адаптивный шаг)"""
+        self._rejectedSteps = self._rejectedSteps + 1
+
+    def stepDone(self, ctx):
+        """Шаг расчета завершен"""
+        now = time.perf_counter()
+        self._steps = self._steps + 1
+        for hook in self._stepHooks:
+            hook(ctx, now - self._stepStart)
+        self._stepStart = now
+
+    def end(self, solver):
+        """Завершение расчета"""
+        self._totalTime    = time.perf_counter() - self._start
+        self._historyBytes = sum(obj.historyBytes for obj in solver.objects)
+        report = self.report()
+        for hook in self._endHooks:
+            hook(report)
+
+    def report(self):
+        """Отчет о последнем расчете"""
+        events = {}
+        for (name, event), seconds in self._events.items():
+            label = '{0}: {1} [{2:g} - {3:g}]'.format(name, type(event).__name__, event.start, event.end)
+            events[label] = events.get(label, 0.) + seconds
+        return ProfileReport(self._totalTime, self._steps, self._rejectedSteps, dict(self._phases),
+                             self._interactions, self._historyBytes, dict(self._controllers), events)
@@ -5,9 +5,19 @@ import orbitals.solver as solver
 import orbitals.tools as tools
 
 import matplotlib.pylab as pylab
+import itertools
 import math
+import os
+import subprocess
+import tempfile
+import time
 import numpy
 import matplotlib.animation
+import matplotlib.figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from concurrent.futures import ProcessPoolExecutor
+
+from orbitals.downsampling import minMaxIndices
 
 class RendererOutput:    
     def __init__(self, name):
@@ -19,24 +29,330 @@ class RendererOutput:
         pylab.legend()
 
 class RendererAnimationOutput(RendererOutput):
-    def __init__(self, animation):
+    def __init__(self, animation, scene, frames, figureSize, dpi):
         super().__init__('Анимация')
-        self._animation = animation
+        self._animation  = animation
+        self._scene      = scene
+        self._frames     = frames
+        self._figureSize = figureSize
+        self._dpi        = dpi
 
     def show(self):
         fig = pylab.gcf()
         fig.canvas.set_window_title(self._name)
         pylab.show()
 
-    def save(path):
-        print ('Отрисовка анимации завершена')
-        self._animation.save('animation.mp4', fps = 30)
+    def save(self, path = 'animation.mp4', fps = 30, workers = 1):
+        """Запись анимации в видеофайл. Кадры отрисовываются с blitting и передаются кодировщику ffmpeg
+           через канал (без промежуточных файлов изображений), без ffmpeg анимация записывается через pillow
+           в GIF (расширение path заменяется на .gif).
+           workers > 1 - кадры отрисовываются по частям в параллельных процессах, части объединяются ffmpeg
+        """
+        print ('Запись анимации')
+        if not matplotlib.animation.writers.is_available('ffmpeg'):
+            if workers > 1:
+                raise Exception('Parallel animation export requires ffmpeg')
+            root, extension = os.path.splitext(path)
+            if extension.lower() != '.gif':
+                path = root + '.gif'
+                print ('ffmpeg не найден, анимация записывается в GIF: {0}'.format(path))
+            self._animation.save(path, writer = matplotlib.animation.PillowWriter(fps = fps))
+        elif workers > 1:
+            _saveParallel(self._scene, self._frames, path, fps, workers, self._figureSize, self._dpi)
+        else:
+            _renderSegment(self._scene, self._frames, path, fps, self._figureSize, self._dpi)
         print ('Запись анимации завершена')
 
+class _Trail:
+    """След траектории в анимации (линия графика, дополняемая по ходу расчета).
+       Точки прореживаются блоками фиксированного размера (минимум и максимум в блоке, не больше
+       двух точек на пиксель конечной траектории), на каждом кадре обрабатываются только новые точки.
+       values(first, last) - столбцы значений для прореживания, sample(indices) - координаты выбранных точек
+    """
+    def __init__(self, values, sample, bucketSize):
+        self._values     = values
+        self._sample     = sample
+        self._bucketSize = bucketSize
+        self.reset()
+
+    def reset(self):
+        """Начать след сначала"""
+        self._indices = numpy.empty(0, dtype = numpy.int64) # Выбранные точки завершенных блоков
+        self._done    = 0                                   # Число точек в завершенных блоках
+
+    def advance(self, index):
+        """Координаты следа по точку index включительно"""
+        if index < self._done:
+            self.reset()
+        done = (index + 1) // self._bucketSize * self._bucketSize
+        if done > self._done:
+            selected      = minMaxIndices(self._values, self._done, done, (done - self._done) // self._bucketSize)
+            self._indices = numpy.concatenate((self._indices, selected))
+            self._done    = done
+        indices = numpy.concatenate((self._indices, numpy.arange(self._done, index + 1)))
+        return self._sample(indices)
+
+class AnimationScene:
+    """Данные анимации: траектории динамических объектов и положения статических.
+       Сцена не ссылается на объекты вычислителя и передается в процессы записи через pickle
+    """
+    def __init__(self, objects, times):
+        self._times    = numpy.asarray(times)
+        self._statics  = [(obj.position.x, obj.position.y, obj.radius) for obj in objects if obj.isStatic]
+        self._dynamics = [(obj.name, obj.positionHistory.xs, obj.positionHistory.ys, obj.radius) for obj in objects if not obj.isStatic]
+        self._artists  = []
+        self._trails   = []
+        self._time     = None
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state['_dynamics'] = [(name, numpy.asarray(xs), numpy.asarray(ys), radius) for name, xs, ys, radius in self._dynamics]
+        state['_artists']  = []
+        state['_trails']   = []
+        state['_time']     = None
+        return state
+
+    @property
+    def frameCount(self):
+        """Число точек истории"""
+        return len(self._times)
+
+    def build(self, figure):
+        """Создать объекты графика на фигуре figure. Статические объекты рисуются один раз (фон),
+           объекты, изменяемые на каждом кадре, создаются с animated = True для blitting
+        """
+        plot = figure.add_subplot(111, aspect = 'equal')
+        low, high = [], []
+        for x, y, radius in self._statics:
+            types.renderCircle(plot, basicTypes.Vector(x, y), radius, fill = True)
+            low.append((x - radius, y - radius))
+            high.append((x + radius, y + radius))
+
+        width = max(100, int(plot.bbox.width))
+        self._artists = []
+        self._trails  = []
+        for name, xs, ys, radius in self._dynamics:
+            extent = radius + 500*1000
+            if len(xs) > 0:
+                low.append((numpy.min(xs) - extent, numpy.min(ys) - extent))
+                high.append((numpy.max(xs) + extent, numpy.max(ys) + extent))
+            ringXs, ringYs     = types.ringPoints(radius)
+            circleXs, circleYs = types.circlePoints(radius)
+            rings, = plot.plot([], [], '.', color = 'red', animated = True)
+            body,  = plot.plot([], [], color = 'b', label = name, animated = True)
+            trail, = plot.plot([], [], '-', color = 'r', linewidth = 2, animated = True)
+            self._artists.append((rings, ringXs, ringYs, body, circleXs, circleYs, trail))
+            self._trails.append(_Trail(*_curveColumns(lambda xs = xs, ys = ys: (xs, ys)), max(1, -(-len(xs) // width))))
+        self._time = plot.text(0.02, 0.95, '', transform = plot.transAxes, animated = True)
+
+        if low:
+            low, high = numpy.min(low, axis = 0), numpy.max(high, axis = 0)
+            plot.set_xlim(low[0], high[0])
+            plot.set_ylim(low[1], high[1])
+        return plot
+
+    def artists(self):
+        """Объекты графика, изменяемые на каждом кадре"""
+        result = [self._time]
+        for rings, ringXs, ringYs, body, circleXs, circleYs, trail in self._artists:
+            result.extend((rings, body, trail))
+        return result
+
+    def reset(self):
+        """Начальное состояние анимации"""
+        for trail in self._trails:
+            trail.reset()
+        return self.artists()
+
+    def update(self, index):
+        """Кадр анимации для точки истории index"""
+        for (name, xs, ys, radius), (rings, ringXs, ringYs, body, circleXs, circleYs, trail), history in zip(self._dynamics, self._artists, self._trails):
+            # История объекта, выбывшего из расчета, завершена - объект остается в последней точке
+            last = min(index, len(xs) - 1)
+            if last < 0:
+                continue
+            x, y = xs[last], ys[last]
+            rings.set_data(ringXs + x, ringYs + y)
+            body.set_data(circleXs + x, circleYs + y)
+            trail.set_data(*history.advance(last))
+        self._time.set_text(tools.Formatter.time(self._times[index]))
+        return self.artists()
+
+    def animate(self, figure, frames):
+        """Анимация кадров frames (номера точек истории) на фигуре figure"""
+        self.build(figure)
+        return matplotlib.animation.FuncAnimation(figure, self.update, frames = frames, init_func = self.reset,
+                                                  interval = 10, blit = True, cache_frame_data = False)
+
+class LiveRenderer:
+    """Отрисовка траекторий и графиков |F|(t), |a|(t), |V|(t) во время расчета (Renderer.renderLive).
+       Линии создаются один раз и дополняются точками, записанными в историю после предыдущего кадра.
+       Кадры выводятся не чаще fps раз в секунду и не чаще, чем позволяет доля share времени на отрисовку.
+       Закрытие окна графиков останавливает расчет
+    """
+    def __init__(self, solver, fps = 10, share = 0.1):
+        self._solver     = solver
+        self._fps        = fps
+        self._share      = share
+        self._figure     = None
+        self._axes       = None
+        self._lines      = {}  # Линии объектов: {id(объект): [(_Trail, линия)]}
+        self._bucketSize = 1
+        self._rendering  = 0.  # Время отрисовки, с
+        self._frames     = 0   # Число выведенных кадров
+        self._nextFrame  = 0.  # Время (time.perf_counter()), с которого разрешен следующий кадр
+
+    @property
+    def renderingTime(self):
+        """Время, затраченное на отрисовку, с"""
+        return self._rendering
+
+    @property
+    def frames(self):
+        """Число выведенных кадров"""
+        return self._frames
+
+    def run(self, every = 100):
+        """Выполнить расчет с отрисовкой. every - интервал проверки необходимости кадра, шагов расчета"""
+        for snapshot in self.iterate(every):
+            pass
+
+    def iterate(self, every = 100):
+        """Выполнить расчет с отрисовкой (генератор снимков Solver.iterate). Выход из цикла останавливает расчет"""
+        self._build()
+        self._nextFrame = time.perf_counter() + 1. / self._fps
+        iterator = self._solver.iterate(every)
+        try:
+            for snapshot in iterator:
+                if not pylab.fignum_exists(self._figure.number):
+                    break
+                if time.perf_counter() >= self._nextFrame:
+                    self._frame()
+                yield snapshot
+        finally:
+            iterator.close()
+            if pylab.fignum_exists(self._figure.number):
+                self._frame()
+
+    def _build(self):
+        """Создать окно графиков. Размер блока прореживания - по ожидаемому числу точек истории и ширине осей"""
+        self._figure, self._axes = pylab.subplots(2, 2)
+        for plot, title in zip(self._axes.flat, ('F(t)', 'a(t)', 'V(t)', 'Траектории')):
+            plot.set_title(title)
+        self._axes[1, 1].set_aspect('equal', adjustable = 'datalim')
+        self._lines = {}
+        expected = self._solver.timeRange.iterations // self._solver.historyInterval + 1
+        width    = max(100, int(self._axes[0, 0].bbox.width))
+        self._bucketSize = max(1, -(-expected // width))
+        pylab.show(block = False)
+
+    def _frame(self):
+        """Вывести кадр: дополнить линии новыми точками истории и перерисовать окно"""
+        start = time.perf_counter()
+        for obj in list(self._solver.objects):
+            lines = self._lines.get(id(obj))
+            if lines is None:
+                lines = self._add(obj)
+            for trail, line in lines:
+                line.set_data(*trail.advance(len(obj.positionHistory) - 1))
+        for plot in self._axes.flat:
+            plot.relim()
+            plot.autoscale_view()
+        self._figure.canvas.draw()
+        self._figure.canvas.flush_events()
+
+        # Следующий кадр - не раньше, чем отрисовка займет не больше доли share времени
+        cost = time.perf_counter() - start
+        self._rendering = self._rendering + cost
+        self._frames    = self._frames + 1
+        self._nextFrame = start + max(1. / self._fps, cost / self._share)
+
+    def _add(self, obj):
+        """Создать линии объекта obj (статические объекты рисуются один раз)"""
+        lines = []
+        if obj.isStatic:
+            obj.renderStatic(self._axes[1, 1])
+        else:
+            for plot, name in zip(self._axes.flat, ('forceHistory', 'accelerationHistory', 'velocityHistory')):
+                line, = plot.plot([], [], '-', label = obj.name)
+                lines.append((_Trail(*_seriesColumns(lambda obj = obj, name = name: getattr(obj, name)), self._bucketSize), line))
+            history = lambda obj = obj: (obj.positionHistory.xs, obj.positionHistory.ys)
+            line, = self._axes[1, 1].plot([], [], '-', label = obj.name, linewidth = 2)
+            lines.append((_Trail(*_curveColumns(history), self._bucketSize), line))
+            self._axes[1, 1].legend()
+        self._lines[id(obj)] = lines
+        return lines
+
+def _curveColumns(columns):
+    """Функции values и sample следа для кривой (x, y), columns() - текущие массивы xs, ys"""
+    def values(first, last):
+        xs, ys = columns()
+        return xs[first:last], ys[first:last]
+    def sample(indices):
+        xs, ys = columns()
+        return numpy.asarray(xs[indices]), numpy.asarray(ys[indices])
+    return values, sample
+
+def _seriesColumns(history):
+    """Функции values и sample следа для временного ряда модуля вектора (t, |v|), history() - история вектора"""
+    def values(first, last):
+        value = history()
+        return (numpy.hypot(value.xs[first:last], value.ys[first:last]),)
+    def sample(indices):
+        value = history()
+        return numpy.asarray(value.ts[indices]), numpy.hypot(value.xs[indices], value.ys[indices])
+    return values, sample
+
+def _renderSegment(scene, frames, path, fps, figureSize, dpi):
+    """Запись кадров frames в видеофайл path (выполняется и в процессах пула).
+       Фон (оси, статические объекты) отрисовывается один раз, на каждом кадре восстанавливается
+       и дополняется изменяемыми объектами, изображение кадра передается ffmpeg в формате rawvideo
+    """
+    figure = matplotlib.figure.Figure(figsize = figureSize, dpi = dpi)
+    canvas = FigureCanvasAgg(figure)
+    scene.build(figure)
+    scene.reset()
+    canvas.draw()
+    background    = canvas.copy_from_bbox(figure.bbox)
+    width, height = canvas.get_width_height(physical = True)
+    command = [matplotlib.rcParams['animation.ffmpeg_path'], '-y', '-loglevel', 'error',
+               '-f', 'rawvideo', '-pix_fmt', 'rgba', '-s', '{0}x{1}'.format(width, height), '-r', str(fps), '-i', '-',
+               '-vf', 'pad=ceil(iw/2)*2:ceil(ih/2)*2', '-pix_fmt', 'yuv420p', path]
+    encoder = subprocess.Popen(command, stdin = subprocess.PIPE)
+    try:
+        for index in frames:
+            canvas.restore_region(background)
+            for artist in scene.update(index):
+                figure.draw_artist(artist)
+            encoder.stdin.write(canvas.buffer_rgba())
+    finally:
+        encoder.stdin.close()
+        if encoder.wait() != 0:
+            raise Exception('ffmpeg failed to encode "{0}"'.format(path))
+    return path
+
+def _saveParallel(scene, frames, path, fps, workers, figureSize, dpi):
+    """Запись анимации по частям в workers процессах с объединением частей без перекодирования"""
+    frames    = list(frames)
+    size      = -(-len(frames) // workers)
+    extension = os.path.splitext(path)[1] or '.mp4'
+    with tempfile.TemporaryDirectory() as directory:
+        parts = [os.path.join(directory, 'part{0:04d}{1}'.format(i, extension)) for i in range(0, len(frames), size)]
+        with ProcessPoolExecutor(max_workers = workers) as executor:
+            list(executor.map(_renderSegment, itertools.repeat(scene), [frames[i:i + size] for i in range(0, len(frames), size)],
+                              parts, itertools.repeat(fps), itertools.repeat(figureSize), itertools.repeat(dpi)))
+        listPath = os.path.join(directory, 'parts.txt')
+        with open(listPath, 'w') as file:
+            for part in parts:
+                file.write("file '{0}'\n".format(part))
+        subprocess.run([matplotlib.rcParams['animation.ffmpeg_path'], '-y', '-loglevel', 'error', '-f', 'concat', '-safe', '0',
+                        '-i', listPath, '-c', 'copy', path], check = True)
+
 class Renderer:
     """Рендерер графиков"""
 
     def __init__(self, solver):
+        self._solver            = solver
         self._objects           = solver.objects
         self._times             = solver.times
         self._animationInterval = 1000
@@ -92,39 +408,23 @@ class Renderer:
         print ('Отрисовка траекторий завершена')
         return RendererOutput('Траектории')
 
-    def renderAnimation(self):  
-        """Отрисовка анимации"""
+    def renderLive(self, fps = 10, share = 0.1):
+        """Отрисовка во время расчета: LiveRenderer.run() выполняет расчет и обновляет графики
+           не чаще fps кадров в секунду, отрисовка занимает не больше доли share времени
+        """
+        return LiveRenderer(self._solver, fps, share)
 
-        print ('Отрисовка анимации')
-
-        fig = pylab.figure(figsize=(16,9),dpi=80)
-        plot = fig.add_subplot(111, aspect='equal')
-        frames = []
-
-        bar = tools.ProgressBar()
-        bar.update(0, len(self._times))
-
-        pylab.ion()
-
-        for i in range(len(self._times)):
-            if divmod(i, self._animationInterval)[1] == 0:
-                frame = []
-                for obj in self._objects:
-                    part = obj.renderDynamic(plot, i)
-                    frame.append(part)
-
-                    part, = obj.positionHistory.trajectory(plot, i)
-                    frame.append(part)
-
-                frames.append(frame)
-
-                pylab.draw()
-                pylab.savefig("output/anim_{0}.png".format(i))
-
-                bar.update(i, len(self._times))
+    def renderAnimation(self, figureSize = (16, 9), dpi = 80):
+        """Отрисовка анимации: кадр на каждые animationInterval точек истории.
+           Объекты графика создаются один раз и обновляются на каждом кадре (blitting)
+        """
 
+        print ('Отрисовка анимации')
 
-        bar.end()
+        scene     = AnimationScene(self._objects, self._times)
+        frames    = range(0, scene.frameCount, self._animationInterval)
+        figure    = pylab.figure(figsize = figureSize, dpi = dpi)
+        animation = scene.animate(figure, frames)
 
-        animation = matplotlib.animation.ArtistAnimation(fig, frames, interval=10, blit=False)
-        return RendererAnimationOutput(animation)
\ No newline at end of file
+        print ('Отрисовка анимации завершена')
+        return RendererAnimationOutput(animation, scene, frames, figureSize, dpi)
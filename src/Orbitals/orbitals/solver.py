@@ -1,13 +1,24 @@
 ﻿# -*- coding: utf-8 -*-
+import asyncio
+import collections
+import itertools
+import json
 import math
+import os
+import pickle
+import time
+import numpy
 from colorconsole import terminal
-from orbitals.types import CollidedSpaceObjectController
+from orbitals.gravity import DirectGravity
+from orbitals.engine import ObjectEngine
+from orbitals.history import HistoryStorageFactory
+from orbitals.integrators import IntegratorFactory
+from orbitals.kepler import KeplerSpaceObjectController
+from orbitals.kepler import setKeplerState
+from orbitals.types import SpaceShip
 from orbitals.tools import Formatter
 from orbitals.tools import ProgressBar
 
-# гравитационная постоянная
-G = 6.67384 * math.pow(10, -11) # м^3 кг^-1 с^-2
-
 class TimeRange:
     """Диапазон расчета траекторий"""
 
@@ -16,10 +27,12 @@ class TimeRange:
         self._step          = 1         # Шаг времени
         self._iterations    = 1         # Число итераций
         self._to            = duration  # Конечное время
+        self._rtol          = None      # Допустимая относительная ошибка (адаптивный шаг)
+        self._atol          = None      # Допустимая абсолютная ошибка (адаптивный шаг)
 
     def withTimeStep(self, step):
         """Задать шаг расчета"""
-        self._iterations = (self._to - self._from) / step
+        self._iterations = int(round((self._to - self._from) / step))
         self._step       = step
         return self
 
@@ -29,6 +42,15 @@ class TimeRange:
         self._iterations = iterations
         return self
 
+    def withTolerance(self, rtol, atol):
+        """Задать допустимую ошибку и включить расчет с адаптивным шагом.
+           Шаг расчета (withTimeStep/withIterations) при этом задает начальный шаг
+           и сетку времени, в которой точки записываются в историю
+        """
+        self._rtol = rtol
+        self._atol = atol
+        return self
+
     @property
     def beginTime(self):
         """Начальное время расчета"""
@@ -48,18 +70,59 @@ class TimeRange:
     def iterations(self):
         """Число итераций"""
         return self._iterations
+
+    @property
+    def isAdaptive(self):
+        """Выполняется ли расчет с адаптивным шагом"""
+        return self._rtol != None
+
+    @property
+    def relativeTolerance(self):
+        """Допустимая относительная ошибка"""
+        return self._rtol
+
+    @property
+    def absoluteTolerance(self):
+        """Допустимая абсолютная ошибка"""
+        return self._atol
     
 class SolverLogLevel:
     info  = 1
     err   = 2
     trace = 3
+
+    names = {info: 'info', err: 'err', trace: 'trace'}
     
 class SolverLogEntry:
-    """Запись в логе вычислителя"""
-    def __init__(self, time, level, message):
+    """Запись в логе вычислителя.
+       Сообщение форматируется только при обращении к нему (message.format(*args)),
+       поэтому аргументы записи не должны изменяться после ее добавления в лог
+    """
+    __slots__ = ('_time', '_level', '_format', '_args', '_message')
+
+    def __init__(self, time, level, message, args = ()):
         self._time    = time
         self._level   = level
-        self._message = message
+        self._format  = message
+        self._args    = args
+        self._message = None if args else message
+
+    @property
+    def time(self):
+        """Время записи"""
+        return self._time
+
+    @property
+    def level(self):
+        """Уровень записи"""
+        return self._level
+
+    @property
+    def message(self):
+        """Текст записи"""
+        if self._message is None:
+            self._message = self._format.format(*self._args)
+        return self._message
 
     def print(self, screen):
         """Вывод записи в консоль"""
@@ -70,12 +133,54 @@ class SolverLogEntry:
             if self._level == SolverLogLevel.trace:
                 color = 'DGRAY'
         screen.set_color(fg = terminal.colors[color])
-        print ('{0}:   {1}'.format(Formatter.time(self._time), self._message))
+        print ('{0}:   {1}'.format(Formatter.time(self._time), self.message))
+
+class JsonLinesLogSink:
+    """Потоковая запись лога в файл JSON Lines - по одному объекту {"t", "level", "message"} на строку"""
+    def __init__(self, path):
+        self._path = path
+        self._file = None
+
+    @property
+    def path(self):
+        """Путь к файлу"""
+        return self._path
+
+    def open(self, append = False):
+        """Открыть файл (вызывается в начале расчета, append - при продолжении расчета)"""
+        self._file = open(self._path, 'a' if append else 'w', encoding = 'utf-8')
+
+    def write(self, entry):
+        """Записать запись лога"""
+        self._file.write(json.dumps({'t': entry.time, 'level': SolverLogLevel.names[entry.level], 'message': entry.message}, ensure_ascii = False))
+        self._file.write('\n')
+
+    def close(self):
+        """Закрыть файл (вызывается в конце расчета)"""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+class LogSinkFactory:
+    """Фабрика потоковых приемников лога"""
+    @staticmethod
+    def jsonLines(path):
+        """Запись лога в файл JSON Lines"""
+        return JsonLinesLogSink(path)
 
 class SolverLog:
-    """Лог вычислителя"""
-    def __init__(self):
-        self._events      = []
+    """Лог вычислителя.
+       Записи хранятся в кольцевом буфере ограниченного размера, при переполнении вытесняются старые записи.
+       Потоковые приемники (addSink) получают записи по завершении каждого шага расчета (flush)
+    """
+    defaultCapacity = 100000 # Размер буфера по умолчанию
+
+    def __init__(self, capacity = defaultCapacity):
+        self._events      = collections.deque(maxlen = capacity)
+        self._count       = 0  # Число записей, добавленных в лог
+        self._flushed     = 0  # Число записей, переданных приемникам
+        self._dropped     = 0  # Число записей, вытесненных из буфера
+        self._sinks       = []
         self._enableTrace = True
 
     @property
@@ -85,26 +190,108 @@ class SolverLog:
     def enableTrace(self, enable):
         self._enableTrace = enable
 
-    def info(self, time, message):
-        """Добавить инф. запись в лог"""
-        self._write(time, SolverLogLevel.info, message)
+    @property
+    def capacity(self):
+        """Размер буфера записей (None - без ограничения)"""
+        return self._events.maxlen
+    @capacity.setter
+    def capacity(self, capacity):
+        self._events = collections.deque(self._events, maxlen = capacity)
 
-    def err(self, time, message):
-        """Добавить запись об ошибке в лог"""
-        self._write(time, SolverLogLevel.err, message)
+    @property
+    def events(self):
+        """Записи, находящиеся в буфере"""
+        return list(self._events)
 
-    def trace(self, time, message):
-        """Добавить отладочную запись в лог"""
+    @property
+    def dropped(self):
+        """Число записей, вытесненных из буфера"""
+        return self._dropped
+
+    def addSink(self, sink):
+        """Добавить потоковый приемник записей"""
+        self._sinks.append(sink)
+
+    def info(self, time, message, *args):
+        """Добавить инф. запись в лог, message.format(*args) выполняется отложенно"""
+        self._write(time, SolverLogLevel.info, message, args)
+
+    def err(self, time, message, *args):
+        """Добавить запись об ошибке в лог, message.format(*args) выполняется отложенно"""
+        self._write(time, SolverLogLevel.err, message, args)
+
+    def trace(self, time, message, *args):
+        """Добавить отладочную запись в лог, message.format(*args) выполняется отложенно"""
         if self._enableTrace:
-            self._write(time, SolverLogLevel.trace, message)
+            self._write(time, SolverLogLevel.trace, message, args)
 
-    def _write(self, time, level, message):
+    def _write(self, time, level, message, args):
         """Добавить запись в лог"""
-        self._events.append(SolverLogEntry(time, level, message))
+        if len(self._events) == self._events.maxlen:
+            # Вытесняемая запись должна быть передана приемникам
+            if self._flushed <= self._count - len(self._events):
+                self.flush()
+            self._dropped = self._dropped + 1
+        self._events.append(SolverLogEntry(time, level, message, args))
+        self._count = self._count + 1
+
+    def mark(self):
+        """Текущая позиция в логе"""
+        return self._count
+
+    def since(self, mark):
+        """Записи, добавленные после позиции mark (вытесненные из буфера записи не возвращаются)"""
+        count = min(self._count - mark, len(self._events))
+        return list(itertools.islice(self._events, len(self._events) - count, None)) if count > 0 else []
+
+    def discard(self, begin, end):
+        """Удалить записи лога между позициями begin и end (записи, еще не переданные приемникам)"""
+        begin = max(begin, self._flushed)
+        if end <= begin:
+            return
+        tail = [self._events.pop() for i in range(min(len(self._events), self._count - end))]
+        for i in range(min(len(self._events), end - begin)):
+            self._events.pop()
+        self._events.extend(reversed(tail))
+        self._count = self._count - (end - begin)
+
+    def begin(self, append = False):
+        """Начало расчета - открыть приемники (append - продолжение расчета)"""
+        for sink in self._sinks:
+            sink.open(append)
+
+    def flush(self):
+        """Передать новые записи приемникам"""
+        pending = self._count - self._flushed
+        if pending > 0 and self._sinks:
+            # Новые записи выбираются с конца буфера - без копирования всего буфера на каждом шаге
+            entries = list(itertools.islice(reversed(self._events), min(pending, len(self._events))))
+            for entry in reversed(entries):
+                for sink in self._sinks:
+                    sink.write(entry)
+        self._flushed = self._count
+
+    def end(self):
+        """Завершение расчета - передать оставшиеся записи и закрыть приемники"""
+        self.flush()
+        for sink in self._sinks:
+            sink.close()
+
+    def saveState(self):
+        """Сохранить записи лога (для контрольной точки)"""
+        return list(self._events), self._count, self._dropped, self._enableTrace
+
+    def restoreState(self, state):
+        """Восстановить записи лога, сохраненные saveState(). Восстановленные записи приемникам не передаются"""
+        events, self._count, self._dropped, self._enableTrace = state
+        self._events  = collections.deque(events, maxlen = self._events.maxlen)
+        self._flushed = self._count
 
     def print(self):
         """Вывод лога в консоль"""
         screen = terminal.get_terminal()
+        if self._dropped > 0:
+            print ('... {0} ранних записей вытеснено из буфера лога'.format(self._dropped))
         for event in self._events:
             event.print(screen)
         screen.reset()
@@ -115,23 +302,38 @@ class SolverLogFacade:
         self._ctx = ctx
         self._log = log
 
-    def info(self, message):
+    def info(self, message, *args):
         """Добавить инф. запись в лог"""
-        self._log.info(self._ctx.t, message)
+        self._log.info(self._ctx.t, message, *args)
 
-    def err(self, time, message):
+    def err(self, time, message, *args):
         """Добавить запись об ошибке в лог"""
-        self._log.err(self._ctx.t, message)
+        self._log.err(self._ctx.t, message, *args)
 
-    def trace(self, time, message):
+    def trace(self, time, message, *args):
         """Добавить отладочную запись в лог"""
-        self._log.trace(self._ctx.t, message)
+        self._log.trace(self._ctx.t, message, *args)
         
+class SolverSnapshot:
+    """Снимок состояния расчета (Solver.iterate). Координаты и скорости - массивы [N, 2] только для чтения,
+       строки соответствуют объектам objects. Объекты, выбывшие из расчета, имеют состояние в момент выбывания
+    """
+    __slots__ = ('t', 'iteration', 'objects', 'positions', 'velocities', 'log')
+
+    def __init__(self, t, iteration, objects, positions, velocities, log):
+        self.t          = t          # Время
+        self.iteration  = iteration  # Номер шага расчета
+        self.objects    = objects    # Объекты расчета
+        self.positions  = positions  # Координаты объектов, м
+        self.velocities = velocities # Скорости объектов, м/с
+        self.log        = log        # Записи лога, добавленные после предыдущего снимка (SolverLogEntry)
+
 class SolverCtx:
     """Контекст вычислителя"""
     def __init__(self, solver):
         self._solver         = solver
         self._t              = 0.
+        self._dt             = 0.
         self._putIntoHistory = False
         self._iteration      = 0     
         self._logFacade      = SolverLogFacade(self, solver._log)            
@@ -139,14 +341,42 @@ class SolverCtx:
     def begin(self):
         """Инициализация расчета"""
         self._t              = self._solver._range.beginTime
+        self._dt             = self._solver._range.timeStep
         self._iteration      = 0
-        self._putIntoHistory = divmod(self._iteration, self._solver._historyInterval)[1] == 0
+        self._putIntoHistory = self._isHistoryIteration()
 
-    def next(self):
-        """Переход к следующему шагу расчета"""
-        self._t              = self._t + self.dt
+    def next(self, t = None):
+        """Переход к следующему шагу расчета, t - точное время начала следующего шага"""
+        self._t              = self._t + self._dt if t == None else t
         self._iteration      = self._iteration + 1
-        self._putIntoHistory = divmod(self._iteration, self._solver._historyInterval)[1] == 0
+        self._putIntoHistory = self._isHistoryIteration()
+
+    def setStep(self, dt):
+        """Задать шаг расчета (в режиме адаптивного шага)"""
+        self._dt = dt
+
+    def skip(self, count, t):
+        """Пропустить count шагов расчета (баллистический участок), t - время начала следующего шага"""
+        self._t              = t
+        self._iteration      = self._iteration + count
+        self._putIntoHistory = self._isHistoryIteration()
+
+    def saveState(self):
+        """Сохранить время и номер шага (для контрольной точки)"""
+        return self._t, self._dt, self._iteration
+
+    def restoreState(self, state):
+        """Восстановить время и номер шага, сохраненные saveState()"""
+        self._t, self._dt, self._iteration = state
+        self._putIntoHistory = self._isHistoryIteration()
+
+    def _isHistoryIteration(self):
+        """Записывается ли в историю текущий шаг расчета.
+           В режиме адаптивного шага точки записываются вычислителем в узлах сетки вывода
+        """
+        if self._solver._range.isAdaptive:
+            return False
+        return divmod(self._iteration, self._solver._historyInterval)[1] == 0
 
     @property
     def t(self):
@@ -156,13 +386,23 @@ class SolverCtx:
     @property
     def dt(self):
         """Шаг расчета"""
-        return self._solver._range.timeStep
+        return self._dt
+
+    @property
+    def iteration(self):
+        """Номер шага расчета"""
+        return self._iteration
 
     @property
     def putIntoHistory(self):
         """Шаг расчета"""
         return self._putIntoHistory
 
+    @property
+    def profiler(self):
+        """Профилировщик вычислителя (None - замеры не выполняются)"""
+        return self._solver._profiler
+
     @property
     def log(self):
         """Лог вычислителя"""
@@ -175,8 +415,30 @@ class Solver:
         self._times              = []
         self._range              = TimeRange(1)
         self._historyInterval    = 1
+        self._historyStorage     = HistoryStorageFactory.memory()
         self._log                = SolverLog()
         self._ctx                = SolverCtx(self)
+        self._engine             = ObjectEngine()
+        self._integrator         = IntegratorFactory.euler()
+        self._gravity            = DirectGravity()
+        self._profiler           = None
+        self._coast              = None
+        self._coastRetry         = 0     # Номер шага, с которого разрешена следующая попытка баллистического участка
+        self._shipCoastRetry     = 0     # То же для баллистических участков отдельных кораблей
+        self._coasting           = []    # Корабли на баллистических участках отдельных кораблей
+        self._escapeRadius       = None  # Радиус области расчета (None - не ограничен)
+        self._removed            = []    # Объекты, исключаемые из расчета в начале следующего шага
+        self._isChanged          = False # Изменен ли состав объектов во время расчета
+        self._stopConditions     = []    # Условия досрочного завершения расчета
+        self._stopInterval       = 1     # Интервал проверки условий завершения, шагов расчета
+        self._stopReason         = None  # Причина досрочного завершения (None - расчет выполнен до конца диапазона)
+        self._quiet              = False
+        self._isRunning          = False
+        self._cursor             = None  # Состояние адаптивного расчета: (число точек вывода, предлагаемый шаг)
+        self._checkpointPath     = None  # Файл автоматической контрольной точки
+        self._checkpointInterval = 300.  # Интервал автоматической записи контрольной точки, с
+        self._nextCheckpoint     = 0.
+        self._pendingCheckpoint  = None  # Контрольная точка, запрошенная во время шага расчета
 
     @property
     def objects(self):
@@ -196,16 +458,135 @@ class Solver:
     def historyInterval(self, historyInterval):
         self._historyInterval = historyInterval
 
+    @property
+    def historyStorage(self):
+        """Хранилище истории объектов (HistoryStorage, по умолчанию - в памяти)"""
+        return self._historyStorage
+    @historyStorage.setter
+    def historyStorage(self, historyStorage):
+        self._historyStorage = historyStorage
+
     @property
     def enableTrace(self):
-        return self._log._enableTrace
+        return self._log.enableTrace
     @enableTrace.setter
     def enableTrace(self, enable):
-        self._log._enableTrace = enable
+        self._log.enableTrace = enable
+
+    @property
+    def logCapacity(self):
+        """Размер буфера лога (None - без ограничения)"""
+        return self._log.capacity
+    @logCapacity.setter
+    def logCapacity(self, capacity):
+        self._log.capacity = capacity
+
+    def addLogSink(self, sink):
+        """Добавить потоковый приемник лога (напр. LogSink.jsonLines(path))"""
+        self._log.addSink(sink)
     
     def addObject(self, body):
-        """Добавить небесное тело к расчету"""
-        self._objects.append(body)
+        """Добавить небесное тело к расчету. Во время расчета тело участвует в расчете со следующего шага"""
+        if self._isRunning:
+            if body not in self._objects:
+                self._objects.append(body)
+                body.attachHistory(self._historyStorage)
+                self._isChanged = True
+        else:
+            self._objects.append(body)
+
+    def removeObject(self, body):
+        """Исключить небесное тело из расчета. Во время расчета тело выбывает в начале следующего шага,
+           его история завершается
+        """
+        if self._isRunning:
+            if body in self._objects and body not in self._removed:
+                self._removed.append(body)
+                self._isChanged = True
+        else:
+            self._objects.remove(body)
+
+    @property
+    def engine(self):
+        """Вычислительное ядро"""
+        return self._engine
+    @engine.setter
+    def engine(self, engine):
+        self._engine = engine
+
+    @property
+    def integrator(self):
+        """Интегратор уравнений движения"""
+        return self._integrator
+    @integrator.setter
+    def integrator(self, integrator):
+        self._integrator = integrator
+
+    @property
+    def gravity(self):
+        """Алгоритм расчета гравитации (Barnes-Hut поддерживается только ядром Engine.arrays())"""
+        return self._gravity
+    @gravity.setter
+    def gravity(self, gravity):
+        self._gravity = gravity
+
+    @property
+    def quiet(self):
+        """Расчет без вывода в консоль (индикатор выполнения и лог не выводятся)"""
+        return self._quiet
+    @quiet.setter
+    def quiet(self, quiet):
+        self._quiet = quiet
+
+    @property
+    def profiler(self):
+        """Профилировщик расчета (Profiler(), None - профилирование отключено)"""
+        return self._profiler
+    @profiler.setter
+    def profiler(self, profiler):
+        self._profiler = profiler
+
+    @property
+    def coast(self):
+        """Баллистические участки по кеплеровым орбитам (KeplerCoast(), None - участки не выделяются)"""
+        return self._coast
+    @coast.setter
+    def coast(self, coast):
+        self._coast = coast
+
+    @property
+    def escapeRadius(self):
+        """Радиус области расчета, м: объекты, удалившиеся от начала координат дальше escapeRadius,
+           выбывают из расчета (None - область не ограничена)
+        """
+        return self._escapeRadius
+    @escapeRadius.setter
+    def escapeRadius(self, radius):
+        self._escapeRadius = radius
+
+    @property
+    def stopConditions(self):
+        """Условия досрочного завершения расчета (StopCondition)"""
+        return self._stopConditions
+
+    def addStopCondition(self, condition):
+        """Добавить условие досрочного завершения: расчет останавливается после шага, на котором
+           выполнено любое из условий, причина записывается в лог и в stopReason
+        """
+        self._stopConditions.append(condition)
+
+    @property
+    def stopInterval(self):
+        """Интервал проверки условий завершения, шагов расчета"""
+        return self._stopInterval
+    @stopInterval.setter
+    def stopInterval(self, interval):
+        self._stopInterval = interval
+
+    @property
+    def stopReason(self):
+        """Причина досрочного завершения последнего расчета (None - расчет выполнен до конца диапазона)"""
+        return self._stopReason
 
     @property
     def timeRange(self):
@@ -215,65 +596,540 @@ class Solver:
     def timeRange(self, range):
         self._range = range
 
+    def autoCheckpoint(self, path, interval = 300.):
+        """Записывать контрольную точку в файл path каждые interval секунд расчета (path = None - отключить)"""
+        self._checkpointPath     = path
+        self._checkpointInterval = interval
+
+    def checkpoint(self, path):
+        """Сохранить состояние расчета в файл path: объекты с контроллерами, событиями и историей,
+           время и номер шага, лог. Файл заменяется атомарно - прерванная запись не портит прежнюю точку.
+           Во время расчета (напр. из обработчика профилировщика) точка записывается по завершении текущего шага
+        """
+        if self._isRunning:
+            self._pendingCheckpoint = path
+        else:
+            self._writeCheckpoint(path)
+
+    def _writeCheckpoint(self, path):
+        """Записать контрольную точку (между шагами расчета)"""
+        if self._isRunning:
+            if self._isChanged:
+                self._updateObjects()
+            self._engine.sync(self._ctx)
+        state = {
+            'objects':         self._objects,
+            'times':           self._times,
+            'range':           self._range,
+            'historyInterval': self._historyInterval,
+            'historyStorage':  self._historyStorage,
+            'engine':          type(self._engine),
+            'engineState':     self._engine.saveState() if self._isRunning else None,
+            'integrator':      self._integrator,
+            'gravity':         self._gravity,
+            'coast':           self._coast,
+            'coastRetry':      self._coastRetry,
+            'shipCoastRetry':  self._shipCoastRetry,
+            'escapeRadius':    self._escapeRadius,
+            'stopConditions':  self._stopConditions,
+            'stopInterval':    self._stopInterval,
+            'ctx':             self._ctx.saveState(),
+            'cursor':          self._cursor,
+            'log':             self._log.saveState()
+        }
+        temp = path + '.tmp'
+        with open(temp, 'wb') as file:
+            pickle.dump(state, file, protocol = pickle.HIGHEST_PROTOCOL)
+        os.replace(temp, path)
+
+    def resume(self, path):
+        """Продолжить расчет с контрольной точки, сохраненной checkpoint()"""
+        with open(path, 'rb') as file:
+            state = pickle.load(file)
+        self._objects         = state['objects']
+        self._times           = state['times']
+        self._range           = state['range']
+        self._historyInterval = state['historyInterval']
+        self._historyStorage  = state['historyStorage']
+        self._engine          = state['engine']()
+        self._integrator      = state['integrator']
+        self._gravity         = state['gravity']
+        self._coast           = state['coast']
+        self._coastRetry      = state['coastRetry']
+        self._shipCoastRetry  = state['shipCoastRetry']
+        self._escapeRadius    = state['escapeRadius']
+        self._stopConditions  = state['stopConditions']
+        self._stopInterval    = state['stopInterval']
+        self._cursor          = state['cursor']
+        self._ctx.restoreState(state['ctx'])
+        self._log.restoreState(state['log'])
+        self._run(isResumed = True, engineState = state['engineState'])
+
     def run(self):
         """Запустить расчет"""
-        print ('Расчет траекторий')
-        bar = ProgressBar()
-        bar.update(0, self._range.iterations)
+        self._prepare()
+        self._run(isResumed = False)
+
+    def iterate(self, every = 1):
+        """Выполнять расчет по мере получения результатов (генератор): каждые every шагов расчета
+           и по завершении расчета возвращается снимок состояния SolverSnapshot. Индикатор выполнения
+           и лог в консоль не выводятся. Выход из цикла (break) останавливает расчет - история объектов
+           завершается, в stopReason записывается причина остановки
+        """
+        self._prepare()
+        mark  = self._log.mark()
+        self._begin(isResumed = False)
+        ctx   = self._ctx
+        steps = self._runAdaptive(None) if self._range.isAdaptive else self._runFixed(None)
+        last  = ctx.iteration
+        isCompleted = False
+        try:
+            for step in steps:
+                if ctx.iteration - last >= every:
+                    snapshot, mark = self._snapshot(mark)
+                    last = ctx.iteration
+                    yield snapshot
+            isCompleted = True
+        finally:
+            steps.close()
+            if not isCompleted and self._stopReason is None:
+                self._stopReason = 'выход из цикла iterate()'
+                self._log.info(ctx.t, 'Расчет остановлен: {0}', self._stopReason)
+            self._end()
+        snapshot, mark = self._snapshot(mark)
+        yield snapshot
 
+    async def iterateAsync(self, every = 1):
+        """Асинхронный вариант iterate(): между снимками (каждые every шагов) управление передается
+           циклу событий asyncio. Для остановки расчета при выходе из цикла async for генератор
+           следует закрыть (contextlib.aclosing)
+        """
+        iterator = self.iterate(every)
+        try:
+            for snapshot in iterator:
+                yield snapshot
+                await asyncio.sleep(0)
+        finally:
+            iterator.close()
+
+    def _prepare(self):
+        """Подготовка нового расчета: начальное время, история объектов"""
         self._ctx.begin()
-        self._log.info(self._ctx.t, 'Запуск симуляции');
-        for i in range(self._range.iterations):
-            self._beginStep()
-            self._runStep()
-            self._endStep()
+        self._cursor     = (0, self._range.timeStep)
+        self._coastRetry = 0
+        self._shipCoastRetry = 0
+        for obj in self._objects:
+            obj.attachHistory(self._historyStorage)
+
+    def _run(self, isResumed, engineState = None):
+        """Расчет от текущего состояния контекста до конца диапазона (engineState - состояние ядра из контрольной точки)"""
+        bar = None
+        if not self._quiet:
+            print ('Расчет траекторий')
+            bar = ProgressBar()
 
-            self._ctx.next()
-            bar.update(i, self._range.iterations)
+        self._begin(isResumed, engineState)
+        for step in (self._runAdaptive(bar) if self._range.isAdaptive else self._runFixed(bar)):
+            pass
+        self._end()
+        if bar is not None:
+            bar.end()
+        if not self._quiet:
+            print ('Расчет траекторий завершен')
+            self._log.print()
+            if self._profiler is not None:
+                self._profiler.report().print()
 
-        bar.end()
+    def _begin(self, isResumed, engineState = None):
+        """Начало расчета: загрузка объектов в ядро, открытие лога"""
+        if self._profiler is not None:
+            self._profiler.begin(self)
+        self._coasting = [obj for obj in self._objects if isinstance(obj.controller, KeplerSpaceObjectController)]
+        self._engine.begin(self, self._ctx)
+        self._engine.restoreState(engineState)
+        self._reserveHistory()
+        self._log.begin(append = isResumed)
+        self._log.info(self._ctx.t, 'Продолжение симуляции' if isResumed else 'Запуск симуляции');
+        self._isRunning      = True
+        self._stopReason     = None
+        self._nextCheckpoint = time.monotonic() + self._checkpointInterval
+
+    def _end(self):
+        """Завершение расчета: выгрузка состояния из ядра, завершение истории и лога"""
+        if self._isChanged:
+            self._updateObjects()
+        self._engine.end(self._ctx)
+        self._endShipCoasts(list(self._coasting))
+        for obj in self._objects:
+            # При досрочном завершении память, выделенная под весь диапазон расчета, освобождается
+            if self._stopReason is None:
+                obj.flushHistory()
+            else:
+                obj.trimHistory()
+        self._isRunning = False
         self._log.info(self._ctx.t, 'Симуляция завершена');
-        print ('Расчет траекторий завершен')
-        self._log.print()
+        self._log.end()
+        if self._profiler is not None:
+            self._profiler.end(self)
+
+    def _runFixed(self, bar):
+        """Расчет с постоянным шагом (генератор, возвращает управление после каждого шага или баллистического участка)"""
+        self._updateProgress(bar, self._ctx.iteration, self._range.iterations)
+        while self._ctx.iteration < self._range.iterations:
+            if self._isChanged:
+                self._updateObjects()
+            if self._coast is None or not self._coastFixed():
+                if self._coast is not None:
+                    self._coastShips()
+                self._beginStep()
+                self._runStep()
+                self._integrateStep()
+                self._endStep()
+                self._log.flush()
+                self._ctx.next()
+
+            if self._stopConditions and self._isStopDue():
+                break
+            self._updateProgress(bar, self._ctx.iteration - 1, self._range.iterations)
+            if self._checkpointPath is not None or self._pendingCheckpoint is not None:
+                self._checkpointIfDue()
+            yield
+
+    def _runAdaptive(self, bar):
+        """Расчет с адаптивным шагом (генератор, возвращает управление после каждого принятого шага).
+           Шаг подбирается по оценке локальной ошибки вложенной схемы Рунге-Кутты и не пересекает
+           границы событий управления, точки в историю записываются в узлах регулярной сетки
+           (шаг расчета * интервал записи) с помощью плотного вывода
+        """
+        ctx        = self._ctx
+        integrator = self._integrator if self._integrator.isAdaptive else IntegratorFactory.dormandPrince()
+        rtol, atol = self._range.relativeTolerance, self._range.absoluteTolerance
+        beginTime  = self._range.beginTime
+        endTime    = self._range.endTime
+        output     = self._range.timeStep * self._historyInterval
+        outputs, proposed = self._cursor
+
+        self._updateProgress(bar, 0, endTime - beginTime)
+        while ctx.t < endTime:
+            if self._isChanged:
+                self._updateObjects()
+            # Шаг не должен пересекать границы событий управления
+            boundary = min(endTime, self._nextEventTime(ctx.t))
+            if self._coast is not None:
+                count = self._coastAdaptive(boundary, beginTime + outputs * output, output, proposed)
+                if count is not None:
+                    outputs      = outputs + count
+                    self._cursor = (outputs, proposed)
+                    self._updateProgress(bar, ctx.t - beginTime, endTime - beginTime)
+                    if self._stopConditions and self._isStopDue():
+                        break
+                    yield
+                    continue
+            h = min(proposed, boundary - ctx.t)
+
+            state = self._saveState()
+            while True:
+                ctx.setStep(h)
+                begin = self._log.mark()
+                self._beginStep()
+                end = self._log.mark()
+                self._runStep()
+                step = self._attemptStep(integrator, rtol, atol)
+                if step.error <= 1. or h <= 1E-12 * max(1., abs(ctx.t)):
+                    break
+
+                # Шаг отклонен - возвращаемся в начало шага
+                self._engine.setState(*step.beginState)
+                self._restoreState(state)
+                self._log.discard(begin, end)
+                if self._profiler is not None:
+                    self._profiler.stepRejected()
+                h = h * integrator.stepFactor(step.error)
+
+            self._endStep()
+            self._log.flush()
+
+            # Запись в историю точек, попавших на шаг
+            while beginTime + outputs * output < ctx.t + h:
+                t = beginTime + outputs * output
+                self._engine.setState(*step.interpolate((t - ctx.t) / h))
+                self._writeHistory(t)
+                outputs = outputs + 1
+            self._engine.setState(*step.endState)
+
+            ctx.next(boundary if ctx.t + h >= boundary else None)
+            self._updateProgress(bar, ctx.t - beginTime, endTime - beginTime)
+            proposed     = h * integrator.stepFactor(step.error)
+            self._cursor = (outputs, proposed)
+            if self._stopConditions and self._isStopDue():
+                break
+            if self._checkpointPath is not None or self._pendingCheckpoint is not None:
+                self._checkpointIfDue()
+            yield
+
+        # Последняя точка сетки вывода совпадает с концом расчета
+        if self._stopReason is None and beginTime + outputs * output <= endTime * (1. + 1E-12):
+            self._writeHistory(beginTime + outputs * output)
+
+    def _coastFixed(self):
+        """Баллистический участок в режиме постоянного шага: шаги до ближайшего события управления
+           заменяются переносом объектов по кеплеровым орбитам. Возвращает True, если участок выполнен
+        """
+        ctx = self._ctx
+        if ctx.iteration < self._coastRetry:
+            return False
+
+        # Шаги, начинающиеся до границы события, выполняются без событий
+        dt       = ctx.dt
+        steps    = self._range.iterations - ctx.iteration
+        boundary = self._nextEventTime(ctx.t)
+        if boundary < ctx.t + steps * dt:
+            steps = int(math.ceil((boundary - ctx.t) / dt))
+        orbits, duration = self._coastDuration(steps * dt)
+        if duration < steps * dt:
+            steps = int(duration / dt)
+        if steps < self._coast.minSteps:
+            self._coastRetry = ctx.iteration + self._coast.retrySteps
+            return False
+
+        # Состояние после шага записывается в историю с отметкой времени начала шага (как в _endStep)
+        interval = self._historyInterval
+        first    = -(-ctx.iteration // interval) * interval
+        offsets  = numpy.arange(first - ctx.iteration, steps, interval, dtype = numpy.float64)
+        self._coastJump(orbits, (offsets + 1.) * dt, ctx.t + offsets * dt, steps * dt)
+        ctx.skip(steps, ctx.t + steps * dt)
+        return True
+
+    def _coastAdaptive(self, boundary, nextOutput, output, proposed):
+        """Баллистический участок в режиме адаптивного шага до момента boundary (или меньше, если возмущения
+           превысят допустимые). Возвращает число записанных точек вывода (None - участок не выполнен)
+        """
+        ctx = self._ctx
+        if ctx.iteration < self._coastRetry:
+            return None
+
+        orbits, duration = self._coastDuration(boundary - ctx.t)
+        if duration < self._coast.minSteps * proposed:
+            self._coastRetry = ctx.iteration + self._coast.retrySteps
+            return None
+
+        end     = boundary if duration >= boundary - ctx.t else ctx.t + duration
+        times   = numpy.arange(nextOutput, end, output)
+        times   = times[times < end]
+        self._coastJump(orbits, times - ctx.t, times, end - ctx.t)
+        ctx.setStep(end - ctx.t)
+        ctx.next(end)
+        return len(times)
+
+    def _coastShips(self):
+        """Баллистические участки отдельных кораблей в режиме постоянного шага (KeplerCoast): корабли
+           без событий управления переносятся по кеплеровым орбитам, остальные объекты интегрируются.
+           Участок корабля завершается перед шагом с его событием управления, возмущения и сближения
+           с другими объектами проверяются каждые minSteps шагов
+        """
+        ctx      = self._ctx
+        coast    = self._coast
+        ending   = [obj for obj in self._coasting if not obj.schedule.isIdle(ctx.t)]
+        starting = []
+        if ctx.iteration % coast.minSteps == 0:
+            coasting   = [obj for obj in self._coasting if obj not in ending]
+            candidates = [] if ctx.iteration < self._shipCoastRetry else \
+                         [obj for obj in self._objects if isinstance(obj, SpaceShip) and obj.controller.isAffectedByForces and obj.schedule.isIdle(ctx.t)]
+            if coasting or candidates:
+                self._engine.sync(ctx)
+                sources  = self._gravity.sources(self._objects)
+                interval = coast.minSteps * ctx.dt
+                for obj in coasting:
+                    if not coast.isShipFree(self._objects, obj.controller.orbit, interval, sources):
+                        ending.append(obj)
+                for obj in candidates:
+                    orbit = coast.shipOrbit(self._objects, self._objects.index(obj), ctx.t, ctx.dt, sources)
+                    if orbit is not None and coast.isShipFree(self._objects, orbit, interval, sources):
+                        starting.append((obj, orbit))
+                    else:
+                        self._shipCoastRetry = ctx.iteration + coast.retrySteps
+        if not ending and not starting:
+            return
+
+        self._engine.sync(ctx)
+        self._endShipCoasts(ending)
+        for obj, orbit in starting:
+            KeplerSpaceObjectController(orbit, ctx.t, obj.controller).attach(obj)
+            obj.controller.setState(ctx.t)
+            self._coasting.append(obj)
+            self._log.info(ctx.t, 'Баллистический участок корабля {0}', obj.name)
+        # Ядро заново загружает состояние и состав динамических объектов
+        self._engine.begin(self, ctx)
+
+    def _endShipCoasts(self, ships):
+        """Завершить баллистические участки кораблей ships - восстановить их прежние контроллеры"""
+        for obj in ships:
+            obj.controller = obj.controller.previous
+            self._coasting.remove(obj)
+            self._log.info(self._ctx.t, 'Завершен баллистический участок корабля {0}', obj.name)
+
+    def _coastDuration(self, duration):
+        """Орбиты объектов и допустимая длительность баллистического участка (не более duration) с текущего момента"""
+        self._engine.sync(self._ctx)
+        sources = self._gravity.sources(self._objects)
+        orbits  = self._coast.orbits(self._objects, self._ctx.t, sources)
+        if orbits is None:
+            return None, 0.
+        return orbits, self._coast.duration(self._objects, orbits, duration, sources)
+
+    def _coastJump(self, orbits, offsets, times, duration):
+        """Перенести объекты по кеплеровым орбитам: состояния через offsets секунд записываются в историю
+           с отметками времени times, затем объекты переходят в состояние через duration секунд
+        """
+        if self._profiler is None:
+            self._coastJumpCore(orbits, offsets, times, duration)
+        else:
+            self._profiler.measure('coast', self._coastJumpCore, orbits, offsets, times, duration)
+        self._log.info(self._ctx.t, 'Баллистический участок до {0}', Formatter.time(self._ctx.t + duration))
+        self._log.flush()
+
+    def _coastJumpCore(self, orbits, offsets, times, duration):
+        """Перенести объекты по кеплеровым орбитам (см. _coastJump)"""
+        tracks = [(self._objects[orbit.index], orbit, orbit.states(numpy.append(offsets, duration))) for orbit in orbits]
+        for k, t in enumerate(times.tolist()):
+            for obj, orbit, (positions, velocities) in tracks:
+                setKeplerState(obj, orbit, positions[k], velocities[k])
+            for obj in self._objects:
+                if obj.controller.isActive:
+                    obj.putHistory(t)
+            self._times.append(t)
+        for obj, orbit, (positions, velocities) in tracks:
+            setKeplerState(obj, orbit, positions[-1], velocities[-1])
+
+        # Ядро заново загружает состояние объектов
+        self._engine.begin(self, self._ctx)
+
+    def _updateObjects(self):
+        """Применить изменения состава объектов, сделанные во время расчета (addObject, removeObject).
+           Исключенные объекты завершают историю, ядро заново загружает состояние объектов
+        """
+        ctx = self._ctx
+        self._engine.sync(ctx)
+        self._endShipCoasts([body for body in self._removed if body in self._coasting])
+        for body in self._removed:
+            body.finalizeHistory(ctx.t)
+            self._objects.remove(body)
+            self._log.info(ctx.t, 'Объект {0} исключен из расчета', body.name)
+        self._removed   = []
+        self._isChanged = False
+        self._engine.begin(self, ctx)
+        self._reserveHistory()
+
+    def _writeHistory(self, t):
+        """Записать текущее состояние объектов в историю в момент времени t"""
+        if self._profiler is None:
+            self._engine.writeHistory(t)
+        else:
+            self._profiler.measure('history', self._engine.writeHistory, t)
+        self._times.append(t)
+
+    def _updateProgress(self, bar, value, max):
+        """Обновить индикатор выполнения"""
+        if bar is None:
+            return
+        if self._profiler is None:
+            bar.update(value, max)
+        else:
+            self._profiler.measure('progress', bar.update, value, max)
+
+    def _checkpointIfDue(self):
+        """Записать запрошенную контрольную точку или автоматическую, если истек интервал"""
+        if self._pendingCheckpoint is not None:
+            path, self._pendingCheckpoint = self._pendingCheckpoint, None
+            self._writeCheckpoint(path)
+        if self._checkpointPath is not None and time.monotonic() >= self._nextCheckpoint:
+            self._writeCheckpoint(self._checkpointPath)
+            self._nextCheckpoint = time.monotonic() + self._checkpointInterval
+
+    def _snapshot(self, mark):
+        """Снимок состояния объектов и записи лога, добавленные после позиции mark. Возвращает снимок и новую позицию лога"""
+        self._engine.sync(self._ctx)
+        objects    = list(self._objects)
+        positions  = numpy.array([(obj.position.x, obj.position.y) for obj in objects], dtype = numpy.float64).reshape(-1, 2)
+        velocities = numpy.array([(obj.velocity.x, obj.velocity.y) for obj in objects], dtype = numpy.float64).reshape(-1, 2)
+        positions.flags.writeable  = False
+        velocities.flags.writeable = False
+        snapshot = SolverSnapshot(self._ctx.t, self._ctx.iteration, objects, positions, velocities, self._log.since(mark))
+        return snapshot, self._log.mark()
+
+    def _isStopDue(self):
+        """Проверить условия досрочного завершения (по завершении шага). Возвращает True, если расчет нужно остановить"""
+        ctx = self._ctx
+        if ctx.iteration % self._stopInterval != 0:
+            return False
+        if any(condition.isStateRequired for condition in self._stopConditions):
+            self._engine.sync(ctx)
+        for condition in self._stopConditions:
+            reason = condition.check(self)
+            if reason is not None:
+                self._stopReason = reason
+                self._log.info(ctx.t, 'Расчет остановлен: {0}', reason)
+                return True
+        return False
+
+    def _reserveHistory(self):
+        """Выделить память под историю по ожидаемому (оставшемуся) числу точек"""
+        count = int(math.ceil((self._range.iterations - self._ctx.iteration) / self._historyInterval)) + 1
+        for obj in self._objects:
+            if obj.controller.isActive:
+                obj.reserveHistory(count)
+
+    def _nextEventTime(self, t):
+        """Ближайшая граница события управления после момента t"""
+        result = float('inf')
+        for obj in self._objects:
+            if isinstance(obj, SpaceShip) and obj.controller.isActive:
+                result = min(result, obj.schedule.nextBoundary(t))
+        return result
+
+    def _saveState(self):
+        """Сохранить состояние объектов, изменяемое в начале шага расчета"""
+        return [obj.saveState() for obj in self._objects]
+
+    def _restoreState(self, state):
+        """Восстановить состояние объектов, сохраненное _saveState()"""
+        for obj, objState in zip(self._objects, state):
+            obj.restoreState(objState)
 
     def _beginStep(self):
         """Начать шаг расчета"""
-        for obj in self._objects:
-            obj.beginStep(self._ctx)
+        if self._profiler is None:
+            self._engine.beginStep(self._ctx)
+        else:
+            self._profiler.measure('beginStep', self._engine.beginStep, self._ctx)
 
     def _runStep(self):
         """Выполнить шаг расчета"""
-        for objA in self._objects:
-            for objB in self._objects:
-                # 1. Объект не влияет сам на себя
-                # 2. Объект должен быть подвержен действию сил (втч сил гравитации)
-                #    Напр. объект, столкнувшийся с другим, более не подвержен действию внешних сил
-                if objA != objB and objA.controller.isAffectedByForces:
-                    rVector = objB.position - objA.position
-                    distance = rVector.length
-
-                    # расчет коллизий - меньший по массе объект может столкнуться с большим по массе
-                    if objA.mass < objB.mass and distance <= objA.radius + objB.radius:
-                       # Объект A столкнулся с объектом B
-                       CollidedSpaceObjectController(objB, -rVector).attach(objA)
-                       objA.beginStep(self._ctx)
-                       relativeVelocity = (objA.velocity - objB.velocity).length
-                       self._log.err(self._ctx.t, 'Объект {0} столкнулся с объектом {1}, скорость столкновения {2}'.format(objA.name, objB.name, Formatter.speed(relativeVelocity)))
-                       continue
-
-                    # расчет гравитации
-                    if distance > 0:
-                        g = G * objA.mass * objB.mass
-                        h = 1. / distance**3
-                        force = rVector * g * h
-                        self._log.trace(self._ctx.t, 'Грав. сила для объекта {0} = {1} | {2}'.format(objA.name, force, force * (1. / objA.mass)))
-                        self._log.trace(self._ctx.t, 'Сила тяги для объекта  {0} = {1} | {2}'.format(objA.name, objA.force, objA.force * (1. / objA.mass)))
-                        objA.force = objA.force + force
-                                
+        if self._profiler is None:
+            self._engine.runStep(self._ctx)
+        else:
+            self._profiler.measure('runStep', self._engine.runStep, self._ctx)
+
+    def _integrateStep(self):
+        """Обновить скорости и координаты объектов"""
+        if self._profiler is None:
+            self._integrator.step(self._engine, self._ctx)
+        else:
+            self._profiler.measure('integrate', self._integrator.step, self._engine, self._ctx)
+
+    def _attemptStep(self, integrator, rtol, atol):
+        """Попытка шага адаптивным интегратором"""
+        if self._profiler is None:
+            return integrator.attempt(self._engine, self._ctx, rtol, atol)
+        return self._profiler.measure('integrate', integrator.attempt, self._engine, self._ctx, rtol, atol)
+
     def _endStep(self):
         """Завершить шаг расчета"""
-        for obj in self._objects:
-            obj.endStep(self._ctx)
+        if self._profiler is None:
+            self._engine.endStep(self._ctx)
+        else:
+            self._profiler.measure('endStep', self._engine.endStep, self._ctx)
+            self._profiler.stepDone(self._ctx)
 
         if self._ctx.putIntoHistory:
-            self._times.append(self._ctx.t)
\ No newline at end of file
+            self._times.append(self._ctx.t)
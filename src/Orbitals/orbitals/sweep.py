@@ -0,0 +1,136 @@
+﻿# -*- coding: utf-8 -*-
+import itertools
+import os
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import as_completed
+
+import numpy
+
+from orbitals.types import SpaceShip
+from orbitals.types import CollidedSpaceObjectController
+
+class SweepResult:
+    """Итоговые показатели одного расчета серии"""
+    def __init__(self, index, parameters):
+        self.index         = index      # Номер расчета в серии
+        self.parameters    = parameters # Параметры расчета
+        self.altitude      = None       # Конечная высота над поверхностью центрального тела, м
+        self.speed         = None       # Конечная скорость относительно центрального тела, м/с
+        self.collisionTime = None       # Время столкновения (None - столкновения не было), с
+        self.stopReason    = None       # Причина досрочного завершения расчета (Solver.stopReason)
+        self.fuelUsed      = 0.         # Масса сожженного топлива, кг
+        self.elapsed       = 0.         # Время расчета, с
+        self.history       = None       # История объектов {имя: {'t', 'x', 'y', 'vx', 'vy'}} (если сохранялась)
+        self.error         = None       # Текст ошибки (None - расчет выполнен)
+
+    def __repr__(self):
+        if self.error is not None:
+            return 'SweepResult({0}, {1}, error)'.format(self.index, self.parameters)
+        return 'SweepResult({0}, {1}, altitude = {2:.1f}, speed = {3:.1f}, collisionTime = {4}, fuelUsed = {5:.1f})'.format(
+            self.index, self.parameters, self.altitude, self.speed, self.collisionTime, self.fuelUsed)
+
+class Sweep:
+    """Серия расчетов по сетке параметров или по случайной выборке (метод Монте-Карло).
+       builder(**parameters) строит настроенный Solver; расчеты выполняются в пуле процессов,
+       поэтому builder должен быть функцией уровня модуля (передается в процессы через pickle).
+       target - имя объекта, для которого считаются показатели (по умолчанию - первый SpaceShip)
+    """
+    def __init__(self, builder, target = None):
+        self._builder = builder
+        self._target  = target
+
+    @staticmethod
+    def grid(**axes):
+        """Все сочетания значений параметров: grid(angle = [0, -4, -8], fuel = [...])"""
+        names = list(axes.keys())
+        return [dict(zip(names, values)) for values in itertools.product(*(axes[name] for name in names))]
+
+    @staticmethod
+    def sample(count, seed = None, **distributions):
+        """Случайная выборка из count наборов параметров.
+           Распределение задается функцией от numpy.random.Generator (напр. lambda random: random.normal(0, 1))
+           или диапазоном (low, high) для равномерного распределения
+        """
+        random = numpy.random.default_rng(seed)
+        result = []
+        for i in range(count):
+            parameters = {}
+            for name, distribution in distributions.items():
+                if callable(distribution):
+                    parameters[name] = distribution(random)
+                else:
+                    parameters[name] = float(random.uniform(*distribution))
+            result.append(parameters)
+        return result
+
+    def run(self, parameters, workers = None, keepHistory = ()):
+        """Выполнить расчеты для списка наборов parameters.
+           Результаты SweepResult возвращаются по мере завершения расчетов (генератор).
+           workers - число процессов (по умолчанию - число ядер),
+           keepHistory - номера расчетов, для которых сохраняется полная история объектов.
+           Выход из цикла по результатам (break, close()) отменяет расчеты, еще не начатые пулом
+        """
+        keep     = set(keepHistory)
+        executor = ProcessPoolExecutor(max_workers = workers or os.cpu_count())
+        try:
+            futures = [executor.submit(_runOne, self._builder, self._target, index, values, index in keep)
+                       for index, values in enumerate(parameters)]
+            for future in as_completed(futures):
+                yield future.result()
+        finally:
+            executor.shutdown(cancel_futures = True)
+
+    def runAll(self, parameters, workers = None, keepHistory = ()):
+        """Выполнить расчеты и вернуть результаты в порядке наборов parameters"""
+        return sorted(self.run(parameters, workers, keepHistory), key = lambda result: result.index)
+
+def _runOne(builder, target, index, parameters, keepHistory):
+    """Один расчет серии (выполняется в процессе пула)"""
+    result = SweepResult(index, parameters)
+    start  = time.perf_counter()
+    try:
+        solver = builder(**parameters)
+        solver.quiet = True
+        solver.run()
+        _measure(solver, target, result)
+        if keepHistory:
+            result.history = _history(solver)
+    except Exception:
+        result.error = traceback.format_exc()
+    result.elapsed = time.perf_counter() - start
+    return result
+
+def _measure(solver, target, result):
+    """Показатели объекта target по завершении расчета"""
+    objects = solver.objects
+    if target is None:
+        obj = next((obj for obj in objects if isinstance(obj, SpaceShip)), objects[0])
+    else:
+        obj = next(obj for obj in objects if obj.name == target)
+
+    # Центральное тело - самый массивный из остальных объектов
+    others  = [other for other in objects if other is not obj]
+    primary = max(others, key = lambda other: other.mass) if others else None
+    position, velocity = obj.position, obj.velocity
+    if primary is not None:
+        position = position - primary.position
+        velocity = velocity - primary.velocity
+    result.altitude = position.length - (primary.radius if primary is not None else 0.)
+    result.speed    = velocity.length
+
+    if isinstance(obj.controller, CollidedSpaceObjectController):
+        result.collisionTime = obj.controller.collisionTime
+    if isinstance(obj, SpaceShip):
+        result.fuelUsed = obj.fuelUsed
+    result.stopReason = solver.stopReason
+
+def _history(solver):
+    """Копия истории координат и скоростей объектов"""
+    history = {}
+    for obj in solver.objects:
+        position, velocity = obj.positionHistory, obj.velocityHistory
+        history[obj.name] = {'t':  numpy.array(position.ts), 'x':  numpy.array(position.xs), 'y':  numpy.array(position.ys),
+                             'vx': numpy.array(velocity.xs), 'vy': numpy.array(velocity.ys)}
+    return history
@@ -1,6 +1,7 @@
 ﻿# -*- coding: utf-8 -*-
 import math
 import sys
+import numpy
 
 max_count = 25;
 
@@ -69,4 +70,8 @@ class Formatter:
 
         return '{0:0.1f} м/с'.format(mass / 1E3)
 
-
+def expandRanges(first, counts):
+    """Диапазоны [first, first + counts), объединенные в один массив индексов"""
+    total   = int(counts.sum())
+    offsets = numpy.cumsum(counts) - counts
+    return numpy.arange(total) - numpy.repeat(offsets - first, counts)
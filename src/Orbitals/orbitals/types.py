@@ -1,41 +1,32 @@
 ﻿# -*- coding: utf-8 -*-
+import bisect
+import heapq
+import itertools
 import numpy
-import math
 
 from orbitals.basicTypes import Vector
 from orbitals.basicTypes import VectorWithHistory
+from orbitals.basicTypes import rotateXY
 from orbitals.tools      import Formatter
 
-def renderCircle(plot, position, radius, name = None, fill = False, color = None):
-    ts = [math.radians(x) for x in numpy.arange(0, 360, 1)]
-  
-    xs = [position.x + (100*1000 + radius) * math.cos(x) for x in ts]
-    ys = [position.y + (100*1000 + radius) * math.sin(x) for x in ts]
-
-    plot.plot(xs, ys, '.', color = 'red')
-
-    xs = [position.x + (200*1000 + radius) * math.cos(x) for x in ts]
-    ys = [position.y + (200*1000 + radius) * math.sin(x) for x in ts]
-
-    plot.plot(xs, ys, '.', color = 'red')
-
-    xs = [position.x + (300*1000 + radius) * math.cos(x) for x in ts]
-    ys = [position.y + (300*1000 + radius) * math.sin(x) for x in ts]
-
-    plot.plot(xs, ys, '.', color = 'red')
+_unitCircle = (numpy.cos(numpy.radians(numpy.arange(0, 360, 1))), numpy.sin(numpy.radians(numpy.arange(0, 360, 1)))) # Единичная окружность (360 точек)
+_ringOffsets = numpy.arange(1, 6)[:, numpy.newaxis] * (100*1000) # Кольца высот 100 - 500 км
 
-    xs = [position.x + (400*1000 + radius) * math.cos(x) for x in ts]
-    ys = [position.y + (400*1000 + radius) * math.sin(x) for x in ts]
+def circlePoints(radius):
+    """Точки окружности радиуса radius с центром в начале координат"""
+    return _unitCircle[0] * radius, _unitCircle[1] * radius
 
-    plot.plot(xs, ys, '.', color = 'red')
+def ringPoints(radius):
+    """Точки колец высот 100 - 500 км над поверхностью тела радиуса radius с центром в начале координат (одним массивом)"""
+    radii = _ringOffsets + radius
+    return (radii * _unitCircle[0]).ravel(), (radii * _unitCircle[1]).ravel()
 
-    xs = [position.x + (500*1000 + radius) * math.cos(x) for x in ts]
-    ys = [position.y + (500*1000 + radius) * math.sin(x) for x in ts]
-
-    plot.plot(xs, ys, '.', color = 'red')
+def renderCircle(plot, position, radius, name = None, fill = False, color = None):
+    xs, ys = ringPoints(radius)
+    plot.plot(xs + position.x, ys + position.y, '.', color = 'red')
 
-    xs = [position.x + radius * math.cos(x) for x in ts]
-    ys = [position.y + radius * math.sin(x) for x in ts]
+    xs, ys = circlePoints(radius)
+    xs, ys = xs + position.x, ys + position.y
 
     if color != None:
         p,  = plot.plot(xs, ys, label = name, color = color)
@@ -58,6 +49,13 @@ class SpaceObjectController:
         """Является ли данный объект участником динамического расчета"""
         return True
 
+    @property
+    def isActive(self):
+        """Участвует ли объект в шагах расчета (объекты, выбывшие из расчета, не обрабатываются
+           вычислительным ядром, их история завершена)
+        """
+        return True
+
     def attach(self, object):
         """Привязать контроллер к космическому объекту"""
         self._object      = object
@@ -65,16 +63,15 @@ class SpaceObjectController:
 
     def beginStep(self, ctx):
         """Обновление шага расчета"""
-        self._object.acceleration = Vector.zero
-        self._object.force        = Vector.zero
+        self._object.resetForces()
         self._clearDependents()
         self._beginStepCore(self._object, ctx)
 
     def endStep(self, ctx, isDependencyCall = False):
-        """Завершение шага расчета"""
-        self._object.acceleration = self._object.force * (1. / self._object.mass)
-        self._object.velocity     = self._object.velocity + self._object.acceleration * ctx.dt
-        self._object.position     = self._object.position + self._object.velocity * ctx.dt
+        """Завершение шага расчета.
+           Скорость и координаты объекта к этому моменту уже обновлены интегратором вычислителя
+        """
+        self._object.updateAcceleration()
         self._invokeDependents(ctx)
 
     def _beginStepCore(self, object, ctx):
@@ -115,8 +112,7 @@ class ChainedSpaceObjectController(SpaceObjectController):
 
     def beginStep(self, ctx):
         """Обновление шага расчета"""
-        self._object.acceleration = Vector.zero
-        self._object.force = Vector.zero
+        self._object.resetForces()
         self._clearDependents()
 
         # Вызываем предыдущий контроллер
@@ -138,8 +134,12 @@ class DynamicSpaceObjectController(ChainedSpaceObjectController):
                 
     def _beginStepCore(self, object, ctx):
         """Обновление шага расчета"""
-        for event in object.events:
-            event.apply(object, ctx)
+        profiler = ctx.profiler
+        for event in object.schedule.due(ctx.t):
+            if profiler is None:
+                event.apply(object, ctx)
+            else:
+                profiler.measureEvent(object, event, event.apply, object, ctx)
 
 class StaticSpaceObjectController(SpaceObjectController):
     """Контроллер для статического объекта"""
@@ -153,8 +153,7 @@ class StaticSpaceObjectController(SpaceObjectController):
         
     def beginStep(self, ctx):
         """Обновление шага расчета"""
-        self._object.acceleration = Vector.zero
-        self._object.force        = Vector.zero
+        self._object.resetForces()
         self._clearDependents()
     
     def endStep(self, ctx, isDependencyCall = False):
@@ -163,30 +162,97 @@ class StaticSpaceObjectController(SpaceObjectController):
 
 class CollidedSpaceObjectController(SpaceObjectController):
     """Контроллер для объекта, столкнувшегося с другим"""
-    def __init__(self, collider, relativePosition):
+    def __init__(self, collider, relativePosition, time = None):
         super().__init__()
         self._collider         = collider
         self._relativePosition = relativePosition
+        self._time             = time
+
+    @property
+    def collider(self):
+        """Объект, с которым столкнулся данный объект"""
+        return self._collider
+
+    @property
+    def carrier(self):
+        """Тело, вместе с которым движется объект (с учетом столкновений самого объекта collider).
+           Объект и тело образуют одно составное тело
+        """
+        collider = self._collider
+        while isinstance(collider.controller, CollidedSpaceObjectController):
+            collider = collider.controller.collider
+        return collider
+
+    @property
+    def collisionTime(self):
+        """Время столкновения (None - не задано)"""
+        return self._time
 
     @property
     def isAffectedByForces(self):
         """Является ли данный объект участником динамического расчета"""
         return False
+
+    @property
+    def isActive(self):
+        """Участвует ли объект в шагах расчета - объект выбыл из расчета, его положение определяется телом collider"""
+        return False
+
+    def follow(self):
+        """Перенести объект в точку тела, с которым он столкнулся (вне шагов расчета)"""
+        collider = self._collider
+        if isinstance(collider.controller, CollidedSpaceObjectController):
+            collider.controller.follow()
+        position, velocity = collider.currentPosition, collider.currentVelocity
+        self._object.setPositionXY(position.x + self._relativePosition.x, position.y + self._relativePosition.y)
+        self._object.setVelocityXY(velocity.x, velocity.y)
         
     def _beginStepCore(self, object, ctx):
         """Обновление шага расчета"""
-        self._object.acceleration = Vector.zero
-        self._object.force = Vector.zero
+        self._object.resetForces()
         self._clearDependents()
     
     def endStep(self, ctx, isDependencyCall = False):
         """Завершение шага расчета"""
         if isDependencyCall:
-            self._object.position = self._collider.position + self._relativePosition
+            position = self._collider.currentPosition
+            self._object.setPositionXY(position.x + self._relativePosition.x, position.y + self._relativePosition.y)
             self._invokeDependents(ctx)
         else:
             self._collider.controller.putDependent(ctx, self)
 
+class EscapedSpaceObjectController(SpaceObjectController):
+    """Контроллер для объекта, покинувшего область расчета (Solver.escapeRadius).
+       Объект выбывает из расчета и остается в точке выхода
+    """
+    def __init__(self, time = None):
+        super().__init__()
+        self._time = time
+
+    @property
+    def escapeTime(self):
+        """Время выхода из области расчета (None - не задано)"""
+        return self._time
+
+    @property
+    def isAffectedByForces(self):
+        """Является ли данный объект участником динамического расчета"""
+        return False
+
+    @property
+    def isActive(self):
+        """Участвует ли объект в шагах расчета"""
+        return False
+
+    def beginStep(self, ctx):
+        """Обновление шага расчета"""
+        self._object.resetForces()
+        self._clearDependents()
+
+    def endStep(self, ctx, isDependencyCall = False):
+        """Завершение шага расчета"""
+        self._invokeDependents(ctx)
+
 class SpaceObject:
     """Базовый класс космического объекта"""
 
@@ -199,6 +265,7 @@ class SpaceObject:
         self._force        = VectorWithHistory(name, "F")
         self._acceleration = VectorWithHistory(name, "a")
         self._isStatic     = False
+        self._isGravitySource = None
         self._controller   = None
 
         # Привязываем гравитационный контроллер
@@ -274,6 +341,63 @@ class SpaceObject:
         """История изменений суммарной силы"""
         return self._force.history
 
+    @property
+    def currentPosition(self):
+        """Координаты объекта для чтения во внутренних вычислениях (ссылку нельзя сохранять)"""
+        return self._position.current
+
+    @property
+    def currentVelocity(self):
+        """Скорость для чтения во внутренних вычислениях (ссылку нельзя сохранять)"""
+        return self._velocity.current
+
+    @property
+    def currentForce(self):
+        """Суммарная сила для чтения во внутренних вычислениях (ссылку нельзя сохранять)"""
+        return self._force.current
+
+    def setPositionXY(self, x, y):
+        """Задать координаты объекта без создания нового вектора"""
+        self._position.mutable().set(x, y)
+
+    def setVelocityXY(self, x, y):
+        """Задать скорость без создания нового вектора"""
+        self._velocity.mutable().set(x, y)
+
+    def setForceXY(self, x, y):
+        """Задать суммарную силу без создания нового вектора"""
+        self._force.mutable().set(x, y)
+
+    def setAccelerationXY(self, x, y):
+        """Задать ускорение без создания нового вектора"""
+        self._acceleration.mutable().set(x, y)
+
+    def resetForces(self):
+        """Обнулить суммарную силу и ускорение"""
+        self._force.mutable().set(0., 0.)
+        self._acceleration.mutable().set(0., 0.)
+
+    def addForce(self, x, y):
+        """Добавить силу (x, y) к суммарной силе"""
+        force = self._force.mutable()
+        force.set(force.x + x, force.y + y)
+
+    def updateAcceleration(self):
+        """Вычислить ускорение по суммарной силе"""
+        k     = 1. / self._mass
+        force = self._force.current
+        self._acceleration.mutable().set(force.x * k, force.y * k)
+
+    def accelerate(self, force, h):
+        """Обновить скорость под действием силы force на интервале h"""
+        k        = 1. / self._mass
+        velocity = self._velocity.mutable()
+        velocity.set(velocity.x + force.x * k * h, velocity.y + force.y * k * h)
+
+    def move(self, h):
+        """Обновить координаты по текущей скорости на интервале h"""
+        self._position.mutable().axpy(h, self._velocity.current)
+
     @property
     def isStatic(self):
         """Является ли объект статическим"""
@@ -282,6 +406,17 @@ class SpaceObject:
     def isStatic(self, isStatic):
         self._isStatic = isStatic
 
+    @property
+    def isGravitySource(self):
+        """Является ли объект источником гравитации: True - источник, False - пробная частица
+           (притягивается источниками, но сама ни на кого не действует), None - определяется по массе
+           объекта алгоритмом расчета гравитации (Solver.gravity)
+        """
+        return self._isGravitySource
+    @isGravitySource.setter
+    def isGravitySource(self, isGravitySource):
+        self._isGravitySource = isGravitySource
+
     @property
     def controller(self):
         """Контроллер объекта"""
@@ -292,16 +427,83 @@ class SpaceObject:
 
     def beginStep(self, ctx):
         """Инициализация шага расчета"""
-        self._controller.beginStep(ctx)
+        profiler = ctx.profiler
+        if profiler is None:
+            self._controller.beginStep(ctx)
+        else:
+            profiler.measureController(self._controller, self._controller.beginStep, ctx)
 
     def endStep(self, ctx):
         """Завершение шага расчета"""
-        self._controller.endStep(ctx)
+        profiler = ctx.profiler
+        if profiler is None:
+            self._controller.endStep(ctx)
+        else:
+            profiler.measureController(self._controller, self._controller.endStep, ctx)
         if ctx.putIntoHistory:
-            self._position.put(ctx.t)
-            self._velocity.put(ctx.t)
-            self._acceleration.put(ctx.t)
-            self._force.put(ctx.t)
+            self.putHistory(ctx.t)
+
+    def putHistory(self, t):
+        """Записать текущее состояние объекта в историю в момент времени t"""
+        self._position.put(t)
+        self._velocity.put(t)
+        self._acceleration.put(t)
+        self._force.put(t)
+
+    def finalizeHistory(self, t):
+        """Завершить историю объекта, выбывшего из расчета: последняя точка - состояние в момент t
+           (если точка с таким временем уже записана, история не дополняется), память под
+           незаписанные точки освобождается
+        """
+        history = self._position.history
+        if len(history) == 0 or history.ts[-1] < t:
+            self.putHistory(t)
+        for value in (self._position, self._velocity, self._acceleration, self._force):
+            value.history.trim()
+
+    def reserveHistory(self, count):
+        """Выделить память под count новых точек истории"""
+        for value in (self._position, self._velocity, self._acceleration, self._force):
+            value.history.reserve(count)
+
+    def attachHistory(self, storage):
+        """Подключить хранилище истории storage (HistoryStorage)"""
+        for value in (self._position, self._velocity, self._acceleration, self._force):
+            value.history.attach(storage)
+
+    def flushHistory(self):
+        """Дописать в файлы историю, накопленную в памяти (для истории в файлах)"""
+        for value in (self._position, self._velocity, self._acceleration, self._force):
+            value.history.flush()
+
+    def trimHistory(self):
+        """Освободить память, выделенную под незаписанные точки истории (расчет завершен досрочно)"""
+        for value in (self._position, self._velocity, self._acceleration, self._force):
+            value.history.trim()
+
+    @property
+    def historyBytes(self):
+        """Объем памяти, выделенной под историю объекта, байт"""
+        return sum(value.history.nbytes for value in (self._position, self._velocity, self._acceleration, self._force))
+
+    def thrust(self, velocity):
+        """Сила тяги объекта при скорости velocity (None - объект не создает тяги).
+           Используется интеграторами для пересчета внешних сил на промежуточных этапах шага
+        """
+        return None
+
+    @property
+    def massRate(self):
+        """Скорость расхода массы объекта, кг/с"""
+        return 0.
+
+    def saveState(self):
+        """Сохранить состояние объекта, изменяемое контроллерами в начале шага расчета"""
+        return self._mass
+
+    def restoreState(self, state):
+        """Восстановить состояние объекта, сохраненное saveState()"""
+        self._mass = state
 
     def renderStatic(self, plot):
         """Отрисовка объекта как статического тела"""
@@ -309,7 +511,8 @@ class SpaceObject:
 
     def renderDynamic(self, plot, index):
         """Отрисовка объекта как динамического тела в момент времени t[index]"""
-        position = Vector(self._position.history._xs[index], self._position.history._ys[index])
+        history  = self._position.history
+        position = Vector(history.xs[index], history.ys[index])
         return renderCircle(plot, position, self.radius, name = self.name, color = 'b')
 
 class SpaceShipControlEvent:
@@ -318,6 +521,38 @@ class SpaceShipControlEvent:
         self._end      = end
         self._isActive = False
 
+    @property
+    def start(self):
+        """Время начала события"""
+        return self._start
+
+    @property
+    def end(self):
+        """Время окончания события"""
+        return self._end
+
+    @property
+    def isActive(self):
+        """Активно ли событие на текущем шаге расчета"""
+        return self._isActive
+
+    @property
+    def massRate(self):
+        """Скорость расхода массы корабля, вызванного событием, кг/с"""
+        return 0.
+
+    def thrust(self, velocity):
+        """Сила тяги, создаваемая событием при скорости корабля velocity (None - событие не создает тяги)"""
+        return None
+
+    def saveState(self):
+        """Сохранить состояние события"""
+        return dict(self.__dict__)
+
+    def restoreState(self, state):
+        """Восстановить состояние события, сохраненное saveState()"""
+        self.__dict__.update(state)
+
     def apply(self, object, ctx):
         if self._start <= ctx.t and self._end > ctx.t:
             if not self._isActive:
@@ -341,26 +576,44 @@ class SpaceShipControlEvent:
 class BurnControlEvent(SpaceShipControlEvent):
     def __init__(self, force, fuelMass, start, end):
         super().__init__(start, end)
-        self._force    = force
-        self._fuelMass = fuelMass
-        self._duration = end - start
+        self._force      = force
+        self._fuelMass   = fuelMass
+        self._duration   = end - start
+        self._burnedFuel = 0.
+
+    @property
+    def burnedFuel(self):
+        """Масса сожженного топлива, кг"""
+        return self._burnedFuel
 
     def _applyCore(self, object, ctx):
         # Сжигаем часть топлива
         burnedFuel  = self._fuelMass * ctx.dt / self._duration
         object.mass = object.mass - burnedFuel
+        self._burnedFuel = self._burnedFuel + burnedFuel
 
         # Добавляем импульс двигателя
-        direction    = object.velocity.normalize()
-        force        = self._force.rotate(direction)
-        object.force = object.force + force
+        object.addForce(*self._thrustXY(object.currentVelocity))
+
+    @property
+    def massRate(self):
+        """Скорость расхода топлива, кг/с"""
+        return self._fuelMass / self._duration
+
+    def thrust(self, velocity):
+        """Сила тяги двигателя - направлена относительно вектора скорости"""
+        return Vector(*self._thrustXY(velocity))
+
+    def _thrustXY(self, velocity):
+        """Компоненты силы тяги двигателя при скорости velocity"""
+        return rotateXY(self._force.x, self._force.y, velocity.x, velocity.y)
         
     def _onStart(self, object, ctx):
-        ctx.log.info('Объект {0} - двигатель включен, тяга {1}'.format(object.name, Formatter.force(self._force.length)))
+        ctx.log.info('Объект {0} - двигатель включен, тяга {1}', object.name, Formatter.force(self._force.length))
         return
 
     def _onEnd(self, object, ctx):
-        ctx.log.info('Объект {0} - двигатель выключен'.format(object.name))
+        ctx.log.info('Объект {0} - двигатель выключен', object.name)
         return
 
 class StageSeparationControlEvent(SpaceShipControlEvent):
@@ -373,7 +626,7 @@ class StageSeparationControlEvent(SpaceShipControlEvent):
     def _applyCore(self, object, ctx):
         # Отделяем часть массы КА
         if not self._separated:
-            ctx.log.info('Объект {0} - отделение ступени {1} массой {2}'.format(object.name, self._name,  Formatter.mass(self._mass)))
+            ctx.log.info('Объект {0} - отделение ступени {1} массой {2}', object.name, self._name,  Formatter.mass(self._mass))
             self._separated = True
             object.mass     = object.mass - self._mass
 
@@ -383,12 +636,124 @@ class SpaceShipControlEventFactory:
     def stageSeparation(range, name = '?', mass = 0):
         return StageSeparationControlEvent(name, mass, range[0], range[1])
     
+class ControlEventSchedule:
+    """Расписание событий управления корабля.
+       События упорядочены по времени начала, курсор указывает на первое не начавшееся событие,
+       активные события хранятся в куче по времени окончания. На шаге расчета обрабатываются только
+       активные события и события, начинающиеся на этом шаге - завершенные и будущие события не проверяются.
+       Порядок применения событий на шаге - порядок их добавления, как при переборе всего списка
+    """
+    def __init__(self, events):
+        self._events  = events # События корабля в порядке добавления (SpaceShip.events)
+        self._count   = -1     # Число событий, для которого построено расписание
+        self._order   = []     # Номера событий по возрастанию времени начала
+        self._starts  = []     # Времена начала событий в порядке _order
+        self._cursor  = 0      # Позиция первого не начавшегося события в _order
+        self._active  = []     # Номера активных событий по возрастанию
+        self._ends    = []     # Куча (время окончания, номер) активных событий
+        self._initial = {}     # Состояния событий перед началом: {номер: состояние} (для restoreState)
+
+    def invalidate(self):
+        """Перестроить расписание по флагам активности событий (после изменения событий извне)"""
+        self._count = -1
+
+    def _rebuild(self):
+        """Построить расписание по списку событий"""
+        self._count   = len(self._events)
+        self._order   = sorted(range(self._count), key = lambda i: self._events[i].start)
+        self._starts  = [self._events[i].start for i in self._order]
+        self._cursor  = 0
+        self._active  = [i for i, event in enumerate(self._events) if event.isActive]
+        self._ends    = [(self._events[i].end, i) for i in self._active]
+        self._initial = {}
+        heapq.heapify(self._ends)
+
+    @property
+    def active(self):
+        """Активные события в порядке добавления"""
+        if len(self._events) != self._count:
+            self._rebuild()
+        return [self._events[i] for i in self._active]
+
+    def due(self, t):
+        """События, которые нужно применить на шаге, начинающемся в момент t: активные
+           (в т.ч. завершающиеся) и начинающиеся. События, начало и конец которых пропущены шагом, не применяются
+        """
+        if len(self._events) != self._count:
+            self._rebuild()
+        touched = list(self._active)
+        while self._ends and self._ends[0][0] <= t:
+            end, i = heapq.heappop(self._ends)
+            self._active.remove(i)
+
+        started = False
+        while self._cursor < self._count and self._starts[self._cursor] <= t:
+            i     = self._order[self._cursor]
+            event = self._events[i]
+            self._cursor = self._cursor + 1
+            if event.end > t and i not in touched:
+                self._initial[i] = event.saveState()
+                bisect.insort(self._active, i)
+                heapq.heappush(self._ends, (event.end, i))
+                touched.append(i)
+                started = True
+        if started:
+            touched.sort()
+        return [self._events[i] for i in touched]
+
+    def isIdle(self, t):
+        """Нет активных событий и событий, которые нужно начать на шаге, начинающемся в момент t"""
+        if len(self._events) != self._count:
+            self._rebuild()
+        if self._active:
+            return False
+        k = bisect.bisect_right(self._starts, t, self._cursor)
+        return all(self._events[self._order[j]].end <= t for j in range(self._cursor, k))
+
+    def nextBoundary(self, t):
+        """Ближайшая граница (начало или окончание) события после момента t"""
+        if len(self._events) != self._count:
+            self._rebuild()
+        result = float('inf')
+        # Первое событие, начинающееся после t - окончания более поздних событий не раньше его начала
+        k = bisect.bisect_right(self._starts, t, self._cursor)
+        if k < self._count:
+            result = self._starts[k]
+        # Окончания активных событий и событий, начавшихся до t, но еще не обработанных
+        for i in itertools.chain(self._active, (self._order[j] for j in range(self._cursor, k))):
+            end = self._events[i].end
+            if end > t and end < result:
+                result = end
+        return result
+
+    def saveState(self):
+        """Сохранить состояние расписания и активных событий"""
+        if len(self._events) != self._count:
+            self._rebuild()
+        return self._cursor, list(self._active), list(self._ends), [self._events[i].saveState() for i in self._active]
+
+    def restoreState(self, state):
+        """Восстановить состояние, сохраненное saveState(). События, начавшиеся после сохранения,
+           возвращаются в состояние перед началом
+        """
+        cursor, active, ends, states = state
+        for k in range(cursor, self._cursor):
+            initial = self._initial.pop(self._order[k], None)
+            if initial is not None:
+                self._events[self._order[k]].restoreState(initial)
+        self._cursor = cursor
+        self._active = list(active)
+        self._ends   = list(ends)
+        for i, eventState in zip(active, states):
+            self._events[i].restoreState(eventState)
+
 class SpaceShip(SpaceObject):
     """Космический корабль"""
 
     def __init__(self, name, mass, radius):
         super().__init__(name, mass, radius)
         self._events     = []
+        self._schedule   = ControlEventSchedule(self._events)
 
         # меняем контроллер на динамический
         DynamicSpaceObjectController().attach(self)
@@ -399,5 +764,39 @@ class SpaceShip(SpaceObject):
     def events(self):
         return self._events
 
+    @property
+    def schedule(self):
+        """Расписание событий управления"""
+        return self._schedule
+
     def addEvent(self, event):
-        self._events.append(event)
\ No newline at end of file
+        self._events.append(event)
+
+    def thrust(self, velocity):
+        """Суммарная сила тяги активных событий при скорости velocity"""
+        result = None
+        for event in self._schedule.active:
+            force = event.thrust(velocity)
+            if force is not None:
+                result = force if result is None else result + force
+        return result
+
+    @property
+    def massRate(self):
+        """Суммарная скорость расхода массы активных событий, кг/с"""
+        return sum(event.massRate for event in self._schedule.active)
+
+    @property
+    def fuelUsed(self):
+        """Масса топлива, сожженного двигателями, кг"""
+        return sum(event.burnedFuel for event in self._events if isinstance(event, BurnControlEvent))
+
+    def saveState(self):
+        """Сохранить состояние корабля и его событий"""
+        return super().saveState(), self._schedule.saveState()
+
+    def restoreState(self, state):
+        """Восстановить состояние корабля и его событий, сохраненное saveState()"""
+        mass, schedule = state
+        super().restoreState(mass)
+        self._schedule.restoreState(schedule)
\ No newline at end of file